@@ -1,63 +1,686 @@
+import argparse
+import array
+import sys
 import tkinter as tk
 from tkinter import ttk, messagebox
 import threading
 import time
+import os
+import json
+import csv
+import html
+import math
+import hashlib
+import functools
+import inspect
+import importlib.util
 from enum import Enum
-from dataclasses import dataclass
-from typing import List, Optional, Dict
+from dataclasses import dataclass, asdict, field, replace
+from types import MappingProxyType
+from typing import List, Optional, Dict, Tuple, Mapping, Any
 import queue
+import itertools
+import socket
+import socketserver
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-# Importar RoboDK 
-try:
-    from robodk.robolink import *
-    from robodk.robomath import *
-    ROBODK_AVAILABLE = True
-    print("RoboDK importado correctamente")
-except ImportError:
+# RoboDK se importa de forma diferida (al conectar) para mostrar la HMI de inmediato
+ROBODK_AVAILABLE = importlib.util.find_spec("robodk") is not None
+if not ROBODK_AVAILABLE:
     print("Error: RoboDK no está instalado o no se puede importar")
     print("Instala RoboDK Python API: pip install robodk")
-    ROBODK_AVAILABLE = False
+
+# Mismos valores que robodk.robolink
+ITEM_TYPE_FRAME = 3
+ITEM_TYPE_ROBOT = 2
+ITEM_TYPE_TARGET = 6
+ITEM_TYPE_PROGRAM = 8
+
+# Módulos de RoboDK, cargados por load_robodk()
+robolink = None
+robomath = None
+
+def load_robodk():
+    """Importa la API de RoboDK bajo demanda (una sola vez)"""
+    global robolink, robomath, ROBODK_AVAILABLE
+    if not ROBODK_AVAILABLE or robolink is not None:
+        return
+    try:
+        from robodk import robolink as robodk_robolink, robomath as robodk_robomath
+    except ImportError:
+        print("Error: RoboDK no está instalado o no se puede importar")
+        ROBODK_AVAILABLE = False
+        return
+    robolink, robomath = robodk_robolink, robodk_robomath
+    print("RoboDK importado correctamente")
+
+def create_robolink(port: Optional[int] = None):
+    """Crea la conexión con RoboDK (o con el mock si no está disponible); port elige la instancia"""
+    load_robodk()
+    if ROBODK_AVAILABLE:
+        return robolink.Robolink() if port is None else robolink.Robolink(port=port)
+    return MockRobolink()
+
+# Reloj del controlador: real por defecto; las simulaciones (load_test.py)
+# instalan uno virtual con set_clock() para correr horas en segundos
+class SystemClock:
+    """Reloj de pared"""
+
+    def time(self) -> float:
+        return time.time()
+
+    def sleep(self, seconds: float):
+        time.sleep(seconds)
+
+clock = SystemClock()
+
+def set_clock(new_clock):
+    """Reemplaza el reloj usado por el controlador, el robot simulado y el gripper"""
+    global clock
+    clock = new_clock
+
+# Clases Mock para desarrollo sin RoboDK
+# Robot simulado: la duración de cada movimiento sale de la distancia, el perfil
+# de velocidad/aceleración y el redondeo, para que los tiempos de ciclo sin
+# RoboDK se parezcan a los reales
+MOCK_DEFAULT_SPEED = 300.0         # mm/s
+MOCK_DEFAULT_ACCEL = 1000.0        # mm/s²
+MOCK_DEFAULT_JOINT_SPEED = 60.0    # °/s
+MOCK_DEFAULT_JOINT_ACCEL = 200.0   # °/s²
+MOCK_REACH_RADIUS = 600.0          # mm: radio equivalente para estimar giros de ejes sin articulaciones
+MOCK_CORNER_SAVING = 2 - math.pi / 2  # Fracción del radio de redondeo que se ahorra al cortar la esquina
+MOCK_LAYOUT_SLOTS = 8              # Posiciones de parrilla y entrega de la disposición aproximada
+
+# Tamaño de la celda (capacity_planner.py prueba otros con el robot simulado)
+GRILL_SLOTS = 4
+DELIVERY_SLOTS = 4
+
+def mock_station_layout() -> Dict[str, dict]:
+    """Disposición aproximada de la celda (mm y grados) para el robot simulado"""
+    layout = {"Home": [400, 0, 600, 180, 0, 0],
+              "Pos1_Estan1": [0, -450, 550, 180, 0, -90],
+              "Pos1_Estan2": [0, -450, 300, 180, 0, -90],
+              "Entrega1": [0, 450, 400, 180, 0, 90]}
+    for slot in range(1, 4):
+        x = -150 + 150 * (slot - 1)
+        layout[f"Estan1_{slot}_Agarre"] = [x, -600, 450, 180, 0, -90]
+        layout[f"Estan2_{slot}_Agarre"] = [x, -600, 200, 180, 0, -90]
+    for position in range(1, MOCK_LAYOUT_SLOTS + 1):
+        y = -225 + 150 * (position - 1)
+        layout[f"Parrilla_Pos{position}"] = [500, y, 300, 180, 0, 0]
+        layout[f"Parrilla_Arepa{position}"] = [500, y, 180, 180, 0, 0]
+        layout[f"Parrilla_Pos{position}_Giro"] = [500, y, 300, 180, 0, 180]
+        layout[f"Parrilla_Giro_Pos{position}"] = [500, y, 180, 180, 0, 180]
+        layout[f"Entrega_Pos{position}"] = [-225 + 150 * (position - 1), 600, 150, 180, 0, 90]
+    return {name: {"pose": pose, "joints": None} for name, pose in layout.items()}
+
+# Snapshot de la estación real (ver station_snapshot.py): si existe, el robot
+# simulado usa sus poses, marcos de referencia y límites articulares en lugar
+# de la disposición aproximada
+STATION_SNAPSHOT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "estacion_snapshot.json")
+STATION_SNAPSHOT_VERSION = 1
+
+def load_station_snapshot(path: str = STATION_SNAPSHOT_FILE) -> Optional[dict]:
+    """Lee un snapshot de estación; None si no existe o no es válido"""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Snapshot de estación ilegible ({path}): {str(e)}")
+        return None
+    if snapshot.get("version") != STATION_SNAPSHOT_VERSION:
+        print(f"⚠️ Snapshot de estación con versión {snapshot.get('version')} no soportada: {path}")
+        return None
+
+    station_file = os.path.join(os.path.dirname(os.path.abspath(path)), snapshot.get("station", ""))
+    if (snapshot.get("station_hash") and os.path.isfile(station_file)
+            and compute_file_hash(station_file) != snapshot["station_hash"]):
+        print(f"⚠️ El snapshot no corresponde a la versión actual de {snapshot['station']} "
+              f"(vuelve a ejecutar station_snapshot.py)")
+    return snapshot
+
+def trapezoid_time(distance: float, speed: float, accel: float,
+                   entry_speed: float = 0.0, exit_speed: float = 0.0) -> float:
+    """Tiempo de recorrer una distancia con perfil trapezoidal de velocidad"""
+    if distance <= 0:
+        return 0.0
+    entry_speed = min(entry_speed, speed)
+    exit_speed = min(exit_speed, speed)
+    ramp_distance = (2 * speed ** 2 - entry_speed ** 2 - exit_speed ** 2) / (2 * accel)
+    if ramp_distance <= distance:
+        return (distance - ramp_distance) / speed + (2 * speed - entry_speed - exit_speed) / accel
+    # Perfil triangular: no llega a la velocidad de crucero
+    peak = math.sqrt(max(accel * distance + (entry_speed ** 2 + exit_speed ** 2) / 2, 0.0))
+    return max((2 * peak - entry_speed - exit_speed) / accel, 0.0)
+
+def angle_difference(a: float, b: float) -> float:
+    """Diferencia angular mínima en grados"""
+    return abs((b - a + 180) % 360 - 180)
+
+class MockPose:
+    """Pose simulada: posición XYZ (mm), orientación (°) y articulaciones si se conocen"""
+
+    def __init__(self, values, joints=None):
+        self.values = [float(value) for value in values]
+        self.joints = list(joints) if joints is not None else None
+
+    def Pos(self):
+        return self.values[:3]
+
+    def interpolate(self, target: "MockPose", fraction: float) -> "MockPose":
+        """Pose intermedia (lineal) camino a target"""
+        values = [a + (b - a) * fraction for a, b in zip(self.values, target.values)]
+        joints = None
+        if self.joints is not None and target.joints is not None:
+            joints = [a + (b - a) * fraction for a, b in zip(self.joints, target.joints)]
+        return MockPose(values, joints)
+
+    def __repr__(self):
+        return f"MockPose({', '.join(f'{value:g}' for value in self.values)})"
+
+class MockRobolink:
+    """Estación simulada: targets {nombre: {"pose": [x,y,z,rx,ry,rz], "joints": [...] | None}},
+    marcos con el mismo formato y datos del robot (nombre y límites articulares)"""
+
+    def __init__(self, station: Optional[Dict[str, dict]] = None, frames: Optional[Dict[str, dict]] = None,
+                 robot: Optional[dict] = None):
+        if station is None:
+            snapshot = load_station_snapshot()
+            if snapshot is not None:
+                station, frames, robot = snapshot["targets"], snapshot.get("frames"), snapshot.get("robot")
+            else:
+                station = mock_station_layout()
+        self.station = station
+        self.frames = frames or {}
+        robot = robot or {}
+        self.robot = MockRobot(robot.get("name", "Robot_Mock"), self.station.get("Home"),
+                               robot.get("joint_lower"), robot.get("joint_upper"))
     
-    # Clases Mock para desarrollo sin RoboDK
-    ITEM_TYPE_ROBOT = 1
-    ITEM_TYPE_TARGET = 2
+    def Item(self, name, item_type):
+        if item_type == ITEM_TYPE_ROBOT:
+            return self.robot
+        if item_type == ITEM_TYPE_FRAME:
+            return MockItem(name, self.frames.get(name))
+        return MockItem(name, self.station.get(name))
     
-    class Robolink:
-        def Item(self, name, item_type):
-            return MockItem(name)
-        
-        def ItemUserPick(self, prompt, item_type):
-            return MockItem("Robot_Mock")
-        
-        def getOpenStations(self):
-            return ["Estacion_Mock"]
+    def ItemUserPick(self, prompt, item_type):
+        return self.robot
     
-    class MockItem:
-        def __init__(self, name):
-            self.name = name
-        
-        def Valid(self):
-            return True
-        
-        def Name(self):
-            return self.name
-        
-        def Pose(self):
-            return [0, 0, 0, 0, 0, 0]
-        
-        def MoveJ(self, pose):
-            time.sleep(0.5)  # Simular tiempo de movimiento
-            print(f"MOCK: Moviendo a {pose}")
+    def getOpenStations(self):
+        return ["Estacion_Mock"]
+    
+    def getParam(self, param):
+        return ""
+    
+    def Version(self):
+        return "mock"
+
+class MockItem:
+    """Target simulado"""
+
+    def __init__(self, name, entry: Optional[dict] = None):
+        self.name = name
+        self.entry = entry
+    
+    def Valid(self):
+        return self.entry is not None
+    
+    def Name(self):
+        return self.name
+    
+    def Pose(self):
+        if self.entry is None:
+            return None
+        return MockPose(self.entry["pose"], self.entry.get("joints"))
+
+class MockRobot(MockItem):
+    """Robot simulado con cinemática aproximada y recorrido acumulado"""
+
+    def __init__(self, name, home: Optional[dict] = None, joint_lower: Optional[List[float]] = None,
+                 joint_upper: Optional[List[float]] = None):
+        super().__init__(name, {"pose": [0, 0, 0, 0, 0, 0]})
+        self.pose = MockPose(home["pose"], home.get("joints")) if home else MockPose([0] * 6)
+        self.joint_lower = joint_lower  # ° (None = sin límites conocidos)
+        self.joint_upper = joint_upper
+        self.speed = MOCK_DEFAULT_SPEED
+        self.accel = MOCK_DEFAULT_ACCEL
+        self.joint_speed = MOCK_DEFAULT_JOINT_SPEED
+        self.joint_accel = MOCK_DEFAULT_JOINT_ACCEL
+        self.rounding = 0.0
+        self.carry_ratio = 0.0     # Fracción de la velocidad de crucero al salir del último punto de paso
+        self.path_length = 0.0     # mm recorridos por la herramienta
+        self.joint_travel = 0.0    # ° recorridos (eje más exigido de cada MoveJ)
+        self.motion_time = 0.0     # s en movimiento
+        self.move_count = 0
+        # Movimientos sin bloquear en curso o encolados: (desde, hasta, inicio, duración, mm)
+        self.queued: List[Tuple[MockPose, MockPose, float, float, float]] = []
+        self.busy_until = 0.0      # Hora del reloj en que termina el último movimiento encolado
+    
+    def Pose(self):
+        return self.pose
+    
+    def setSpeed(self, speed, speed_joints=-1, accel=-1, accel_joints=-1):
+        # -1 = mantener el valor actual (igual que RoboDK)
+        if speed > 0:
+            self.speed = speed
+        if speed_joints > 0:
+            self.joint_speed = speed_joints
+        if accel > 0:
+            self.accel = accel
+        if accel_joints > 0:
+            self.joint_accel = accel_joints
+    
+    def setRounding(self, rounding):
+        self.rounding = max(rounding, 0.0)
+    
+    def JointLimits(self):
+        return self.joint_lower, self.joint_upper
+    
+    def check_joint_limits(self, pose: MockPose):
+        """Rechaza un destino con articulaciones fuera de los límites del robot"""
+        if pose.joints is None or self.joint_lower is None or self.joint_upper is None:
+            return
+        for axis, (value, lower, upper) in enumerate(zip(pose.joints, self.joint_lower, self.joint_upper), 1):
+            if not lower <= value <= upper:
+                raise ValueError(f"Eje {axis} fuera de límites: {value:.1f}° (rango {lower:g}..{upper:g})")
+    
+    def cartesian_distance(self, pose: MockPose) -> float:
+        return math.dist(self.pose.Pos(), pose.Pos())
+    
+    def joint_distance(self, pose: MockPose) -> float:
+        """Giro (°) del eje más exigido; sin articulaciones se aproxima desde la pose"""
+        if self.pose.joints is not None and pose.joints is not None:
+            return max((abs(b - a) for a, b in zip(self.pose.joints, pose.joints)), default=0.0)
+        return max(math.degrees(self.cartesian_distance(pose) / MOCK_REACH_RADIUS), self.orientation_change(pose))
+    
+    def move(self, pose: Optional[MockPose], axes: List[Tuple[float, float, float]], blocking: bool) -> float:
+        """Ejecuta el movimiento simulado y devuelve su duración
+
+        axes: (distancia, velocidad, aceleración) de cada magnitud que limita el
+        movimiento; la más lenta marca la duración. Como en RoboDK, sin bloquear
+        el movimiento se encola tras los anteriores y Busy() sigue activo hasta que termina.
+        """
+        if pose is None:
+            raise ValueError("Target desconocido en la estación simulada")
+        self.check_joint_limits(pose)
         
-        def MoveL(self, pose):
-            time.sleep(0.4)  # Simular tiempo de movimiento lineal
-            print(f"MOCK: Movimiento lineal a {pose}")
+        # Un punto de paso con redondeo corta la esquina y no frena hasta cero
+        distance = self.cartesian_distance(pose)
+        blending = not blocking and self.rounding > 0
+        shortened = 1.0
+        if blending and distance > 0:
+            shortened = 1 - MOCK_CORNER_SAVING * min(self.rounding, distance / 2) / distance
+        exit_ratio = 1.0 if blending else 0.0
+        duration = max((trapezoid_time(length * shortened, speed, accel,
+                                       self.carry_ratio * speed, exit_ratio * speed)
+                        for length, speed, accel in axes), default=0.0)
         
-        def setSpeed(self, speed):
-            print(f"MOCK: Velocidad establecida a {speed}")
+        now = clock.time()
+        start = max(now, self.busy_until)
+        target = MockPose(pose.values, pose.joints)
+        self.queued = [move for move in self.queued if move[2] + move[3] > now]
+        self.queued.append((self.pose, target, start, duration, distance * shortened))
+        self.busy_until = start + duration
         
-        def setRounding(self, rounding):
-            print(f"MOCK: Redondeo establecido a {rounding}")
+        self.carry_ratio = exit_ratio
+        self.path_length += distance * shortened
+        self.motion_time += duration
+        self.move_count += 1
+        self.pose = target
+        if blocking:
+            clock.sleep(self.busy_until - now)
+        return duration
+    
+    def orientation_change(self, pose: MockPose) -> float:
+        return max(angle_difference(a, b) for a, b in zip(self.pose.values[3:], pose.values[3:]))
+    
+    def MoveL(self, pose, blocking=True):
+        if pose is None:
+            return self.move(None, [], blocking)
+        # La reorientación de la herramienta también limita (a velocidad articular)
+        return self.move(pose, [(self.cartesian_distance(pose), self.speed, self.accel),
+                                (self.orientation_change(pose), self.joint_speed, self.joint_accel)], blocking)
+    
+    def MoveJ(self, pose, blocking=True):
+        if pose is None:
+            return self.move(None, [], blocking)
+        angle = self.joint_distance(pose)
+        self.joint_travel += angle
+        return self.move(pose, [(angle, self.joint_speed, self.joint_accel)], blocking)
+    
+    def Stop(self):
+        """Detiene los movimientos sin bloquear donde van (uno bloqueante termina en su duración)"""
+        now = clock.time()
+        stopped_at = None
+        for origin, target, start, duration, length in self.queued:
+            if now >= start + duration:
+                continue
+            fraction = max(now - start, 0.0) / duration if duration > 0 else 0.0
+            if stopped_at is None:
+                stopped_at = origin.interpolate(target, fraction)
+            self.path_length -= length * (1 - fraction)
+            self.motion_time -= duration * (1 - fraction)
+        if stopped_at is not None:
+            self.pose = stopped_at
+        self.queued = []
+        self.busy_until = min(self.busy_until, now)
+        self.carry_ratio = 0.0
+
+    def Busy(self):
+        return 1 if clock.time() < self.busy_until else 0
+
+    def motion_summary(self) -> str:
+        """Resumen del recorrido acumulado"""
+        return (f"{self.move_count} movimientos, {self.path_length / 1000:.2f} m, "
+                f"{self.joint_travel:.0f}° de ejes, {self.motion_time:.1f} s en movimiento")
+
+# Gripper electroneumático (E/S digitales del robot)
+GRIPPER_DO_CLOSE = 1           # Salida digital de la electroválvula (1 = cerrar)
+GRIPPER_DI_CLOSED = 1          # Entrada de confirmación "cerrado" (None = sin sensor)
+GRIPPER_DI_OPEN = 2            # Entrada de confirmación "abierto" (None = sin sensor)
+GRIPPER_MIN_DWELL = 0.3        # s mínimos con la válvula conmutada
+GRIPPER_BLIND_DWELL = 1.0      # s por acción sin sensores ni min_dwell configurado (el tiempo fijo original)
+GRIPPER_CONFIRM_TIMEOUT = 2.0  # s máximos esperando la confirmación
+GRIPPER_SIM_ACTUATION = 0.25   # s de actuación del gripper simulado
+GRIPPER_POLL_PERIOD = 0.01     # s entre lecturas de la entrada
+
+class GripperError(Exception):
+    """El gripper no confirmó la operación a tiempo"""
+
+class SimulatedGripperIO:
+    """Sustituto local de las E/S del robot: la confirmación sigue a la salida tras el tiempo de actuación"""
+
+    def __init__(self, do_close: int = GRIPPER_DO_CLOSE, di_closed: Optional[int] = GRIPPER_DI_CLOSED,
+                 di_open: Optional[int] = GRIPPER_DI_OPEN, actuation_time: float = GRIPPER_SIM_ACTUATION):
+        self.do_close = do_close
+        self.di_closed = di_closed
+        self.di_open = di_open
+        self.actuation_time = actuation_time
+        self.outputs: Dict[int, str] = {}
+        self.changed_at = 0.0
+
+    def setDO(self, io_var, io_value):
+        self.outputs[io_var] = str(io_value)
+        self.changed_at = clock.time()
+
+    def getDI(self, io_var) -> str:
+        closed = self.outputs.get(self.do_close, "0") == "1"
+        settled = clock.time() - self.changed_at >= self.actuation_time
+        if io_var == self.di_closed:
+            return "1" if closed and settled else "0"
+        if io_var == self.di_open:
+            return "1" if not closed and settled else "0"
+        return "0"
+
+class PneumaticGripper:
+    """Gripper electroneumático: conmuta una salida digital y espera la confirmación o el tiempo mínimo"""
+
+    def __init__(self, io, do_close: int = GRIPPER_DO_CLOSE, di_closed: Optional[int] = GRIPPER_DI_CLOSED,
+                 di_open: Optional[int] = GRIPPER_DI_OPEN, min_dwell: float = GRIPPER_MIN_DWELL,
+                 confirm_timeout: float = GRIPPER_CONFIRM_TIMEOUT):
+        self.io = io                  # Item robot de RoboDK o SimulatedGripperIO
+        self.do_close = do_close
+        self.di_closed = di_closed
+        self.di_open = di_open
+        self.min_dwell = min_dwell
+        self.confirm_timeout = confirm_timeout
+        self.operations = 0
+        self.mean_duration = 0.0
+
+    def grasp(self) -> float:
+        """Cierra el gripper; devuelve el tiempo que tardó"""
+        return self.actuate(True, self.di_closed)
+
+    def release(self) -> float:
+        """Abre el gripper; devuelve el tiempo que tardó"""
+        return self.actuate(False, self.di_open)
+
+    def actuate(self, close: bool, confirm_input: Optional[int]) -> float:
+        """Conmuta la válvula y espera confirmación y/o el tiempo mínimo"""
+        start = clock.time()
+        self.io.setDO(self.do_close, 1 if close else 0)
+
+        if confirm_input is not None:
+            deadline = start + self.confirm_timeout
+            while not self.input_active(confirm_input):
+                if clock.time() >= deadline:
+                    action = "cierre" if close else "apertura"
+                    raise GripperError(f"Sin confirmación de {action} (DI{confirm_input}) en {self.confirm_timeout:.1f}s")
+                clock.sleep(GRIPPER_POLL_PERIOD)
+
+        remaining = self.min_dwell - (clock.time() - start)
+        if remaining > 0:
+            clock.sleep(remaining)
+
+        duration = clock.time() - start
+        self.operations += 1
+        self.mean_duration += (duration - self.mean_duration) / self.operations
+        return duration
+
+    def input_active(self, io_var: int) -> bool:
+        """Lee una entrada digital"""
+        return str(self.io.getDI(io_var)).strip() in ("1", "1.0", "True", "true")
+
+    def expected_duration(self) -> float:
+        """Duración esperada de una operación (media medida o tiempo mínimo)"""
+        return self.mean_duration if self.operations else max(self.min_dwell, GRIPPER_SIM_ACTUATION)
+
+# Supervisión de la conexión con RoboDK
+HEARTBEAT_INTERVAL = 1.0        # s entre heartbeats
+RECONNECT_BACKOFF_MIN = 0.5     # s
+RECONNECT_BACKOFF_MAX = 10.0    # s
+
+class ConnectionSupervisor:
+    """Vigila la API de RoboDK con heartbeats y reconecta con backoff exponencial"""
+
+    def __init__(self, controller, interval: float = HEARTBEAT_INTERVAL):
+        self.controller = controller
+        self.interval = interval
+        self.connected = threading.Event()
+        self.connected.set()
+        self.stop_event = threading.Event()
+        self.heartbeat_lock = threading.Lock()
+        self.heartbeat_link = None   # Conexión propia: no comparte el socket con los movimientos
+        self.thread: Optional[threading.Thread] = None
+        self.disconnections = 0
+
+    def start(self):
+        """Inicia el hilo de supervisión (una sola vez)"""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """Detiene la supervisión"""
+        self.stop_event.set()
+
+    def heartbeat(self) -> bool:
+        """Consulta la API de RoboDK; False si no responde"""
+        with self.heartbeat_lock:
+            try:
+                if self.heartbeat_link is None:
+                    self.heartbeat_link = create_robolink(self.controller.robodk_port)
+                self.heartbeat_link.Version()
+                return True
+            except Exception:
+                self.heartbeat_link = None
+                return False
+
+    def check_now(self) -> bool:
+        """Heartbeat inmediato; marca la conexión como perdida si falla"""
+        if self.heartbeat():
+            return True
+        self.mark_lost()
+        return False
+
+    def mark_lost(self):
+        """Registra la pérdida de conexión (una vez por desconexión)"""
+        if self.connected.is_set():
+            self.connected.clear()
+            self.disconnections += 1
+            self.controller.on_connection_lost()
+
+    def wait_connected(self, timeout: Optional[float] = None) -> bool:
+        """Espera a que la conexión esté disponible"""
+        return self.connected.wait(timeout)
+
+    def run(self):
+        """Bucle de heartbeat y reconexión"""
+        backoff = RECONNECT_BACKOFF_MIN
+        while not self.stop_event.is_set():
+            if self.connected.is_set():
+                if not self.heartbeat():
+                    self.mark_lost()
+                    continue
+                self.stop_event.wait(self.interval)
+            elif self.heartbeat() and self.controller.reconnect_robot():
+                backoff = RECONNECT_BACKOFF_MIN
+                self.connected.set()
+                self.controller.on_connection_restored()
+            else:
+                self.controller.update_status(f"Sin conexión con RoboDK - reintento en {backoff:.1f}s")
+                self.stop_event.wait(backoff)
+                backoff = min(backoff * 2, RECONNECT_BACKOFF_MAX)
+
+# Configuración persistente entre arranques (robot elegido, etc.)
+SETTINGS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config_arepas.json")
+
+def load_settings() -> dict:
+    """Lee la configuración guardada (vacía si no existe)"""
+    try:
+        with open(SETTINGS_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_settings(settings: dict):
+    """Guarda la configuración"""
+    with open(SETTINGS_FILE, "w", encoding="utf-8") as f:
+        json.dump(settings, f, indent=2)
+
+# Trazas de ejecución en formato Chrome trace-event (chrome://tracing o ui.perfetto.dev)
+TRACE_ENV_VAR = "AREPAS_TRACE"   # Ruta del archivo de trazas; sin definir = trazas desactivadas
+
+class Span:
+    """Intervalo abierto de la traza; se cierra al salir del bloque with"""
+    __slots__ = ("tracer", "name", "category", "attributes", "start")
+
+    def __init__(self, tracer: "SpanTracer", name: str, category: str, attributes: dict):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.attributes = attributes
+        self.start = 0.0
+
+    def set(self, **attributes):
+        """Agrega atributos conocidos después de abrir el span"""
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        self.tracer.add(self.name, self.category, self.start, time.perf_counter(), self.attributes)
+        return False
+
+class NullSpan:
+    """Span vacío para cuando las trazas están desactivadas"""
+    __slots__ = ()
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+NULL_SPAN = NullSpan()
+
+class SpanTracer:
+    """Registra spans anidados por hilo y los exporta como eventos completos ("X") de Chrome"""
+
+    def __init__(self):
+        self.enabled = False
+        self.events: List[dict] = []
+        self.thread_names: Dict[int, str] = {}
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+
+    def enable(self):
+        """Activa las trazas y descarta las anteriores"""
+        with self.lock:
+            self.events = []
+            self.thread_names = {}
+            self.origin = time.perf_counter()
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def span(self, name: str, category: str = "control", **attributes):
+        """Abre un span (no hace nada si las trazas están desactivadas)"""
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, category, attributes)
+
+    def add(self, name: str, category: str, start: float, end: float, attributes: dict):
+        """Guarda un span terminado"""
+        thread = threading.current_thread()
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": (start - self.origin) * 1e6,
+            "dur": (end - start) * 1e6,
+            "pid": os.getpid(),
+            "tid": thread.ident,
+            "args": {key: value for key, value in attributes.items() if value is not None}
+        }
+        with self.lock:
+            self.events.append(event)
+            self.thread_names.setdefault(thread.ident, thread.name)
+
+    def export(self, path: str) -> int:
+        """Escribe la traza en formato Chrome trace-event; devuelve el número de spans"""
+        with self.lock:
+            events = list(self.events)
+            metadata = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid,
+                         "args": {"name": name}} for tid, name in self.thread_names.items()]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": metadata + events, "displayTimeUnit": "ms"}, f)
+        return len(events)
+
+tracer = SpanTracer()
+
+def traced(category: str = "control", name: Optional[str] = None, **arg_attributes):
+    """Decorador: abre un span alrededor de la llamada
+
+    arg_attributes relaciona cada atributo del span con el argumento del que
+    sale, p. ej. @traced("motion", target="target_name"). Con las trazas
+    desactivadas solo cuesta una comprobación.
+    """
+    def decorator(func):
+        span_name = name or func.__name__
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+            arguments = signature.bind(*args, **kwargs).arguments
+            attributes = {attribute: arguments.get(argument) for attribute, argument in arg_attributes.items()}
+            with tracer.span(span_name, category, **attributes):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
 
 class ArepaState(Enum):
     IDLE = "idle"                    # En bandeja de selección
@@ -72,111 +695,1601 @@ class ArepaState(Enum):
     DELIVERED = "delivered"          # Entregada
     ERROR = "error"                  # Error en el proceso
 
-@dataclass
-class ArepaInfo:
-    id: str                          # A1, A2, A3, B1, B2, B3
-    name: str                        # "Arepa de Queso", etc.
-    state: ArepaState = ArepaState.IDLE
-    grill_position: Optional[int] = None  # Posición en parrilla (1-4)
-    cook_start_time: Optional[float] = None
-    flip_time: Optional[float] = None
-    delivery_time: Optional[float] = None
-    selection_order: Optional[int] = None  # Orden de selección
+@dataclass(frozen=True)
+class ArepaInfo:
+    id: str                          # A1, A2, A3, B1, B2, B3
+    name: str                        # "Arepa de Queso", etc.
+    state: ArepaState = ArepaState.IDLE
+    grill_position: Optional[int] = None  # Posición en parrilla (1-4)
+    cook_start_time: Optional[float] = None
+    flip_time: Optional[float] = None
+    delivery_time: Optional[float] = None
+    selection_order: Optional[int] = None  # Orden de selección
+    transitions: Tuple[Tuple[ArepaState, float], ...] = ()  # (estado, hora) de cada cambio de estado
+
+@dataclass
+class MoveStep:
+    target: str                      # Nombre del target en RoboDK
+    description: str                 # Texto para el log
+    move_type: str = "L"             # "L" = MoveL, "J" = MoveJ, "ROT" = rotación en Z
+    action: Optional[str] = None     # "grasp" / "release" al llegar al target
+    action_message: str = ""         # Texto para el log de la acción
+    fly_by: bool = False             # Punto de paso (holgura): se atraviesa con redondeo sin detenerse
+    profile: str = "empty"           # Clase de segmento para velocidad/aceleración (DEFAULT_MOTION_PROFILES)
+
+@dataclass
+class CycleStage:
+    name: str                        # Nombre del programa nativo (NATIVE_PROGRAM_PREFIX + ...)
+    kind: str                        # "transport" / "flip" / "delivery" / "home"
+    steps: List[MoveStep]
+    arepa_id: Optional[str] = None   # Producto (perfiles de velocidad)
+    return_target: Optional[str] = None  # Regreso sin carga al terminar (tolerante a fallos desde el PC)
+
+    @property
+    def program_steps(self) -> List[MoveStep]:
+        """Pasos del programa nativo: la secuencia más el regreso, sin pasar por el PC entre medio"""
+        if self.return_target is None:
+            return list(self.steps)
+        return self.steps + [MoveStep(self.return_target, f"→ {self.return_target} (regreso)")]
+
+@dataclass
+class OrderInfo:
+    order_id: str                    # P00001, P00002, ...
+    items: List[str]                 # Productos pedidos: nombre o ID de estante como alias (A1, B2, ...)
+    status: str = "queued"           # queued / cooking / delivered / error
+    created: float = 0.0
+    started: Optional[float] = None
+    completed: Optional[float] = None
+    eta: Optional[float] = None      # Hora estimada de entrega (epoch)
+    source: str = "pos"              # Origen del pedido
+    slots: List[str] = field(default_factory=list)  # Posiciones de estante asignadas al armar el lote
+
+# Estado de la celda con un solo dueño: el hilo del actor aplica los comandos
+# en orden desde su buzón y publica snapshots inmutables para los lectores
+@dataclass(frozen=True)
+class CellSnapshot:
+    version: int                                          # Sube con cada comando aplicado
+    arepas: Mapping[str, ArepaInfo]
+    grill_positions: Tuple[Optional[str], ...]            # Arepa en cada posición de parrilla
+    grill_timers: Tuple[Optional[Mapping[str, Any]], ...]  # start_time / duration / side / arepa_id
+    delivery_positions: Tuple[Optional[str], ...]         # Arepa en cada posición de entrega
+
+class CellStateActor:
+    """Dueño único de parrilla, timers, entregas y estado de cada arepa
+
+    Los demás hilos no modifican nada directamente: envían comandos con ask()
+    (esperan el resultado) o tell() y leen el último snapshot sin bloqueos.
+    Las transiciones son los métodos cmd_*: reciben la hora como argumento,
+    así que el resultado depende solo del orden de los comandos.
+    """
+
+    def __init__(self, arepas: Dict[str, ArepaInfo], grill_slots: int = 4, delivery_slots: int = 4):
+        self.initial_arepas = dict(arepas)
+        self.arepas = dict(arepas)
+        self.grill: List[Optional[str]] = [None] * grill_slots
+        self.timers: List[Optional[Mapping[str, Any]]] = [None] * grill_slots
+        self.delivery: List[Optional[str]] = [None] * delivery_slots
+        self.version = 0
+        self.snapshot = self.build_snapshot()
+        self.mailbox: "queue.Queue[tuple]" = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name="EstadoCelda", daemon=True)
+        self.thread.start()
+
+    def build_snapshot(self) -> CellSnapshot:
+        return CellSnapshot(self.version, MappingProxyType(dict(self.arepas)), tuple(self.grill),
+                            tuple(self.timers), tuple(self.delivery))
+
+    def run(self):
+        """Bucle del actor: un comando a la vez, snapshot nuevo después de cada uno"""
+        while True:
+            command, args, kwargs, reply = self.mailbox.get()
+            if command is None:
+                break
+            try:
+                result, error = self.apply(command, *args, **kwargs), None
+            except Exception as e:
+                result, error = None, e
+            if reply is not None:
+                reply.put((result, error))
+
+    def apply(self, command: str, *args, **kwargs):
+        """Aplica un comando y publica el snapshot resultante (solo desde el hilo del actor)"""
+        try:
+            return getattr(self, f"cmd_{command}")(*args, **kwargs)
+        finally:
+            self.version += 1
+            self.snapshot = self.build_snapshot()
+
+    def ask(self, command: str, *args, **kwargs):
+        """Envía un comando y espera su resultado (relanza sus excepciones)"""
+        if threading.current_thread() is self.thread:
+            return self.apply(command, *args, **kwargs)
+        reply: "queue.Queue[tuple]" = queue.Queue(maxsize=1)
+        self.mailbox.put((command, args, kwargs, reply))
+        result, error = reply.get()
+        if error is not None:
+            raise error
+        return result
+
+    def tell(self, command: str, *args, **kwargs):
+        """Envía un comando sin esperar"""
+        self.mailbox.put((command, args, kwargs, None))
+
+    def stop(self):
+        self.mailbox.put((None, (), {}, None))
+
+    def update_arepa(self, arepa_id: str, at: Optional[float] = None, **fields):
+        """Reemplaza campos de una arepa; los cambios de estado quedan en transitions con su hora"""
+        arepa = self.arepas[arepa_id]
+        state = fields.get("state")
+        if state is not None and state != arepa.state:
+            fields["transitions"] = arepa.transitions + ((state, clock.time() if at is None else at),)
+        self.arepas[arepa_id] = replace(arepa, **fields)
+
+    # --- Transiciones ---
+
+    def cmd_set_state(self, arepa_id: str, state: ArepaState, at: Optional[float] = None):
+        self.update_arepa(arepa_id, at, state=state)
+
+    def cmd_set_selection(self, arepa_ids: List[str]):
+        """Orden de selección (1..n) de las arepas elegidas; None para las demás"""
+        for arepa_id in self.arepas:
+            order = arepa_ids.index(arepa_id) + 1 if arepa_id in arepa_ids else None
+            self.update_arepa(arepa_id, selection_order=order)
+
+    def cmd_assign_grill(self, arepa_id: str, preferred: Optional[int] = None,
+                         blocked: Tuple[int, ...] = ()) -> Optional[int]:
+        """Reserva la posición preferida (por defecto la del orden de selección) o la primera libre
+
+        Las posiciones en blocked (en cuarentena) nunca se asignan.
+        """
+        if self.arepas[arepa_id].selection_order is None:
+            return None
+        if preferred is None:
+            preferred = self.arepas[arepa_id].selection_order
+        free = [i + 1 for i, occupant in enumerate(self.grill) if occupant is None and i + 1 not in blocked]
+        if preferred in free:
+            position = preferred
+        elif free:
+            position = free[0]
+        else:
+            return None
+        self.grill[position - 1] = arepa_id
+        self.update_arepa(arepa_id, grill_position=position)
+        return position
+
+    def cmd_start_timer(self, position: int, side: int, duration: float, at: float) -> Optional[str]:
+        """Empieza a cocinar un lado: timer de la posición y estado de la arepa a la vez"""
+        arepa_id = self.grill[position - 1]
+        if arepa_id is None:
+            return None
+        self.timers[position - 1] = MappingProxyType(
+            {'start_time': at, 'duration': duration, 'side': side, 'arepa_id': arepa_id})
+        if side == 1:
+            self.update_arepa(arepa_id, at, state=ArepaState.COOKING_SIDE1, cook_start_time=at)
+        else:
+            self.update_arepa(arepa_id, at, state=ArepaState.COOKING_SIDE2, flip_time=at)
+        return arepa_id
+
+    def cmd_deliver(self, arepa_id: str, grill_position: int, delivery_position: int, at: float):
+        """Arepa entregada: libera su posición de parrilla y ocupa la de entrega"""
+        self.update_arepa(arepa_id, at, state=ArepaState.DELIVERED, delivery_time=at)
+        self.grill[grill_position - 1] = None
+        self.timers[grill_position - 1] = None
+        self.delivery[delivery_position - 1] = arepa_id
+
+    def cmd_fail(self, arepa_id: str, release_grill: bool):
+        """Arepa en error: se detiene su timer y, si no llegó a la parrilla, se libera su posición"""
+        position = self.arepas[arepa_id].grill_position
+        self.update_arepa(arepa_id, state=ArepaState.ERROR)
+        if position is not None and self.grill[position - 1] == arepa_id:
+            self.timers[position - 1] = None
+            if release_grill:
+                self.grill[position - 1] = None
+
+    def cmd_clear_deliveries(self):
+        self.delivery = [None] * len(self.delivery)
+
+    def cmd_clear_arepa(self, arepa_id: str):
+        """Devuelve una arepa a su estado inicial"""
+        self.arepas[arepa_id] = self.initial_arepas[arepa_id]
+
+    def cmd_reset(self):
+        """Vacía parrilla, timers y entregas y reinicia todas las arepas"""
+        self.arepas = dict(self.initial_arepas)
+        self.grill = [None] * len(self.grill)
+        self.timers = [None] * len(self.timers)
+        self.delivery = [None] * len(self.delivery)
+
+# Servidor local de pedidos (integración con punto de venta)
+ORDER_SERVER_HOST = "127.0.0.1"
+ORDER_SERVER_PORT = 8765
+ORDER_QUEUE_SIZE = 20      # Pedidos en espera antes de rechazar con 503
+ORDER_POLL_MS = 500        # Periodo de revisión de la cola desde la HMI
+SHELF_UNITS_PER_SLOT = 1   # Arepas por posición de estantería
+SHELF_LOW_WATER = 0        # Unidades con las que una posición pide reposición
+
+# Aislamiento de fallas por arepa (config_arepas.json: "fault_handling")
+STAGE_ATTEMPTS = 3         # Intentos por etapa ante fallas de movimiento o gripper
+STAGE_RETRY_BACKOFF = 1.0  # s antes del segundo intento; se duplica en cada reintento
+
+# Posicionamiento anticipado (config_arepas.json: "staging"): mientras todo cocina,
+# el robot espera sobre la aproximación de la próxima acción de parrilla
+STAGING_MARGIN = 1.0       # s de holgura entre la llegada estimada y el vencimiento
+STAGING_POLL_PERIOD = 0.05 # s entre consultas durante el movimiento (para poder cancelarlo)
+COOKING_POLL_PERIOD = 0.5  # s entre revisiones de los timers de parrilla
+
+@dataclass
+class ShelfSlot:
+    slot_id: str                     # A1, A2, A3, B1, B2, B3
+    product: str                     # "Arepa de Queso", etc.
+    capacity: int = SHELF_UNITS_PER_SLOT
+    units: int = SHELF_UNITS_PER_SLOT
+    low_water: int = SHELF_LOW_WATER  # Pide reposición al bajar a este nivel
+
+class ShelfInventory:
+    """Existencias de la estantería: unidades por posición e índice producto → posiciones
+
+    Los pedidos reservan unidades por producto al llegar (contadores por
+    producto, sin recorrer la estantería); al armar el lote cada unidad se
+    asigna a la posición no vacía más cercana de su producto y se descuenta
+    cuando el robot la toma. No tiene candado propio: el controlador lo usa
+    con orders_lock tomado.
+    """
+
+    def __init__(self, slots: List[ShelfSlot]):
+        self.slots: Dict[str, ShelfSlot] = {slot.slot_id: slot for slot in slots}
+        self.by_product: Dict[str, List[str]] = {}  # Posiciones de cada producto, de la más cercana a la más lejana
+        for slot in slots:
+            self.by_product.setdefault(slot.product, []).append(slot.slot_id)
+        self.units = Counter()     # Unidades en estante por producto
+        self.reserved = Counter()  # Unidades comprometidas con pedidos aún sin tomar
+        for slot in slots:
+            self.units[slot.product] += slot.units
+        self.requests: Dict[str, dict] = {}  # Solicitudes de reposición abiertas, por posición
+
+    @classmethod
+    def from_config(cls, products: Dict[str, str], config: Dict[str, dict]) -> "ShelfInventory":
+        """Estantería por defecto (una unidad por posición) con lo de config_arepas.json ("shelf_inventory")
+
+        Cada posición acepta "product", "capacity", "units" (por defecto llena) y "low_water".
+        """
+        slots = []
+        for slot_id, product in products.items():
+            settings = config.get(slot_id, {})
+            capacity = max(1, int(settings.get("capacity", SHELF_UNITS_PER_SLOT)))
+            slots.append(ShelfSlot(slot_id, str(settings.get("product", product)), capacity,
+                                   min(capacity, max(0, int(settings.get("units", capacity)))),
+                                   max(0, int(settings.get("low_water", SHELF_LOW_WATER)))))
+        return cls(slots)
+
+    def product_of(self, item: str) -> Optional[str]:
+        """Producto de un ítem de pedido: nombre de producto o ID de posición (alias de su producto)"""
+        if item in self.by_product:
+            return item
+        slot = self.slots.get(item)
+        return slot.product if slot is not None else None
+
+    def rank_slots(self, costs: Dict[str, float]):
+        """Ordena las posiciones de cada producto por costo de recogida (s)"""
+        for slot_ids in self.by_product.values():
+            slot_ids.sort(key=lambda slot_id: (costs.get(slot_id, math.inf), slot_id))
+
+    def available(self, product: str, blocked=()) -> int:
+        """Unidades sin reservar de un producto, sin contar las posiciones bloqueadas"""
+        units = self.units[product] - self.reserved[product]
+        if blocked:
+            units -= sum(self.slots[slot_id].units for slot_id in self.by_product[product] if slot_id in blocked)
+        return max(0, units)
+
+    def reserve(self, products: List[str]):
+        for product in products:
+            self.reserved[product] += 1
+
+    def release(self, products: List[str]):
+        for product in products:
+            self.reserved[product] = max(0, self.reserved[product] - 1)
+
+    def set_reservations(self, products: List[str]):
+        """Rehace las reservas con los productos de los pedidos pendientes"""
+        self.reserved = Counter(products)
+
+    def choose_slots(self, products: List[str], blocked=()) -> Optional[List[str]]:
+        """Posición no vacía más cercana para cada unidad (distintas entre sí); None si no alcanzan"""
+        taken = set(blocked)
+        chosen = []
+        for product in products:
+            slot_id = next((slot_id for slot_id in self.by_product[product]
+                            if slot_id not in taken and self.slots[slot_id].units > 0), None)
+            if slot_id is None:
+                return None
+            taken.add(slot_id)
+            chosen.append(slot_id)
+        return chosen
+
+    def pick(self, slot_id: str) -> Optional[dict]:
+        """Descuenta la unidad que tomó el robot; devuelve la solicitud de reposición si la abre"""
+        slot = self.slots[slot_id]
+        if slot.units > 0:
+            slot.units -= 1
+            self.units[slot.product] -= 1
+        self.reserved[slot.product] = max(0, self.reserved[slot.product] - 1)
+        if slot.units > slot.low_water or slot_id in self.requests:
+            return None
+        request = {"slot": slot_id, "product": slot.product, "units": slot.units,
+                   "capacity": slot.capacity, "requested": clock.time()}
+        self.requests[slot_id] = request
+        return request
+
+    def refill(self, slot_ids: Optional[List[str]] = None, capacity: Optional[int] = None) -> List[str]:
+        """Llena las posiciones (todas por defecto) y cierra sus solicitudes de reposición"""
+        refilled = []
+        for slot_id in self.slots if slot_ids is None else slot_ids:
+            slot = self.slots[slot_id]
+            if capacity is not None:
+                slot.capacity = capacity
+            self.units[slot.product] += slot.capacity - slot.units
+            slot.units = slot.capacity
+            self.requests.pop(slot_id, None)
+            refilled.append(slot_id)
+        return refilled
+
+    def to_dict(self) -> dict:
+        """Posiciones, unidades por producto y solicitudes de reposición abiertas"""
+        return {
+            "slots": {slot_id: {"product": slot.product, "units": slot.units, "capacity": slot.capacity,
+                                "low_water": slot.low_water} for slot_id, slot in self.slots.items()},
+            "products": {product: {"units": self.units[product], "reserved": self.reserved[product],
+                                   "slots": list(slot_ids)} for product, slot_ids in self.by_product.items()},
+            "replenishment": list(self.requests.values())
+        }
+
+class OrderRequestHandler(BaseHTTPRequestHandler):
+    """API HTTP/JSON de pedidos: POST /orders, GET /orders, GET /orders/<id>, GET /stock,
+    POST /stock/replenish, GET /faults"""
+
+    def do_POST(self):
+        path = self.path.rstrip("/")
+        if path not in ("/orders", "/stock/replenish"):
+            self.send_json(404, {"error": "Ruta no encontrada"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            items = body.get("items")
+        except (ValueError, AttributeError):
+            self.send_json(400, {"error": "JSON inválido"})
+            return
+        
+        if path == "/stock/replenish":
+            try:
+                refilled = self.server.controller.replenish_shelves(body.get("slots"))
+            except ValueError as e:
+                self.send_json(400, {"error": str(e)})
+            else:
+                self.send_json(200, {"replenished": refilled, "stock": self.server.controller.get_available_stock()})
+            return
+
+        try:
+            order = self.server.controller.submit_order(items, source=str(body.get("source", "pos")))
+        except ValueError as e:
+            self.send_json(400, {"error": str(e)})
+        except queue.Full:
+            self.send_json(503, {"error": "Cola de pedidos llena"},
+                           {"Retry-After": str(self.server.controller.order_retry_after())})
+        else:
+            self.send_json(202, self.server.controller.order_to_dict(order))
+
+    def do_GET(self):
+        controller = self.server.controller
+        parts = [part for part in self.path.split("/") if part]
+        if parts == ["orders"]:
+            self.send_json(200, {"orders": controller.list_orders()})
+        elif len(parts) == 2 and parts[0] == "orders":
+            order = controller.get_order(parts[1])
+            if order is None:
+                self.send_json(404, {"error": f"Pedido {parts[1]} no existe"})
+            else:
+                self.send_json(200, order)
+        elif parts == ["stock"]:
+            self.send_json(200, {"stock": controller.get_available_stock(), "shelves": controller.shelf_report()})
+        elif parts == ["faults"]:
+            self.send_json(200, controller.fault_report())
+        else:
+            self.send_json(404, {"error": "Ruta no encontrada"})
+
+    def send_json(self, code: int, payload: dict, headers: Optional[Dict[str, str]] = None):
+        """Envía una respuesta JSON"""
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # Sin log por petición: el controlador registra los pedidos al procesarlos
+        pass
+
+# Publicación del estado para HMIs en otros procesos (ver hmi_client.py)
+STATE_SERVER_HOST = "127.0.0.1"
+STATE_SERVER_PORT = 8766
+STATE_PUBLISH_PERIOD = 0.2  # s entre deltas
+STATE_LOG_HISTORY = 200     # Líneas de log que recibe un visor al conectarse
+STATE_OUTBOX_SIZE = 100     # Mensajes pendientes por visor antes de desconectarlo
+HMI_COMMANDS = ("start", "stop", "home", "reset", "cancel")
+
+def state_delta(previous: dict, current: dict) -> dict:
+    """Cambios entre dos estados publicados (los dicts se comparan un nivel más adentro)"""
+    changes = {}
+    for key, value in current.items():
+        old = previous.get(key)
+        if value == old:
+            continue
+        if isinstance(value, dict) and isinstance(old, dict) and value.keys() == old.keys():
+            changes[key] = {k: v for k, v in value.items() if old[k] != v}
+        else:
+            changes[key] = value
+    return changes
+
+class StateClientHandler(socketserver.StreamRequestHandler):
+    """Un visor conectado: recibe snapshot y deltas (JSON por línea) y envía comandos
+
+    Cada visor tiene su propia cola de salida y su hilo de escritura; si no
+    lee a tiempo y la cola se llena, se desconecta sin frenar a los demás.
+    """
+
+    def handle(self):
+        self.outbox: "queue.Queue[Optional[dict]]" = queue.Queue(maxsize=STATE_OUTBOX_SIZE)
+        threading.Thread(target=self.write_loop, daemon=True).start()
+        self.server.attach(self)
+        try:
+            for line in self.rfile:
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    self.send({"type": "reply", "id": None, "ok": False, "error": "JSON inválido"})
+                    continue
+                if isinstance(message, dict) and message.get("type") == "command":
+                    self.server.controller.handle_hmi_command(message, self.send)
+        except OSError:
+            pass
+        finally:
+            self.server.detach(self)
+            try:
+                self.outbox.put_nowait(None)
+            except queue.Full:
+                pass
+
+    def send(self, message: dict) -> bool:
+        """Encola un mensaje para el visor (False si se desconectó por lento)"""
+        try:
+            self.outbox.put_nowait(message)
+            return True
+        except queue.Full:
+            self.drop()
+            return False
+
+    def drop(self):
+        """Corta la conexión; el hilo de lectura termina y el visor se retira"""
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def write_loop(self):
+        while True:
+            message = self.outbox.get()
+            if message is None:
+                return
+            try:
+                self.wfile.write((json.dumps(message) + "\n").encode("utf-8"))
+            except (OSError, ValueError):
+                self.drop()
+                return
+
+class StateServer(socketserver.ThreadingTCPServer):
+    """Publica el estado del controlador a los visores: snapshot al conectar, luego deltas y log"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, controller: "ArepaController"):
+        super().__init__(address, StateClientHandler)
+        self.controller = controller
+        self.clients: List[StateClientHandler] = []
+        self.clients_lock = threading.Lock()  # Ordena snapshot y deltas para cada visor
+        self.state: dict = {}                 # Último estado publicado
+        self.log_seq = 0                      # Última línea de log publicada
+        self.stopped = threading.Event()
+
+    def attach(self, client: StateClientHandler):
+        with self.clients_lock:
+            client.send({"type": "snapshot", "clock": clock.time(), "state": self.state,
+                         "log": [text for seq, text in self.controller.hmi_log_since(0) if seq <= self.log_seq]})
+            self.clients.append(client)
+
+    def detach(self, client: StateClientHandler):
+        with self.clients_lock:
+            if client in self.clients:
+                self.clients.remove(client)
+
+    def publish(self):
+        """Envía a todos los visores lo que cambió desde la última publicación"""
+        state = self.controller.hmi_state()
+        with self.clients_lock:
+            messages = []
+            changes = state_delta(self.state, state)
+            if changes:
+                messages.append({"type": "delta", "clock": clock.time(), "changes": changes})
+            lines = self.controller.hmi_log_since(self.log_seq)
+            if lines:
+                self.log_seq = lines[-1][0]
+                messages.append({"type": "log", "lines": [text for _, text in lines]})
+            self.state = state
+            for client in list(self.clients):
+                for message in messages:
+                    if not client.send(message):
+                        break
+
+    def publish_loop(self):
+        while not self.stopped.wait(STATE_PUBLISH_PERIOD):
+            try:
+                self.publish()
+            except Exception as e:
+                print(f"Error publicando estado: {str(e)}")
+
+# Movimiento con redondeo (fly-by) en puntos de paso
+FLYBY_ROUNDING_MAX = 30.0     # mm
+FLYBY_ROUNDING_RATIO = 0.4    # Fracción del tramo más corto adyacente al punto de paso
+
+# Perfiles de velocidad y aceleración por clase de segmento
+# speed/accel: mm/s y mm/s² (MoveL); joint_speed/joint_accel: °/s y °/s² (MoveJ y rotaciones)
+# Se pueden ajustar en config_arepas.json ("motion_profiles": {"default": {...}, "products": {...}})
+DEFAULT_MOTION_PROFILES = {
+    "empty":    {"speed": 500, "accel": 1500, "joint_speed": 120, "joint_accel": 400},  # Tránsito sin arepa
+    "loaded":   {"speed": 300, "accel": 800,  "joint_speed": 60,  "joint_accel": 200},  # Tránsito con arepa
+    "approach": {"speed": 120, "accel": 500,  "joint_speed": 30,  "joint_accel": 100},  # Bajar a tomar/dejar
+    "flip":     {"speed": 250, "accel": 800,  "joint_speed": 90,  "joint_accel": 300}   # Rotación del volteo
+}
+
+# Programas nativos del robot: cada etapa del ciclo (transporte, volteo, entrega,
+# Home) se genera como un programa de RoboDK y su post-procesador lo traduce al
+# lenguaje del controlador; el PC solo coordina al inicio y al final de cada etapa.
+# Se activan en config_arepas.json ("native_programs": {"enabled": true, ...})
+NATIVE_PROGRAM_PREFIX = "Arepas_"
+NATIVE_PROGRAMS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "programas_robot")
+NATIVE_POLL_PERIOD = 0.05  # s entre consultas de fin de programa (handshake)
+
+# Targets paramétricos de parrilla y entrega: en lugar de enseñar 4 targets por
+# posición, se calculan desde un marco de referencia, el paso entre posiciones,
+# la altura de aproximación y el giro en Z del volteo
+# ("grill_layout" en config_arepas.json). Poses [x, y, z, rx, ry, rz] en mm y
+# grados con la convención de RoboDK (rotación X·Y·Z)
+def pose_to_matrix(values: List[float]) -> List[List[float]]:
+    """[x, y, z, rx, ry, rz] → matriz homogénea 4x4"""
+    x, y, z = values[:3]
+    a, b, c = (math.radians(value) for value in values[3:6])
+    ca, sa, cb, sb, cc, sc = math.cos(a), math.sin(a), math.cos(b), math.sin(b), math.cos(c), math.sin(c)
+    return [[cb * cc, -cb * sc, sb, x],
+            [ca * sc + sa * sb * cc, ca * cc - sa * sb * sc, -sa * cb, y],
+            [sa * sc - ca * sb * cc, sa * cc + ca * sb * sc, ca * cb, z],
+            [0.0, 0.0, 0.0, 1.0]]
+
+def matrix_to_pose(matrix: List[List[float]]) -> List[float]:
+    """Matriz homogénea 4x4 → [x, y, z, rx, ry, rz]"""
+    b = math.asin(max(-1.0, min(1.0, matrix[0][2])))
+    if abs(matrix[0][2]) < 1 - 1e-9:
+        a = math.atan2(-matrix[1][2], matrix[2][2])
+        c = math.atan2(-matrix[0][1], matrix[0][0])
+    else:
+        # Bloqueo de cardán: se atribuye todo el giro a X
+        a, c = math.atan2(matrix[2][1], matrix[1][1]), 0.0
+    return [matrix[0][3], matrix[1][3], matrix[2][3], math.degrees(a), math.degrees(b), math.degrees(c)]
+
+def multiply_matrices(left: List[List[float]], right: List[List[float]]) -> List[List[float]]:
+    return [[sum(left[i][k] * right[k][j] for k in range(4)) for j in range(4)] for i in range(4)]
+
+def translation_matrix(offset: List[float]) -> List[List[float]]:
+    return pose_to_matrix(list(offset[:3]) + [0, 0, 0])
+
+def layout_target_poses(layout: dict, grill_frame: List[float], delivery_frame: List[float],
+                        grill_slots: int, delivery_slots: int) -> Dict[str, List[float]]:
+    """Calcula en una pasada las poses de parrilla, volteo y entrega en el marco del robot
+
+    Cada posición es marco · traslación(paso · (n - 1)) · primera posición; la
+    aproximación sube sobre el eje Z del marco y el volteo gira la herramienta en su Z.
+    """
+    poses: Dict[str, List[float]] = {}
+    frame = pose_to_matrix(grill_frame)
+    first_slot = pose_to_matrix(layout["first_slot"])
+    flip = pose_to_matrix([0, 0, 0, 0, 0, layout.get("flip_rotation", 180)])
+    approach = layout.get("approach", 120)
+    pitch = layout.get("pitch", [0, 150, 0])
+    for slot in range(1, grill_slots + 1):
+        offset = [value * (slot - 1) for value in pitch]
+        place = multiply_matrices(multiply_matrices(frame, translation_matrix(offset)), first_slot)
+        above_offset = [offset[0], offset[1], offset[2] + approach]
+        above = multiply_matrices(multiply_matrices(frame, translation_matrix(above_offset)), first_slot)
+        poses[f"Parrilla_Arepa{slot}"] = matrix_to_pose(place)
+        poses[f"Parrilla_Pos{slot}"] = matrix_to_pose(above)
+        poses[f"Parrilla_Giro_Pos{slot}"] = matrix_to_pose(multiply_matrices(place, flip))
+        poses[f"Parrilla_Pos{slot}_Giro"] = matrix_to_pose(multiply_matrices(above, flip))
+
+    delivery = layout.get("delivery")
+    if delivery:
+        frame = pose_to_matrix(delivery_frame)
+        first_slot = pose_to_matrix(delivery["first_slot"])
+        pitch = delivery.get("pitch", [150, 0, 0])
+        for slot in range(1, delivery_slots + 1):
+            offset = [value * (slot - 1) for value in pitch]
+            target = multiply_matrices(multiply_matrices(frame, translation_matrix(offset)), first_slot)
+            poses[f"Entrega_Pos{slot}"] = matrix_to_pose(target)
+    return poses
+
+# Caché de trayectorias precalculadas (ver trajectory_precompute.py)
+STATION_FILE_DEFAULT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ProyectoFinal.rdk")
+TRAJECTORY_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache_trayectorias")
+
+def compute_file_hash(path: str) -> str:
+    """Calcula el hash SHA-256 de un archivo"""
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+class TrajectoryCache:
+    """Caché en disco de trayectorias, duraciones y veredictos por segmento"""
+
+    def __init__(self, station_hash: str, station_file: str = "", segments: Optional[Dict[str, dict]] = None):
+        self.station_hash = station_hash
+        self.station_file = station_file
+        self.segments: Dict[str, dict] = segments or {}
+        self.created = clock.time()
+
+    @staticmethod
+    def segment_key(from_target: str, to_target: str, move_type: str) -> str:
+        """Clave de un segmento (origen|destino|tipo)"""
+        return f"{from_target}|{to_target}|{move_type}"
+
+    @staticmethod
+    def cache_path(station_hash: str) -> str:
+        """Ruta del archivo de caché para una estación"""
+        return os.path.join(TRAJECTORY_CACHE_DIR, f"{station_hash}.json")
+
+    @classmethod
+    def load(cls, station_hash: str) -> Optional["TrajectoryCache"]:
+        """Carga la caché de una estación; None si no existe o está corrupta"""
+        path = cls.cache_path(station_hash)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("station_hash") != station_hash:
+            return None
+        cache = cls(station_hash, data.get("station_file", ""), data.get("segments", {}))
+        cache.created = data.get("created", cache.created)
+        return cache
+
+    def save(self):
+        """Guarda la caché en disco"""
+        os.makedirs(TRAJECTORY_CACHE_DIR, exist_ok=True)
+        data = {
+            "station_hash": self.station_hash,
+            "station_file": self.station_file,
+            "created": self.created,
+            "segments": self.segments
+        }
+        tmp_path = self.cache_path(self.station_hash) + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.cache_path(self.station_hash))
+
+    def store(self, entry: dict):
+        """Guarda el resultado de un segmento"""
+        key = self.segment_key(entry["from"], entry["to"], entry["move_type"])
+        self.segments[key] = entry
+
+    def lookup(self, from_target: str, to_target: str, move_type: str) -> Optional[dict]:
+        """Busca un segmento en la caché"""
+        return self.segments.get(self.segment_key(from_target, to_target, move_type))
+
+    def infeasible_segments(self) -> List[dict]:
+        """Segmentos marcados como inviables"""
+        return [entry for entry in self.segments.values() if not entry.get("feasible", False)]
+
+# Modelo de duraciones de movimiento medidas
+MOTION_MODEL_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "modelo_tiempos.json")
+
+# Duraciones por defecto (s) cuando un segmento no se ha medido nunca
+DEFAULT_MOVE_DURATIONS = {"L": 1.0, "J": 1.5, "ROT": 1.5}
+
+class MotionDurationModel:
+    """Estimador en línea (media y varianza de Welford) del tiempo de cada segmento"""
+
+    def __init__(self, path: str = MOTION_MODEL_FILE):
+        self.path = path
+        self.segments: Dict[str, dict] = {}
+        self.lock = threading.Lock()
+        self.dirty = False
+
+    @staticmethod
+    def segment_key(from_target: str, to_target: str, move_type: str, speed: float) -> str:
+        """Clave de un segmento (origen|destino|tipo|velocidad)"""
+        return f"{from_target}|{to_target}|{move_type}|{speed:g}"
+
+    @classmethod
+    def load(cls, path: str = MOTION_MODEL_FILE) -> "MotionDurationModel":
+        """Carga el modelo desde disco (vacío si no existe)"""
+        model = cls(path)
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    model.segments = json.load(f).get("segments", {})
+            except (OSError, ValueError):
+                model.segments = {}
+        return model
+
+    def save(self):
+        """Guarda el modelo en disco si hubo cambios"""
+        with self.lock:
+            if not self.dirty:
+                return
+            data = {"updated": clock.time(), "segments": dict(self.segments)}
+            self.dirty = False
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=1)
+        os.replace(tmp_path, self.path)
+
+    def record(self, from_target: str, to_target: str, move_type: str, speed: float, duration: float,
+               profile: Optional[str] = None):
+        """Agrega una medición de duración a un segmento"""
+        key = self.segment_key(from_target, to_target, move_type, speed)
+        with self.lock:
+            stats = self.segments.setdefault(key, {"n": 0, "mean": 0.0, "m2": 0.0})
+            if profile is not None:
+                stats["profile"] = profile
+            stats["n"] += 1
+            delta = duration - stats["mean"]
+            stats["mean"] += delta / stats["n"]
+            stats["m2"] += delta * (duration - stats["mean"])
+            self.dirty = True
+
+    def estimate(self, from_target: str, to_target: str, move_type: str, speed: float) -> Optional[Tuple[float, float, int]]:
+        """Devuelve (media, desviación estándar, muestras) o None si no hay mediciones"""
+        with self.lock:
+            stats = self.segments.get(self.segment_key(from_target, to_target, move_type, speed))
+            if stats is None or stats["n"] == 0:
+                return None
+            variance = stats["m2"] / (stats["n"] - 1) if stats["n"] > 1 else 0.0
+            return stats["mean"], variance ** 0.5, stats["n"]
+
+# Línea de tiempo de cada corrida (reporte Gantt al terminar)
+REPORTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "reportes")
+def timeline_lanes(grill_slots: int = GRILL_SLOTS, delivery_slots: int = DELIVERY_SLOTS) -> List[str]:
+    return (["Robot"] + [f"P{i}" for i in range(1, grill_slots + 1)]
+            + [f"E{i}" for i in range(1, delivery_slots + 1)])
+
+TIMELINE_LANES = timeline_lanes()
+TIMELINE_MIN_GAP = 0.01  # s: intervalos más cortos se absorben en el siguiente
+
+# Estado → (texto, color); los huecos sin intervalo son posiciones vacías
+TIMELINE_STATES = {
+    "idle": ("Inactivo", "#d9d9d9"),
+    "moving": ("Moviendo", "#4a90d9"),
+    "gripping": ("Gripper", "#f5a623"),
+    "staging": ("Anticipando", "#8fb8e8"),
+    "side1": ("Lado 1", "#f8e71c"),
+    "flipping": ("Volteando", "#9b59b6"),
+    "side2": ("Lado 2", "#e67e22"),
+    "overdue": ("Esperando al robot", "#d0021b"),
+    "pickup": ("Retirando", "#7ed321"),
+    "occupied": ("Entregada", "#50e3c2")
+}
+
+class RunTimeline:
+    """Intervalos de actividad del robot y de cada posición de parrilla/entrega durante una corrida"""
+
+    def __init__(self, lanes: List[str] = TIMELINE_LANES):
+        self.lanes = list(lanes)
+        self.start = clock.time()
+        self.end: Optional[float] = None
+        self.lane_intervals: Dict[str, List[dict]] = {lane: [] for lane in self.lanes}
+        self.open: Dict[str, dict] = {}
+        self.lock = threading.Lock()
+
+    def mark(self, lane: str, state: Optional[str], label: Optional[str] = None, at: Optional[float] = None):
+        """Cierra el intervalo abierto del carril y abre uno nuevo (state=None = vacío)"""
+        at = clock.time() if at is None else at
+        with self.lock:
+            if self.end is not None:
+                return
+            current = self.open.pop(lane, None)
+            closed = self.lane_intervals[lane]
+            if current is not None:
+                if current["state"] == state and current["label"] == label:
+                    self.open[lane] = current
+                    return
+                current["end"] = max(at, current["start"])
+                previous = closed[-1] if closed else None
+                if (current["end"] - current["start"] < TIMELINE_MIN_GAP and previous is not None
+                        and previous["state"] == state and previous["label"] == label):
+                    # Hueco despreciable entre dos intervalos iguales: se continúa el anterior
+                    self.open[lane] = closed.pop()
+                    return
+                if current["end"] - current["start"] >= TIMELINE_MIN_GAP:
+                    closed.append(current)
+                    at = current["end"]
+                else:
+                    # Intervalo despreciable: el siguiente lo absorbe
+                    at = current["start"]
+            if state is not None:
+                self.open[lane] = {"lane": lane, "state": state, "label": label, "start": at, "end": None}
+
+    def close(self):
+        """Termina la corrida cerrando todos los intervalos abiertos"""
+        for lane in list(self.open):
+            self.mark(lane, None)
+        with self.lock:
+            self.end = clock.time()
+
+    @property
+    def intervals(self) -> List[dict]:
+        """Intervalos cerrados, por carril y en orden de inicio"""
+        return [interval for lane in self.lanes for interval in self.lane_intervals[lane]]
+
+    def duration(self) -> float:
+        return max((self.end or clock.time()) - self.start, 1e-6)
+
+    def utilization(self) -> Dict[str, Dict[str, float]]:
+        """Fracción del tiempo de la corrida en cada estado, por carril"""
+        usage = {lane: {} for lane in self.lanes}
+        for interval in self.intervals:
+            states = usage[interval["lane"]]
+            states[interval["state"]] = states.get(interval["state"], 0.0) + \
+                (interval["end"] - interval["start"]) / self.duration()
+        return usage
+
+    def export_csv(self, path: str):
+        """Intervalos crudos (segundos desde el inicio de la corrida)"""
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["lane", "state", "label", "start_s", "end_s", "duration_s"])
+            for interval in self.intervals:
+                start = interval["start"] - self.start
+                end = interval["end"] - self.start
+                writer.writerow([interval["lane"], interval["state"], interval["label"] or "",
+                                 f"{start:.3f}", f"{end:.3f}", f"{end - start:.3f}"])
+
+    def export_html(self, path: str):
+        """Diagrama de Gantt (SVG dentro de HTML, sin dependencias)"""
+        left, lane_height, width = 70, 30, 1000
+        scale = width / self.duration()
+        height = lane_height * len(self.lanes) + 30
+
+        svg = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{left + width + 20}" height="{height}" '
+               f'font-family="sans-serif" font-size="12">']
+        step = max(1, round(self.duration() / 10))
+        for second in range(0, int(self.duration()) + 1, step):
+            x = left + second * scale
+            svg.append(f'<line x1="{x:.1f}" y1="0" x2="{x:.1f}" y2="{height - 20}" stroke="#eee"/>')
+            svg.append(f'<text x="{x:.1f}" y="{height - 5}" text-anchor="middle">{second}s</text>')
+        for i, lane in enumerate(self.lanes):
+            svg.append(f'<text x="5" y="{i * lane_height + 19}">{html.escape(lane)}</text>')
+        for interval in self.intervals:
+            text, color = TIMELINE_STATES.get(interval["state"], (interval["state"], "#999"))
+            x = left + (interval["start"] - self.start) * scale
+            w = max((interval["end"] - interval["start"]) * scale, 0.5)
+            y = self.lanes.index(interval["lane"]) * lane_height + 4
+            tooltip = html.escape(f'{interval["label"] or ""} {text}: '
+                                  f'{interval["start"] - self.start:.1f}-{interval["end"] - self.start:.1f}s')
+            svg.append(f'<rect x="{x:.1f}" y="{y}" width="{w:.1f}" height="{lane_height - 8}" '
+                       f'fill="{color}"><title>{tooltip}</title></rect>')
+        svg.append("</svg>")
+
+        legend = " ".join(f'<span style="background:{color};padding:2px 6px">{text}</span>'
+                          for text, color in TIMELINE_STATES.values())
+        rows = []
+        for lane, states in self.utilization().items():
+            cells = ", ".join(f"{TIMELINE_STATES.get(state, (state,))[0]} {fraction:.0%}"
+                              for state, fraction in sorted(states.items(), key=lambda item: -item[1]))
+            rows.append(f"<tr><td>{html.escape(lane)}</td><td>{cells or 'Vacía'}</td></tr>")
+
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("<!DOCTYPE html><html><head><meta charset='utf-8'><title>Línea de tiempo</title></head>"
+                    "<body style='font-family:sans-serif'>"
+                    f"<h2>Corrida {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.start))} "
+                    f"({self.duration():.1f} s)</h2><p>{legend}</p>{''.join(svg)}"
+                    f"<h3>Ocupación</h3><table border='1' cellpadding='4'>{''.join(rows)}</table>"
+                    "</body></html>")
+
+# Historial de pedidos: almacén columnar de solo anexar (ver order_history.py)
+ORDER_HISTORY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "historial_pedidos")
+ORDER_HISTORY_BATCH = 500     # Filas por segmento
+ORDER_HISTORY_FLUSH = 60.0    # s máximos que una fila espera en memoria antes de escribirse
+ORDER_HISTORY_VERSION = 1
+
+# Una fila por arepa de cada pedido cerrado; "str" se guarda con diccionario
+# (códigos int32) y "f64" como float64 con NaN para lo que no ocurrió
+ORDER_HISTORY_COLUMNS = {
+    "order_id": "str", "source": "str", "product": "str", "slot": "str",
+    "status": "str",            # Estado final del pedido
+    "arepa_state": "str",       # Estado final de la arepa
+    "created": "f64", "started": "f64", "eta": "f64", "completed": "f64",
+    "latency": "f64",           # Entrega de la arepa - llegada del pedido (s)
+    "lateness": "f64",          # Cierre del pedido - hora estimada (s, positivo = tarde)
+    **{f"t_{state.value}": "f64" for state in ArepaState}  # Hora de entrada a cada estado
+}
+
+class OrderHistoryStore:
+    """Ciclo de vida de cada pedido cerrado en segmentos columnar de solo anexar
+
+    append() no bloquea: las filas pasan por una cola a un hilo escritor que
+    las junta y escribe un segmento cada ORDER_HISTORY_BATCH filas o cada
+    ORDER_HISTORY_FLUSH s. Cada segmento es una carpeta con un archivo por
+    columna y _meta.json, que se escribe al final: un segmento sin _meta.json
+    está incompleto y se ignora. Las consultas leen solo las columnas que
+    usan y saltan los segmentos fuera del rango de fechas pedido.
+    """
+
+    def __init__(self, directory: str = ORDER_HISTORY_DIR):
+        self.directory = directory
+        self.inbox: "queue.Queue[Optional[List[dict]]]" = queue.Queue()
+        self.thread: Optional[threading.Thread] = None
+        self.lock = threading.Lock()
+        self.sequence = itertools.count(1)
+
+    def append(self, rows: List[dict]):
+        """Encola filas para escribir (desde cualquier hilo, sin esperar el disco)"""
+        if not rows:
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.write_loop, name="HistorialPedidos", daemon=True)
+                self.thread.start()
+        self.inbox.put(rows)
+
+    def close(self):
+        """Escribe lo pendiente y detiene el hilo escritor"""
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread is not None:
+            self.inbox.put(None)
+            thread.join()
+
+    def write_loop(self):
+        buffer: List[dict] = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                rows = self.inbox.get(timeout=timeout)
+            except queue.Empty:
+                rows = []
+            if rows is None:
+                break
+            if rows and not buffer:
+                deadline = time.monotonic() + ORDER_HISTORY_FLUSH
+            buffer.extend(rows)
+            if buffer and (len(buffer) >= ORDER_HISTORY_BATCH or time.monotonic() >= deadline):
+                self.write_segment(buffer)
+                buffer, deadline = [], None
+        if buffer:
+            self.write_segment(buffer)
+
+    def write_segment(self, rows: List[dict]):
+        """Escribe un segmento inmutable con las filas dadas"""
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}_{os.getpid()}_{next(self.sequence):04d}"
+        path = os.path.join(self.directory, name)
+        try:
+            os.makedirs(path, exist_ok=True)
+            for column, kind in ORDER_HISTORY_COLUMNS.items():
+                values = [row.get(column) for row in rows]
+                if kind == "f64":
+                    with open(os.path.join(path, f"{column}.f64"), "wb") as f:
+                        array.array("d", [math.nan if value is None else value for value in values]).tofile(f)
+                else:
+                    dictionary = list(dict.fromkeys("" if value is None else value for value in values))
+                    codes = {value: i for i, value in enumerate(dictionary)}
+                    with open(os.path.join(path, f"{column}.i32"), "wb") as f:
+                        array.array("i", [codes["" if value is None else value] for value in values]).tofile(f)
+                    with open(os.path.join(path, f"{column}.json"), "w", encoding="utf-8") as f:
+                        json.dump(dictionary, f, ensure_ascii=False)
+            created = [row["created"] for row in rows if row.get("created") is not None]
+            meta = {"version": ORDER_HISTORY_VERSION, "rows": len(rows), "byteorder": sys.byteorder,
+                    "columns": ORDER_HISTORY_COLUMNS,
+                    "created_min": min(created, default=None), "created_max": max(created, default=None)}
+            with open(os.path.join(path, "_meta.json.tmp"), "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            os.replace(os.path.join(path, "_meta.json.tmp"), os.path.join(path, "_meta.json"))
+        except OSError as e:
+            print(f"⚠️ No se pudo guardar el historial de pedidos: {str(e)}")
+
+    def segments(self, since: Optional[float] = None, until: Optional[float] = None) -> List[Tuple[str, dict]]:
+        """Segmentos completos que pueden tener pedidos creados en [since, until)"""
+        found = []
+        try:
+            names = sorted(os.listdir(self.directory))
+        except OSError:
+            return found
+        for name in names:
+            try:
+                with open(os.path.join(self.directory, name, "_meta.json"), "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if meta.get("version") != ORDER_HISTORY_VERSION or meta.get("created_min") is None:
+                continue
+            if since is not None and meta["created_max"] < since:
+                continue
+            if until is not None and meta["created_min"] >= until:
+                continue
+            found.append((os.path.join(self.directory, name), meta))
+        return found
+
+    @staticmethod
+    def read_column(path: str, meta: dict, column: str) -> list:
+        """Valores de una columna de un segmento (None para los faltantes)"""
+        if ORDER_HISTORY_COLUMNS[column] == "f64":
+            values = array.array("d")
+            with open(os.path.join(path, f"{column}.f64"), "rb") as f:
+                values.fromfile(f, meta["rows"])
+            if meta["byteorder"] != sys.byteorder:
+                values.byteswap()
+            return [None if math.isnan(value) else value for value in values]
+        codes = array.array("i")
+        with open(os.path.join(path, f"{column}.i32"), "rb") as f:
+            codes.fromfile(f, meta["rows"])
+        if meta["byteorder"] != sys.byteorder:
+            codes.byteswap()
+        with open(os.path.join(path, f"{column}.json"), "r", encoding="utf-8") as f:
+            dictionary = [value or None for value in json.load(f)]
+        return [dictionary[code] for code in codes]
+
+    def read(self, columns: List[str], since: Optional[float] = None,
+             until: Optional[float] = None) -> Dict[str, list]:
+        """Columnas pedidas de los pedidos creados en [since, until) (epoch; None = sin límite)"""
+        wanted = list(dict.fromkeys(["created"] + list(columns)))
+        result: Dict[str, list] = {column: [] for column in wanted}
+        for path, meta in self.segments(since, until):
+            data = {column: self.read_column(path, meta, column) for column in wanted}
+            keep = [i for i, created in enumerate(data["created"])
+                    if (since is None or created >= since) and (until is None or created < until)]
+            for column in wanted:
+                values = data[column]
+                result[column].extend(values if len(keep) == meta["rows"] else [values[i] for i in keep])
+        return result
+
+    def latency_by_product(self, fraction: float = 0.95, since: Optional[float] = None,
+                           until: Optional[float] = None) -> Dict[str, dict]:
+        """Arepas entregadas, mediana y percentil de latencia (s) por producto"""
+        data = self.read(["product", "latency"], since, until)
+        latencies: Dict[str, List[float]] = {}
+        for product, latency in zip(data["product"], data["latency"]):
+            if latency is not None:
+                latencies.setdefault(product, []).append(latency)
+        return {product: {"delivered": len(values), "p50": percentile(values, 0.5),
+                          f"p{round(fraction * 100)}": percentile(values, fraction)}
+                for product, values in sorted(latencies.items())}
+
+    def throughput_per_hour(self, since: Optional[float] = None, until: Optional[float] = None) -> Dict[str, int]:
+        """Arepas entregadas por hora de reloj (hora local "AAAA-MM-DD HH:00")"""
+        data = self.read([f"t_{ArepaState.DELIVERED.value}"], since, until)
+        hours: Dict[str, int] = {}
+        for delivered in data[f"t_{ArepaState.DELIVERED.value}"]:
+            if delivered is not None:
+                hour = time.strftime("%Y-%m-%d %H:00", time.localtime(delivered))
+                hours[hour] = hours.get(hour, 0) + 1
+        return dict(sorted(hours.items()))
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    """Percentil por rango más cercano: el valor en la posición ⌈fraction·n⌉ (desde 1)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    # El redondeo evita que 0.28·25 = 7.000000000000001 salte un rango
+    return ordered[max(0, math.ceil(round(fraction * len(ordered), 9)) - 1)]
+
+# Comandos del operador (Home, Test Targets, Verificar RDK, Reset, Detener)
+class CommandCancelled(Exception):
+    """El operador canceló el comando en curso"""
+
+class OperatorCommand:
+    """Comando en curso: avance para la HMI y pedido de cancelación"""
+
+    def __init__(self, name: str, label: str, on_progress=None):
+        self.name = name
+        self.label = label
+        self.on_progress = on_progress
+        self.fraction = 0.0
+        self.text = ""
+        self.cancel_event = threading.Event()
+        self.on_cancel = None  # Se llama al cancelar (p. ej. detener el robot)
+
+    def progress(self, fraction: float, text: str):
+        """Informa el avance (0..1); también es punto de cancelación"""
+        self.check_cancelled()
+        self.fraction = fraction
+        self.text = text
+        if self.on_progress is not None:
+            self.on_progress(self)
+
+    def check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise CommandCancelled(self.label)
+
+    def cancel(self):
+        self.cancel_event.set()
+        if self.on_cancel is not None:
+            self.on_cancel()
+
+class CommandExecutor:
+    """Corre los comandos del operador en un hilo aparte, de a uno, para que la HMI no se congele
+
+    Exclusión con el ciclo de cocción: start_process no arranca mientras hay un
+    comando (revisa current bajo lock) y los comandos que mueven el robot se
+    niegan si ya hay un ciclo en curso.
+    """
+
+    def __init__(self, controller):
+        self.controller = controller
+        self.lock = threading.Lock()
+        self.current: Optional[OperatorCommand] = None
+
+    @property
+    def busy(self) -> bool:
+        return self.current is not None
+
+    def submit(self, name: str, label: str, func, on_done=None) -> bool:
+        """Ejecuta func(command) en segundo plano; False si ya hay un comando en curso
+
+        on_done(ok, error) se llama al terminar, desde el hilo del comando.
+        """
+        with self.lock:
+            if self.current is not None:
+                return False
+            command = OperatorCommand(name, label, self.controller.report_command_progress)
+            self.current = command
+        self.controller.report_command_started(command)
+        threading.Thread(target=self.run, args=(command, func, on_done), name=f"Comando-{name}", daemon=True).start()
+        return True
+
+    def run(self, command: OperatorCommand, func, on_done):
+        ok, error = False, None
+        try:
+            ok = func(command) is not False
+            if not ok:
+                error = "Comando rechazado (ver log)"
+        except CommandCancelled:
+            error = "Cancelado"
+            self.controller.log_message(f"⏹️ {command.label} cancelado")
+        except Exception as e:
+            error = str(e)
+            self.controller.log_message(f"✗ Error en {command.label}: {error}")
+        finally:
+            with self.lock:
+                self.current = None
+            self.controller.report_command_finished(command, ok, error)
+            if on_done is not None:
+                on_done(ok, error)
+
+    def cancel(self) -> bool:
+        """Pide cancelar el comando en curso (False si no hay ninguno)"""
+        command = self.current
+        if command is None:
+            return False
+        command.cancel()
+        return True
+
+def robot_activity(state: str):
+    """Decorador: marca al robot en 'state' mientras dura la llamada (etiqueta: primer argumento)"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            label = args[0] if args and isinstance(args[0], str) else None
+            self.mark_timeline("Robot", state, label)
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                self.mark_timeline("Robot", "idle")
+        return wrapper
+    return decorator
 
 class ArepaController:
-    def __init__(self, root):
+    def __init__(self, root: Optional[tk.Tk] = None, robodk_port: Optional[int] = None,
+                 grill_slots: int = GRILL_SLOTS, delivery_slots: int = DELIVERY_SLOTS):
+        # Sin root el controlador corre sin HMI (simulaciones, pruebas de carga y flota)
         self.root = root
-        self.root.title("Control de Arepas - Parrilla Automática")
-        self.root.geometry("900x650")  # Reducido de 1000x800
-        self.root.resizable(True, True)
+        if self.root is not None:
+            self.root.title("Control de Arepas - Parrilla Automática")
+            self.root.geometry("900x650")  # Reducido de 1000x800
+            self.root.resizable(True, True)
         
         # Inicializar log_text como None inicialmente
         self.log_text = None
         
-        # RoboDK 
-        if ROBODK_AVAILABLE:
-            self.RDK = Robolink()
-        else:
-            self.RDK = Robolink()  # Usará la clase Mock
+        # RoboDK (se conecta en segundo plano, ver start_robot_connection)
+        self.RDK = None
         self.robot = None
-        
+        self.robodk_port = robodk_port  # None = instancia de RoboDK por defecto
+        self.connection_done = threading.Event()
+        self.robot_name: Optional[str] = None
+        self.supervisor = ConnectionSupervisor(self)
+        self.robot_speed = 300
+        self.robot_rounding = 5
+        self.active_rounding: Optional[float] = None  # Último redondeo enviado al robot
+        self.settings = load_settings()  # config_arepas.json, leído una sola vez por sesión
+        self.motion_profile_config = self.settings.get("motion_profiles", {})
+        self.native_config = self.settings.get("native_programs", {})
+        self.native_programs: Dict[str, Any] = {}  # Programas nativos cargados, por nombre de etapa
+        self.slot_assignment = self.settings.get("slot_assignment", "travel")  # "travel" o "selection"
+        fault_config = self.settings.get("fault_handling", {})
+        self.stage_attempts = max(1, int(fault_config.get("attempts", STAGE_ATTEMPTS)))
+        self.retry_backoff = float(fault_config.get("backoff", STAGE_RETRY_BACKOFF))
+        self.discard_target: Optional[str] = fault_config.get("discard_target")  # Donde soltar una arepa fallida
+        self.held_arepa: Optional[str] = None  # Arepa que quedó en el gripper tras una falla (hasta el Reset)
+        self.quarantined: Dict[str, str] = {}  # Estante ("A1"), parrilla ("P2") o entrega ("E3") → motivo
+        self.batch_failed: set = set()  # Arepas del lote en error o descartadas con su pedido
+        self.fault_stats = {"retries": 0, "recovered": 0, "recovery_seconds": 0.0, "failed_stages": 0,
+                            "failed_arepas": 0, "skipped_arepas": 0, "rejected_orders": 0, "quarantined": 0}
+        staging_config = self.settings.get("staging", {})
+        self.staging_enabled = bool(staging_config.get("enabled", True))
+        self.staging_margin = float(staging_config.get("margin", STAGING_MARGIN))
+        self.staging_stats = {"staged": 0, "cancelled": 0, "responses": 0, "response_seconds": 0.0}
+        self.response_expiry: Optional[float] = None  # Vencimiento del timer de la acción de parrilla en curso
+        self.sequence_progress: Optional[int] = 0  # Pasos hechos de la última etapa (None = programa nativo)
+        self.slot_plan: Dict[str, int] = {}  # Posición de parrilla planificada para cada arepa del lote
+        self.shift_travel = {"planned": [0.0, 0.0], "selection": [0.0, 0.0]}  # (mm, s) acumulados del turno
+        self.active_profile: Optional[dict] = None  # Último perfil de velocidad aplicado
+        self.active_speed_settings: Optional[Tuple[float, float, float, float]] = None
+        self.current_target: Optional[str] = None  # Último target alcanzado
+        self.layout_targets: Dict[str, Any] = {}  # Poses paramétricas de parrilla/entrega, por nombre
+        self.grill_layout: Optional[dict] = None  # "grill_layout" con el que se calcularon
+        self.trajectory_cache: Optional[TrajectoryCache] = None
+        self.motion_model = MotionDurationModel.load()
+        self.gripper: Optional[PneumaticGripper] = None  # Se crea al conectar el robot
+        self.timeline: Optional[RunTimeline] = None  # Corrida en curso (o la última)
+        self.write_reports = True  # Guardar el reporte de línea de tiempo al terminar cada corrida
+
         # Sistema de control
         self.is_executing = False
         self.selected_arepas: List[str] = []  # Orden de selección
-        self.grill_positions = [None, None, None, None]  # 4 posiciones de parrilla
-        self.delivery_positions = [None, None, None, None]  # 4 posiciones de entrega
         
         # Tiempos de proceso (en segundos)
         self.cook_time_side1 = 10  # Reducido para testing
         self.cook_time_side2 = 10  # Reducido para testing
         
-        # Definición de arepas
-        self.arepas: Dict[str, ArepaInfo] = {
-            "A1": ArepaInfo("A1", "Arepa de Queso"),
-            "A2": ArepaInfo("A2", "Arepa de Pollo"),
-            "A3": ArepaInfo("A3", "Arepa de Carne"),
-            "B1": ArepaInfo("B1", "Arepa Mixta"),
-            "B2": ArepaInfo("B2", "Arepa Vegetariana"),
-            "B3": ArepaInfo("B3", "Arepa Especial")
-        }
+        # Definición de arepas; su estado, la parrilla, los timers y las
+        # entregas (4 posiciones cada una por defecto) los maneja solo el actor de la celda
+        # Cada posición de estantería guarda un producto; config_arepas.json
+        # ("shelf_inventory") cambia producto, capacidad y nivel de reposición
+        self.inventory = ShelfInventory.from_config({
+            "A1": "Arepa de Queso",
+            "A2": "Arepa de Pollo",
+            "A3": "Arepa de Carne",
+            "B1": "Arepa Mixta",
+            "B2": "Arepa Vegetariana",
+            "B3": "Arepa Especial"
+        }, self.settings.get("shelf_inventory", {}))
+        self.cell = CellStateActor({slot_id: ArepaInfo(slot_id, slot.product)
+                                    for slot_id, slot in self.inventory.slots.items()},
+                                   grill_slots, delivery_slots)
+        
+        # Pedidos (HMI y punto de venta)
+        self.shelf_capacity: Optional[int] = None  # Unidades por posición al reponer (None = capacidad de cada una)
+        self.orders: Dict[str, OrderInfo] = {}
+        self.order_queue: "queue.Queue[OrderInfo]" = queue.Queue(maxsize=ORDER_QUEUE_SIZE)
+        self.pending_order: Optional[OrderInfo] = None  # Sacado de la cola pero sin espacio en el lote
+        self.active_orders: List[str] = []               # Pedidos del lote en ejecución
+        self.orders_lock = threading.Lock()
+        self.order_counter = itertools.count(1)
+        self.order_history = OrderHistoryStore()  # Ciclo de vida de los pedidos cerrados
+        self.order_server = None
+        self.state_server: Optional[StateServer] = None
+        self.selection_dirty = False  # El operador cambió la selección manual
         
-        # Control de timers por posición
-        self.grill_timers = [None, None, None, None]
+        # Etiquetas de los timers por posición
         self.timer_labels = []
         
         # Variables de control del proceso principal
         self.main_control_thread = None
         self.stop_control = False
         
+        # Comandos del operador en segundo plano (Home, Test Targets, Verificar RDK, Reset, Detener)
+        self.commands = CommandExecutor(self)
+        
         # Debug mode
         self.debug_mode = True
         
+        # Estado y log para los visores remotos (ver start_state_server)
+        self.status_text = ""
+        self.hmi_log: "deque[Tuple[int, str]]" = deque(maxlen=STATE_LOG_HISTORY)
+        self.hmi_log_lock = threading.Lock()
+        self.hmi_log_counter = itertools.count(1)
+        
+        if self.root is None:
+            # Sin HMI: quien crea el controlador llama a dispatch_orders()
+            self.start_robot_connection()
+            return
+        
         # Crear interfaz PRIMERO
         self.create_interface()
         
-        # Luego inicializar robot
-        self.initialize_robot()
+        # Luego conectar el robot sin bloquear la HMI
+        self.start_robot_connection()
         
         # Iniciar actualización de timers
         self.update_timers()
         
+        # Revisar periódicamente la cola de pedidos
+        self.poll_order_queue()
+        
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
     
+    # Lecturas del último snapshot de la celda (sin bloqueos); para varias
+    # lecturas coherentes entre sí usar un mismo self.cell.snapshot
+    @property
+    def arepas(self) -> Mapping[str, ArepaInfo]:
+        return self.cell.snapshot.arepas
+    
+    @property
+    def grill_positions(self) -> Tuple[Optional[str], ...]:
+        return self.cell.snapshot.grill_positions
+    
+    @property
+    def grill_timers(self) -> Tuple[Optional[Mapping[str, Any]], ...]:
+        return self.cell.snapshot.grill_timers
+    
+    @property
+    def delivery_positions(self) -> Tuple[Optional[str], ...]:
+        return self.cell.snapshot.delivery_positions
+    
+    def start_robot_connection(self):
+        """Conecta con RoboDK en segundo plano para que la HMI aparezca de inmediato"""
+        self.connection_done.clear()
+        threading.Thread(target=self.initialize_robot, daemon=True).start()
+    
+    def show_message(self, kind: str, title: str, text: str):
+        """Muestra un messagebox desde cualquier hilo (se agenda en el hilo de la HMI)"""
+        if self.root is None:
+            self.log_message(f"{title}: {text}")
+            return
+        self.root.after(0, lambda: getattr(messagebox, kind)(title, text))
+    
+    def defer_to_hmi(self, callback) -> bool:
+        """Tk solo se toca desde su hilo: desde otro hilo agenda callback con root.after (True si se agendó)"""
+        if threading.current_thread() is threading.main_thread():
+            return False
+        self.root.after(0, callback)
+        return True
+    
     def initialize_robot(self):
-        """Inicializa la conexión con el robot"""
+        """Inicializa la conexión con el robot (en segundo plano)"""
         try:
+            self.update_status("Cargando API de RoboDK...")
+            self.RDK = create_robolink(self.robodk_port)
+            
             if ROBODK_AVAILABLE:
                 # Verificar que RoboDK esté corriendo
+                self.update_status("Conectando con RoboDK...")
                 stations = self.RDK.getOpenStations()
                 if not stations:
                     self.log_message("ADVERTENCIA: RoboDK no tiene estaciones abiertas")
-                    messagebox.showwarning("RoboDK", "RoboDK no tiene estaciones abiertas. Abre una estación primero.")
+                    self.update_status("RoboDK sin estaciones abiertas")
+                    self.show_message("showwarning", "RoboDK", "RoboDK no tiene estaciones abiertas. Abre una estación primero.")
                     return False
                 
-                self.robot = self.RDK.ItemUserPick("Selecciona un robot", ITEM_TYPE_ROBOT)
-                if not self.robot.Valid():
+                self.update_status("Seleccionando robot...")
+                robot = self.pick_robot()
+                if not robot.Valid():
                     self.log_message("Error: No se ha seleccionado un robot válido.")
-                    messagebox.showerror("Error", "No se ha seleccionado un robot válido en RoboDK.")
+                    self.update_status("Sin robot válido")
+                    self.show_message("showerror", "Error", "No se ha seleccionado un robot válido en RoboDK.")
                     return False
-                self.log_message(f"Robot seleccionado: {self.robot.Name()}")
+                self.log_message(f"Robot seleccionado: {robot.Name()}")
             else:
-                self.robot = self.RDK.ItemUserPick("Robot simulado", ITEM_TYPE_ROBOT)
+                robot = self.RDK.ItemUserPick("Robot simulado", ITEM_TYPE_ROBOT)
                 self.log_message("Usando robot simulado para testing")
             
             # Configurar robot
-            self.robot.setSpeed(300)
-            self.robot.setRounding(5)
-            
+            self.update_status("Configurando robot...")
+            robot.setSpeed(self.robot_speed)
+            robot.setRounding(self.robot_rounding)
+            self.active_rounding = self.robot_rounding
+            self.active_speed_settings = None
+            self.robot = robot
+            self.robot_name = robot.Name()
+            self.gripper = self.create_gripper(robot)
+            self.generate_layout_targets()
+            self.rank_shelf_slots()
+
             self.log_message("Robot inicializado correctamente.")
+            self.load_trajectory_cache()
+            self.update_status(f"Sistema listo - Robot: {self.robot_name}")
+            self.supervisor.start()
             return True
             
         except Exception as e:
             error_msg = f"Error al conectar con robot: {str(e)}"
             self.log_message(error_msg)
+            self.update_status("Sin conexión con RoboDK")
             if ROBODK_AVAILABLE:
-                messagebox.showerror("Error RoboDK", error_msg)
+                self.show_message("showerror", "Error RoboDK", error_msg)
+            return False
+        
+        finally:
+            self.connection_done.set()
+    
+    def create_gripper(self, robot) -> PneumaticGripper:
+        """Crea el gripper según config_arepas.json ("gripper": {"mode": "io" | "dwell" | "sim", ...})"""
+        config = self.settings.get("gripper", {})
+        mode = config.get("mode", "dwell" if ROBODK_AVAILABLE else "sim")
+        
+        di_closed = config.get("di_closed", GRIPPER_DI_CLOSED)
+        di_open = config.get("di_open", GRIPPER_DI_OPEN)
+        if mode == "dwell":
+            # Sin sensores: solo el tiempo mínimo con la válvula conmutada
+            di_closed = di_open = None
+        
+        min_dwell = config.get("min_dwell", GRIPPER_MIN_DWELL)
+        if mode == "dwell" and "min_dwell" not in config:
+            # Sin confirmación no se sabe cuánto tarda el gripper real: se mantiene el tiempo probado
+            min_dwell = GRIPPER_BLIND_DWELL
+            self.log_message(f"⚠️ Gripper sin sensores ni 'min_dwell' configurado: se esperan {min_dwell:.1f} s "
+                             f"por acción. Configura 'min_dwell' o el modo 'io' con 'di_closed'/'di_open' "
+                             f"en \"gripper\" de config_arepas.json")
+        
+        do_close = config.get("do_close", GRIPPER_DO_CLOSE)
+        if mode == "sim":
+            io = SimulatedGripperIO(do_close, di_closed, di_open,
+                                    config.get("sim_actuation", GRIPPER_SIM_ACTUATION))
+        else:
+            io = robot
+        
+        self.log_message(f"Gripper: modo '{mode}', DO{do_close}, "
+                         f"confirmación {'DI%s/DI%s' % (di_closed, di_open) if di_closed is not None else 'no'}")
+        return PneumaticGripper(io, do_close, di_closed, di_open, min_dwell,
+                                config.get("confirm_timeout", GRIPPER_CONFIRM_TIMEOUT))
+    
+    @traced("gripper", action="action")
+    @robot_activity("gripping")
+    def operate_gripper(self, action: str) -> bool:
+        """Cierra ("grasp") o abre ("release") el gripper"""
+        try:
+            if action == "grasp":
+                duration = self.gripper.grasp()
+            else:
+                duration = self.gripper.release()
+        except GripperError as e:
+            self.log_message(f"✗ Gripper: {str(e)}")
+            return False
+        except Exception as e:
+            if self.recover_connection():
+                return self.operate_gripper(action)
+            self.log_message(f"✗ Error en gripper: {str(e)}")
+            return False
+        
+        self.log_message(f"  ✓ Gripper {'cerrado' if action == 'grasp' else 'abierto'} ({duration:.2f}s)")
+        if action == "grasp":
+            self.record_response()
+        return True
+    
+    def pick_robot(self):
+        """Usa el robot recordado del arranque anterior o pide elegirlo en RoboDK"""
+        robot_name = self.settings.get("robot_name")
+        if robot_name:
+            robot = self.RDK.Item(robot_name, ITEM_TYPE_ROBOT)
+            if robot.Valid():
+                self.log_message(f"Robot recordado: {robot_name}")
+                return robot
+            self.log_message(f"⚠️ Robot recordado '{robot_name}' no encontrado")
+        
+        robot = self.RDK.ItemUserPick("Selecciona un robot", ITEM_TYPE_ROBOT)
+        if robot.Valid():
+            self.settings["robot_name"] = robot.Name()
+            try:
+                save_settings(self.settings)
+            except OSError as e:
+                self.log_message(f"⚠️ No se pudo recordar el robot: {str(e)}")
+        return robot
+    
+    def reconnect_robot(self) -> bool:
+        """Crea una nueva conexión y vuelve a resolver robot y targets (hilo del supervisor)"""
+        try:
+            rdk = create_robolink(self.robodk_port)
+            robot = rdk.Item(self.robot_name, ITEM_TYPE_ROBOT)
+            if not robot.Valid():
+                self.log_message(f"✗ Reconexión: robot '{self.robot_name}' no encontrado")
+                return False
+            robot.setSpeed(self.robot_speed)
+            robot.setRounding(self.robot_rounding)
+        except Exception as e:
+            self.log_message(f"✗ Reconexión fallida: {str(e)}")
             return False
+        
+        self.RDK = rdk
+        self.robot = robot
+        self.active_rounding = self.robot_rounding
+        self.active_speed_settings = None
+        if not isinstance(self.gripper.io, SimulatedGripperIO):
+            self.gripper.io = robot
+        
+        missing = [target for target in self.get_required_targets() if not self.check_target_exists(target)]
+        if missing:
+            self.log_message(f"⚠️ Reconexión: faltan {len(missing)} targets: {', '.join(missing)}")
+        self.load_trajectory_cache()
+        return True
+    
+    def on_connection_lost(self):
+        """Notificación del supervisor: RoboDK dejó de responder"""
+        self.log_message("⚠️ CONEXIÓN CON RoboDK PERDIDA - reconectando...")
+        self.update_status("Conexión con RoboDK perdida - reconectando...")
     
+    def on_connection_restored(self):
+        """Notificación del supervisor: conexión restablecida"""
+        self.log_message(f"✓ Reconectado con RoboDK (desconexiones: {self.supervisor.disconnections})")
+        if self.is_executing:
+            self.update_status("Reconectado - reanudando proceso...")
+        else:
+            self.update_status(f"Sistema listo - Robot: {self.robot_name}")
+    
+    def recover_connection(self) -> bool:
+        """Tras un error de movimiento: si fue por desconexión, espera la reconexión (True = reintentar)"""
+        if not ROBODK_AVAILABLE or self.supervisor.check_now():
+            return False  # La conexión está bien: es un error real del movimiento
+        
+        self.log_message("⏸️ Movimiento interrumpido por desconexión - esperando reconexión")
+        while not self.stop_control:
+            if self.supervisor.wait_connected(0.5):
+                self.log_message("▶️ Reintentando movimiento")
+                return True
+        return False
+    
+    def get_station_file(self) -> str:
+        """Obtiene la ruta del archivo de la estación abierta"""
+        try:
+            station_file = self.RDK.getParam("FILE_OPENSTATION")
+            if station_file and os.path.exists(station_file):
+                return station_file
+        except Exception:
+            pass
+        return STATION_FILE_DEFAULT
+
+    def trajectory_cache_key(self, station_file: str) -> str:
+        """Clave de la caché: hash de la estación, del grill_layout y de la cantidad de posiciones
+
+        Los targets paramétricos no están en el archivo de la estación: si cambia el
+        layout o el número de posiciones, las trayectorias guardadas ya no sirven.
+        """
+        sha = hashlib.sha256(compute_file_hash(station_file).encode())
+        sha.update(json.dumps(self.grill_layout, sort_keys=True).encode())
+        sha.update(f"{len(self.grill_positions)}|{len(self.delivery_positions)}".encode())
+        return sha.hexdigest()
+
+    def load_trajectory_cache(self):
+        """Carga la caché de trayectorias correspondiente a la estación actual"""
+        station_file = self.get_station_file()
+        if not os.path.exists(station_file):
+            self.log_message("ℹ️ Sin archivo de estación - caché de trayectorias desactivada")
+            return
+
+        self.trajectory_cache = TrajectoryCache.load(self.trajectory_cache_key(station_file))
+        if self.trajectory_cache is None:
+            self.log_message("ℹ️ Sin caché de trayectorias para esta estación (ejecuta trajectory_precompute.py)")
+            return
+
+        infeasible = self.trajectory_cache.infeasible_segments()
+        self.log_message(f"Caché de trayectorias: {len(self.trajectory_cache.segments)} segmentos, "
+                         f"{len(infeasible)} inviables")
+        for entry in infeasible:
+            self.log_message(f"⚠️ Inviable: {entry['from']} → {entry['to']} ({entry['verdict']})")
+
     def create_interface(self):
         """Crea la interfaz gráfica compacta"""
         # Frame principal con scroll
@@ -255,19 +2368,22 @@ class ArepaController:
         order_frame = ttk.LabelFrame(parent, text="Orden", padding="5")
         order_frame.grid(row=2, column=0, columnspan=4, sticky="ew", pady=2)
         
-        self.order_label = ttk.Label(order_frame, text="Selecciona hasta 4 arepas", 
+        self.order_label = ttk.Label(order_frame, text=f"Selecciona hasta {len(self.grill_positions)} arepas", 
                                     font=('Arial', 9))
         self.order_label.grid(row=0, column=0, sticky="w")
+        
+        self.queue_label = ttk.Label(order_frame, text="", font=('Arial', 9))
+        self.queue_label.grid(row=0, column=1, sticky="e", padx=(20, 0))
     
     def create_compact_grill_panel(self, parent):
         """Crea el panel de parrilla más compacto"""
-        grill_frame = ttk.LabelFrame(parent, text="Parrilla (1x4)", padding="5")
+        grill_frame = ttk.LabelFrame(parent, text=f"Parrilla (1x{len(self.grill_positions)})", padding="5")
         grill_frame.grid(row=3, column=0, columnspan=4, sticky="ew", pady=2)
         
         self.grill_labels = []
         self.timer_labels = []
         
-        for i in range(4):
+        for i in range(len(self.grill_positions)):
             # Frame más compacto para cada posición
             pos_frame = ttk.Frame(grill_frame)
             pos_frame.grid(row=0, column=i, padx=5, pady=2)
@@ -295,7 +2411,7 @@ class ArepaController:
         
         self.delivery_labels = []
         
-        for i in range(4):
+        for i in range(len(self.delivery_positions)):
             # Frame más compacto
             pos_frame = ttk.Frame(delivery_frame)
             pos_frame.grid(row=0, column=i, padx=5, pady=2)
@@ -321,26 +2437,37 @@ class ArepaController:
         self.btn_start.grid(row=0, column=0, padx=2, pady=2)
         
         self.btn_stop = ttk.Button(control_frame, text="Detener", 
-                                  command=self.stop_process, width=12)
+                                  command=self.request_stop, width=12)
         self.btn_stop.grid(row=0, column=1, padx=2, pady=2)
         self.btn_stop.configure(state="disabled")
         
         self.btn_home = ttk.Button(control_frame, text="Home", 
-                                  command=self.go_to_home, width=12)
+                                  command=lambda: self.run_command("home"), width=12)
         self.btn_home.grid(row=0, column=2, padx=2, pady=2)
         
         self.btn_reset = ttk.Button(control_frame, text="Reset", 
-                                   command=self.reset_system, width=12)
+                                   command=lambda: self.run_command("reset"), width=12)
         self.btn_reset.grid(row=0, column=3, padx=2, pady=2)
         
         # Segunda fila de botones
         self.btn_check_robodk = ttk.Button(control_frame, text="Verificar RDK", 
-                                          command=self.check_robodk_connection, width=12)
+                                          command=lambda: self.run_command("check_robodk"), width=12)
         self.btn_check_robodk.grid(row=1, column=0, padx=2, pady=2)
         
         self.btn_test_targets = ttk.Button(control_frame, text="Test Targets", 
-                                          command=self.test_targets, width=12)
+                                          command=lambda: self.run_command("test_targets"), width=12)
         self.btn_test_targets.grid(row=1, column=1, padx=2, pady=2)
+        
+        self.btn_cancel = ttk.Button(control_frame, text="Cancelar", 
+                                    command=self.commands.cancel, width=12)
+        self.btn_cancel.grid(row=1, column=2, padx=2, pady=2)
+        self.btn_cancel.configure(state="disabled")
+        
+        # Avance del comando en curso
+        self.command_progress = ttk.Progressbar(control_frame, length=90, maximum=1.0)
+        self.command_progress.grid(row=1, column=3, padx=2, pady=2)
+        self.command_label = ttk.Label(control_frame, text="", font=('Arial', 8))
+        self.command_label.grid(row=2, column=0, columnspan=4, sticky="w")
     
     def create_compact_status_panel(self, parent):
         """Crea el panel de estado y log más compacto"""
@@ -365,29 +2492,42 @@ class ArepaController:
         
         log_frame.columnconfigure(0, weight=1)
     
+    @traced("log")
     def log_message(self, message):
         """Agrega un mensaje al log"""
+        timestamp = time.strftime("%H:%M:%S")
+        with self.hmi_log_lock:
+            self.hmi_log.append((next(self.hmi_log_counter), f"[{timestamp}] {message}"))
+        
         if self.log_text is None:
-            print(f"LOG: {message}")
+            if self.debug_mode:
+                print(f"LOG: {message}")
             return
             
-        timestamp = time.strftime("%H:%M:%S")
         full_message = f"[{timestamp}] {message}\n"
-        self.log_text.insert(tk.END, full_message)
-        self.log_text.see(tk.END)
         
         # También imprimir en consola para debug
         if self.debug_mode:
             print(full_message.strip())
         
-        self.root.update_idletasks()
+        def append():
+            self.log_text.insert(tk.END, full_message)
+            self.log_text.see(tk.END)
+        if not self.defer_to_hmi(append):
+            append()
+            self.root.update_idletasks()
     
+    @traced("gui")
     def update_status(self, status):
         """Actualiza el estado general"""
+        self.status_text = status
         if hasattr(self, 'status_label') and self.status_label:
-            self.status_label.config(text=status)
-            self.root.update_idletasks()
-        else:
+            def show():
+                self.status_label.config(text=status)
+            if not self.defer_to_hmi(show):
+                show()
+                self.root.update_idletasks()
+        elif self.debug_mode:
             print(f"STATUS: {status}")
     
     def on_arepa_selection_change(self):
@@ -395,6 +2535,8 @@ class ArepaController:
         if self.is_executing:
             return
         
+        self.selection_dirty = True
+        
         # Lista anterior
         previous_selected = self.selected_arepas.copy()
         
@@ -415,64 +2557,48 @@ class ArepaController:
             if arepa_id not in new_selected:
                 new_selected.append(arepa_id)
         
-        # Limitar a 4 arepas
-        if len(new_selected) > 4:
+        # Limitar a una arepa por posición de parrilla
+        limit = len(self.grill_positions)
+        if len(new_selected) > limit:
             last_arepa = new_selected[-1]
             self.arepa_vars[last_arepa].set(False)
             new_selected = new_selected[:-1]
-            messagebox.showwarning("Límite", "Solo se pueden seleccionar hasta 4 arepas")
+            messagebox.showwarning("Límite", f"Solo se pueden seleccionar hasta {limit} arepas")
         
         self.selected_arepas = new_selected
         
-        # Asignar orden de selección
-        for i, arepa_id in enumerate(self.selected_arepas):
-            self.arepas[arepa_id].selection_order = i + 1
-        
-        # Limpiar orden de las no seleccionadas
-        for arepa_id in self.arepas.keys():
-            if arepa_id not in self.selected_arepas:
-                self.arepas[arepa_id].selection_order = None
+        # Asignar orden de selección (y limpiar el de las no seleccionadas)
+        self.cell.ask("set_selection", self.selected_arepas)
         
         # Actualizar display
         if self.selected_arepas:
             order_text = f"Orden: {' → '.join(self.selected_arepas)}"
         else:
-            order_text = "Selecciona hasta 4 arepas"
+            order_text = f"Selecciona hasta {len(self.grill_positions)} arepas"
         
         self.order_label.config(text=order_text)
     
-    def test_targets(self):
+    def test_targets(self, command: Optional[OperatorCommand] = None) -> bool:
         """Prueba que todos los targets necesarios existan"""
         if self.is_executing:
-            messagebox.showwarning("Proceso activo", "No se puede probar targets durante la ejecución")
-            return
+            self.show_message("showwarning", "Proceso activo", "No se puede probar targets durante la ejecución")
+            return False
+        
+        if self.RDK is None:
+            self.show_message("showwarning", "RoboDK", "Conexión con RoboDK en curso")
+            return False
         
         self.log_message("🔍 PROBANDO EXISTENCIA DE TARGETS...")
         
         # Lista de todos los targets necesarios
-        required_targets = [
-            "Home",
-            # Posiciones intermedias
-            "Pos1_Estan1", "Pos1_Estan2",
-            # Estante 1
-            "Estan1_1_Agarre", "Estan1_2_Agarre", "Estan1_3_Agarre",
-            # Estante 2
-            "Estan2_1_Agarre", "Estan2_2_Agarre", "Estan2_3_Agarre",
-            # Parrilla - Posiciones normales
-            "Parrilla_Pos1", "Parrilla_Pos2", "Parrilla_Pos3", "Parrilla_Pos4",
-            "Parrilla_Arepa1", "Parrilla_Arepa2", "Parrilla_Arepa3", "Parrilla_Arepa4",
-            # Parrilla - Posiciones de giro
-            "Parrilla_Pos1_Giro", "Parrilla_Pos2_Giro", "Parrilla_Pos3_Giro", "Parrilla_Pos4_Giro",
-            "Parrilla_Giro_Pos1", "Parrilla_Giro_Pos2", "Parrilla_Giro_Pos3", "Parrilla_Giro_Pos4",
-            # Entrega - Target intermedio y posiciones finales
-            "Entrega1",
-            "Entrega_Pos1", "Entrega_Pos2", "Entrega_Pos3", "Entrega_Pos4"
-        ]
+        required_targets = self.get_required_targets()
         
         missing_targets = []
         existing_targets = []
         
-        for target_name in required_targets:
+        for i, target_name in enumerate(required_targets):
+            if command is not None:
+                command.progress(i / len(required_targets), target_name)
             if self.check_target_exists(target_name):
                 existing_targets.append(target_name)
                 self.log_message(f"✓ {target_name}")
@@ -483,55 +2609,532 @@ class ArepaController:
         self.log_message(f"📊 Existentes: {len(existing_targets)}, Faltantes: {len(missing_targets)}")
         
         if missing_targets:
-            messagebox.showerror("Targets Faltantes", 
-                               f"Faltan {len(missing_targets)} targets.\nRevisa el log.")
+            self.show_message("showerror", "Targets Faltantes", 
+                              f"Faltan {len(missing_targets)} targets.\nRevisa el log.")
         else:
             self.log_message("✅ TODOS LOS TARGETS DISPONIBLES")
-            messagebox.showinfo("Test OK", "Todos los targets están disponibles")
+            self.show_message("showinfo", "Test OK", "Todos los targets están disponibles")
+        return True
+    
+    def get_required_targets(self) -> List[str]:
+        """Lista de todos los targets que usa el controlador"""
+        return [
+            "Home",
+            # Posiciones intermedias
+            "Pos1_Estan1", "Pos1_Estan2",
+            # Estante 1
+            "Estan1_1_Agarre", "Estan1_2_Agarre", "Estan1_3_Agarre",
+            # Estante 2
+            "Estan2_1_Agarre", "Estan2_2_Agarre", "Estan2_3_Agarre",
+            # Entrega - Target intermedio
+            "Entrega1"
+        ] + [
+            # Parrilla - Posiciones normales y de giro
+            f"{name}{position}{suffix}" for name, suffix in (("Parrilla_Pos", ""), ("Parrilla_Arepa", ""),
+                                                             ("Parrilla_Pos", "_Giro"), ("Parrilla_Giro_Pos", ""))
+            for position in range(1, len(self.grill_positions) + 1)
+        ] + [f"Entrega_Pos{position}" for position in range(1, len(self.delivery_positions) + 1)]
     
     def check_target_exists(self, target_name: str) -> bool:
         """Verifica si un target existe"""
         try:
-            if ROBODK_AVAILABLE:
-                target = self.RDK.Item(target_name, ITEM_TYPE_TARGET)
-                return target.Valid()
-            else:
-                # En modo simulación, asumimos que todos existen
-                return True
+            # En modo simulación responde la estación simulada (snapshot o disposición aproximada)
+            return target_name in self.layout_targets or self.RDK.Item(target_name, ITEM_TYPE_TARGET).Valid()
+        except Exception as e:
+            return False
+    
+    def submit_order(self, items, source: str = "pos") -> OrderInfo:
+        """Valida y encola un pedido; seguro entre hilos y nunca bloquea (queue.Full si la cola está llena)"""
+        if not isinstance(items, list) or not items or not all(isinstance(item, str) for item in items):
+            raise ValueError("El pedido debe incluir una lista 'items' con productos o IDs de arepa")
+        if len(items) > len(self.grill_positions):
+            raise ValueError(f"Máximo {len(self.grill_positions)} arepas por pedido")
+        unknown = [item for item in items if self.inventory.product_of(item) is None]
+        if unknown:
+            raise ValueError(f"Arepas desconocidas: {', '.join(unknown)}")
+        products = self.order_products(items)
+        
+        with self.orders_lock:
+            # Cada unidad del lote sale de una posición distinta
+            for product, count in Counter(products).items():
+                in_service = [slot_id for slot_id in self.inventory.by_product[product]
+                              if slot_id not in self.quarantined]
+                if not in_service:
+                    raise ValueError(f"Estante en cuarentena: {', '.join(self.inventory.by_product[product])}")
+                if count > len(in_service):
+                    raise ValueError(f"Máximo {len(in_service)} de {product} por pedido")
+            missing = [product for product, count in Counter(products).items()
+                       if self.inventory.available(product, self.quarantined) < count]
+            if missing:
+                raise ValueError(f"Sin existencias de: {', '.join(missing)}")
+            
+            order = OrderInfo(f"P{next(self.order_counter):05d}", list(items),
+                              created=clock.time(), source=source)
+            order.eta = self.estimate_order_eta(len(items))
+            self.order_queue.put_nowait(order)
+            self.inventory.reserve(products)
+            self.orders[order.order_id] = order
+        return order
+    
+    def order_products(self, items: List[str]) -> List[str]:
+        """Productos de los ítems de un pedido (los IDs de estante son alias de su producto)"""
+        return [self.inventory.product_of(item) for item in items]
+    
+    def create_hmi_order(self, items: List[str]) -> OrderInfo:
+        """Registra la selección manual de la HMI como pedido en ejecución"""
+        self.check_quarantine(items)
+        with self.orders_lock:
+            missing = [item for item in items if self.inventory.slots[item].units <= 0
+                       or self.inventory.available(self.inventory.slots[item].product, self.quarantined) <= 0]
+            if missing:
+                raise ValueError(f"Sin existencias de: {', '.join(missing)}")
+            
+            now = clock.time()
+            order = OrderInfo(f"P{next(self.order_counter):05d}", list(items), status="cooking",
+                              created=now, started=now, source="hmi", slots=list(items))
+            order.eta = self.estimate_order_eta(len(items))
+            self.inventory.reserve(self.order_products(items))
+            self.orders[order.order_id] = order
+            self.active_orders = [order.order_id]
+        return order
+    
+    def estimate_arepa_cycle_duration(self) -> float:
+        """Tiempo de robot estimado por arepa (carga + volteo + entrega)"""
+        return (self.estimate_sequence_duration(self.build_transport_sequence("A1", 1), "Home")
+                + self.estimate_sequence_duration(self.build_flip_sequence("A1", 1), "Parrilla_Pos1")
+                + self.estimate_sequence_duration(self.build_delivery_sequence("A1", 1, 1), "Parrilla_Pos1")
+                + self.estimate_move_duration("Entrega_Pos1", "Entrega1", "L"))
+    
+    def estimate_order_eta(self, n_items: int) -> float:
+        """Hora estimada de entrega de un pedido nuevo (llamar con orders_lock tomado)"""
+        items_ahead = sum(len(order.items) for order in self.orders.values()
+                          if order.status in ("queued", "cooking"))
+        return (clock.time() + (items_ahead + n_items) * self.estimate_arepa_cycle_duration()
+                + self.cook_time_side1 + self.cook_time_side2)
+    
+    def order_retry_after(self) -> int:
+        """Segundos sugeridos al cliente antes de reintentar con la cola llena"""
+        return max(1, round(self.estimate_arepa_cycle_duration()))
+    
+    def order_to_dict(self, order: OrderInfo) -> dict:
+        """Representación JSON de un pedido"""
+        data = asdict(order)
+        if order.eta is None or order.completed is not None:
+            data["eta_seconds"] = None
+        else:
+            data["eta_seconds"] = round(max(0.0, order.eta - clock.time()), 1)
+        return data
+    
+    def list_orders(self) -> List[dict]:
+        """Lista todos los pedidos registrados"""
+        with self.orders_lock:
+            return [self.order_to_dict(order) for order in self.orders.values()]
+    
+    def get_order(self, order_id: str) -> Optional[dict]:
+        """Estado de un pedido"""
+        with self.orders_lock:
+            order = self.orders.get(order_id)
+            return None if order is None else self.order_to_dict(order)
+    
+    def get_available_stock(self) -> Dict[str, int]:
+        """Existencias disponibles (sin reservar) por producto y por ID de estante, alias de su producto
+
+        Las posiciones en cuarentena no cuentan.
+        """
+        with self.orders_lock:
+            stock = {product: self.inventory.available(product, self.quarantined)
+                     for product in self.inventory.by_product}
+            for slot_id, slot in self.inventory.slots.items():
+                stock[slot_id] = stock[slot.product]
+        return stock
+    
+    def shelf_report(self) -> dict:
+        """Unidades por posición y producto y solicitudes de reposición abiertas"""
+        with self.orders_lock:
+            report = self.inventory.to_dict()
+        for slot_id, slot in report["slots"].items():
+            slot["quarantined"] = slot_id in self.quarantined
+        return report
+    
+    def rank_shelf_slots(self):
+        """Ordena las posiciones de cada producto por el tiempo estimado de llevarlas a la parrilla"""
+        costs = {slot_id: self.estimate_sequence_duration(self.build_transport_sequence(slot_id, 1), "Home", slot_id)
+                 for slot_id in self.inventory.slots}
+        with self.orders_lock:
+            self.inventory.rank_slots(costs)
+    
+    def take_from_shelf(self, arepa_id: str):
+        """Descuenta la unidad que el robot sacó de su posición y pide reposición al llegar al mínimo"""
+        with self.orders_lock:
+            request = self.inventory.pick(arepa_id)
+        if request is not None:
+            self.log_message(f"🧺 Reponer {arepa_id} ({request['product']}): "
+                             f"quedan {request['units']} de {request['capacity']}")
+    
+    def replenish_shelves(self, slot_ids=None) -> List[str]:
+        """Confirma la reposición de posiciones de estantería (todas si slot_ids es None)"""
+        if slot_ids is not None:
+            if not isinstance(slot_ids, list) or not all(isinstance(slot_id, str) for slot_id in slot_ids):
+                raise ValueError("'slots' debe ser una lista de IDs de estante")
+            unknown = [slot_id for slot_id in slot_ids if slot_id not in self.inventory.slots]
+            if unknown:
+                raise ValueError(f"Estantes desconocidos: {', '.join(unknown)}")
+        with self.orders_lock:
+            refilled = self.inventory.refill(slot_ids, self.shelf_capacity)
+        if refilled:
+            self.log_message(f"🧺 Repuesto: {', '.join(refilled)}")
+        return refilled
+    
+    @traced("gui")
+    def poll_order_queue(self):
+        """Revisa periódicamente la cola de pedidos (hilo de la HMI)"""
+        try:
+            self.dispatch_orders()
+            queued = self.queued_order_count()
+            self.queue_label.config(text=f"Pedidos en cola: {queued}" if queued else "")
         except Exception as e:
+            self.log_message(f"✗ Error procesando pedidos: {str(e)}")
+        
+        self.root.after(ORDER_POLL_MS, self.poll_order_queue)
+    
+    def dispatch_orders(self) -> bool:
+        """Arranca un lote con los pedidos en cola si el sistema está libre (True = lote iniciado)"""
+        if (self.is_executing or self.selection_dirty or self.robot is None or self.commands.busy
+                or not self.supervisor.connected.is_set() or self.held_arepa is not None):
+            return False
+        batch = self.take_order_batch()
+        if not batch:
+            return False
+        self.start_order_batch(batch)
+        return self.is_executing
+    
+    def queued_order_count(self) -> int:
+        """Pedidos esperando lote"""
+        return self.order_queue.qsize() + (1 if self.pending_order else 0)
+    
+    def take_order_batch(self) -> List[OrderInfo]:
+        """Saca de la cola tantos pedidos como quepan en las posiciones de parrilla en servicio"""
+        batch: List[OrderInfo] = []
+        batch_items: List[str] = []
+        capacity = len(self.usable_grill_slots())
+        blocked = [slot_id for slot_id in self.inventory.slots if slot_id in self.quarantined]
+        while True:
+            order = self.pending_order
+            self.pending_order = None
+            if order is None:
+                try:
+                    order = self.order_queue.get_nowait()
+                except queue.Empty:
+                    break
+            
+            # Pedidos que ya no se pueden cocinar (cuarentenas posteriores a su llegada)
+            products = self.order_products(order.items)
+            with self.orders_lock:
+                alone = self.inventory.choose_slots(products, blocked)
+                slots = None if alone is None else self.inventory.choose_slots(products, blocked + batch_items)
+            if alone is None or len(order.items) > capacity:
+                reason = (f"sin posiciones con existencias en servicio para {', '.join(dict.fromkeys(products))}"
+                          if alone is None else f"solo {capacity} posiciones de parrilla en servicio")
+                self.reject_queued_order(order, reason)
+                continue
+            
+            # Cada producto sale de la posición no vacía más cercana que el lote no use ya
+            fits = len(batch_items) + len(order.items) <= capacity
+            if not fits or slots is None:
+                self.pending_order = order
+                break
+            order.slots = slots
+            batch.append(order)
+            batch_items.extend(slots)
+        return batch
+    
+    def reject_queued_order(self, order: OrderInfo, reason: str):
+        """Cierra en error un pedido en cola que ya no se puede cocinar y devuelve sus existencias"""
+        with self.orders_lock:
+            order.status = "error"
+            order.completed = clock.time()
+            self.inventory.release(self.order_products(order.items))
+            self.order_history.append(self.order_history_rows(order))
+        self.fault_stats["rejected_orders"] += 1
+        self.log_message(f"✗ Pedido {order.order_id} rechazado: {reason}")
+    
+    def start_order_batch(self, batch: List[OrderInfo]):
+        """Inicia el proceso de cocción para un lote de pedidos"""
+        items = [slot_id for order in batch for slot_id in order.slots]
+        
+        # Las entregas del lote anterior se consideran retiradas
+        self.clear_delivered_positions()
+        for item in items:
+            self.clear_arepa_info(item)
+        
+        with self.orders_lock:
+            now = clock.time()
+            for order in batch:
+                order.status = "cooking"
+                order.started = now
+            self.active_orders = [order.order_id for order in batch]
+        
+        self.set_selection(items)
+        self.log_message(f"🧾 Pedidos {', '.join(self.active_orders)}: {' → '.join(items)}")
+        if not self.start_process():
+            self.finish_active_orders()
+    
+    def set_selection(self, arepa_ids: List[str]):
+        """Fija la selección de arepas (y sus checkbuttons) desde código"""
+        self.selected_arepas = list(arepa_ids)
+        self.cell.ask("set_selection", self.selected_arepas)
+        if self.root is not None:
+            for arepa_id, var in self.arepa_vars.items():
+                var.set(arepa_id in self.selected_arepas)
+            self.order_label.config(text=f"Orden: {' → '.join(self.selected_arepas)}")
+    
+    def update_order_progress(self):
+        """Marca como entregados los pedidos del lote cuyas arepas ya se entregaron"""
+        with self.orders_lock:
+            for order_id in self.active_orders:
+                order = self.orders[order_id]
+                if order.status == "cooking" and all(
+                        self.arepas[item].state == ArepaState.DELIVERED for item in order.slots):
+                    order.status = "delivered"
+                    order.completed = clock.time()
+    
+    def finish_active_orders(self):
+        """Cierra el lote: los pedidos sin entregar quedan en error y lo no tomado deja de estar reservado"""
+        with self.orders_lock:
+            for order_id in self.active_orders:
+                order = self.orders[order_id]
+                if order.status != "delivered":
+                    order.status = "error"
+                    order.completed = clock.time()
+                # Al cerrar el lote todas sus arepas ya tienen su último estado
+                self.order_history.append(self.order_history_rows(order))
+            self.active_orders = []
+            self.inventory.set_reservations(self.queued_products())
+    
+    def order_history_rows(self, order: OrderInfo) -> List[dict]:
+        """Filas del historial de un pedido cerrado: una por arepa, con la hora de cada estado"""
+        rows = []
+        lateness = None if order.eta is None or order.completed is None else order.completed - order.eta
+        slots = order.slots or [None] * len(order.items)
+        for product, slot_id in zip(self.order_products(order.items), slots):
+            arepa = self.arepas[slot_id] if slot_id is not None else None
+            row = {"order_id": order.order_id, "source": order.source, "product": product, "slot": slot_id,
+                   "status": order.status, "arepa_state": arepa.state.value if arepa is not None else None,
+                   "created": order.created, "started": order.started, "eta": order.eta,
+                   "completed": order.completed, "lateness": lateness}
+            for state, at in (arepa.transitions if arepa is not None else ()):
+                row[f"t_{state.value}"] = at
+            delivered = row.get(f"t_{ArepaState.DELIVERED.value}")
+            row["latency"] = None if delivered is None else delivered - order.created
+            rows.append(row)
+        return rows
+    
+    def queued_products(self) -> List[str]:
+        """Productos reservados por pedidos en cola (llamar con orders_lock tomado)"""
+        return [product for order in self.orders.values() if order.status == "queued"
+                for product in self.order_products(order.items)]
+    
+    def clear_delivered_positions(self):
+        """Libera las posiciones de entrega (arepas retiradas por el cliente)"""
+        self.cell.ask("clear_deliveries")
+        for i in range(len(self.delivery_positions)):
+            self.mark_timeline(f"E{i + 1}", None)
+        self.update_delivery_display()
+    
+    def clear_arepa_info(self, arepa_id: str):
+        """Devuelve una arepa a su estado inicial"""
+        self.cell.ask("clear_arepa", arepa_id)
+    
+    def restock_shelves(self):
+        """Repone la estantería respetando lo reservado por pedidos en cola"""
+        with self.orders_lock:
+            self.inventory.refill(capacity=self.shelf_capacity)
+            self.inventory.set_reservations(self.queued_products())
+    
+    def start_order_server(self, host: str = ORDER_SERVER_HOST, port: int = ORDER_SERVER_PORT) -> bool:
+        """Inicia el servidor HTTP local de pedidos en un hilo aparte"""
+        try:
+            self.order_server = ThreadingHTTPServer((host, port), OrderRequestHandler)
+        except OSError as e:
+            self.log_message(f"⚠️ No se pudo iniciar el servidor de pedidos: {str(e)}")
+            return False
+        
+        self.order_server.daemon_threads = True
+        self.order_server.controller = self
+        threading.Thread(target=self.order_server.serve_forever, daemon=True).start()
+        self.log_message(f"🧾 Servidor de pedidos en http://{host}:{port}/orders")
+        return True
+    
+    def stop_order_server(self):
+        """Detiene el servidor de pedidos"""
+        if self.order_server is not None:
+            self.order_server.shutdown()
+            self.order_server.server_close()
+            self.order_server = None
+    
+    def start_state_server(self, host: str = STATE_SERVER_HOST, port: int = STATE_SERVER_PORT) -> bool:
+        """Publica el estado a HMIs en otros procesos (hmi_client.py) y recibe sus comandos"""
+        try:
+            self.state_server = StateServer((host, port), self)
+        except OSError as e:
+            self.log_message(f"⚠️ No se pudo iniciar el servidor de estado: {str(e)}")
             return False
+        
+        threading.Thread(target=self.state_server.serve_forever, daemon=True).start()
+        threading.Thread(target=self.state_server.publish_loop, name="PublicadorEstado", daemon=True).start()
+        self.log_message(f"🖥️ Estado publicado en {host}:{port} (python hmi_client.py)")
+        return True
+    
+    def stop_state_server(self):
+        """Detiene la publicación de estado"""
+        if self.state_server is not None:
+            self.state_server.stopped.set()
+            self.state_server.shutdown()
+            self.state_server.server_close()
+            self.state_server = None
+    
+    def hmi_state(self) -> dict:
+        """Estado que ven los visores remotos (JSON)"""
+        snapshot = self.cell.snapshot
+        return {
+            "version": snapshot.version,
+            "status": self.status_text,
+            "executing": self.is_executing,
+            "connected": self.supervisor.connected.is_set(),
+            "robot": self.robot_name,
+            "selection": list(self.selected_arepas),
+            "queued_orders": self.queued_order_count(),
+            "arepas": {arepa_id: {"name": arepa.name, "state": arepa.state.value,
+                                  "grill_position": arepa.grill_position,
+                                  "selection_order": arepa.selection_order}
+                       for arepa_id, arepa in snapshot.arepas.items()},
+            "grill": list(snapshot.grill_positions),
+            "timers": [None if timer is None else dict(timer) for timer in snapshot.grill_timers],
+            "delivery": list(snapshot.delivery_positions),
+            "quarantined": sorted(self.quarantined),
+            "command": None if self.commands.current is None else self.commands.current.label
+        }
+    
+    def hmi_log_since(self, seq: int) -> List[Tuple[int, str]]:
+        """Líneas de log posteriores a seq: [(seq, texto), ...]"""
+        with self.hmi_log_lock:
+            return [entry for entry in self.hmi_log if entry[0] > seq]
+    
+    def handle_hmi_command(self, message: dict, reply):
+        """Comando de un visor remoto; se ejecuta como los botones de la HMI local"""
+        name = message.get("name")
+        request_id = message.get("id")
+        if name not in HMI_COMMANDS:
+            reply({"type": "reply", "id": request_id, "ok": False, "error": f"Comando desconocido: {name}"})
+            return
+        
+        self.log_message(f"🖥️ Comando remoto: {name}")
+        if name == "cancel":
+            ok = self.commands.cancel()
+            reply({"type": "reply", "id": request_id, "ok": ok, "error": None if ok else "No hay un comando en curso"})
+            return
+        if name != "start":
+            # Home y Reset van al ejecutor de comandos; la respuesta sale al terminar
+            if name == "stop" and not self.is_executing:
+                reply({"type": "reply", "id": request_id, "ok": False, "error": "No hay un proceso en curso"})
+            elif name == "stop":
+                self.request_stop(on_done=lambda ok, error: reply({"type": "reply", "id": request_id,
+                                                                   "ok": ok, "error": error}))
+            elif not self.commands.submit(name, *self.command_spec(name),
+                                          on_done=lambda ok, error: reply({"type": "reply", "id": request_id,
+                                                                           "ok": ok, "error": error})):
+                reply({"type": "reply", "id": request_id, "ok": False, "error": "Hay otro comando en curso"})
+            return
+        
+        def run():
+            try:
+                ok = self.start_remote_selection(message.get("items"))
+                error = None if ok else "Comando rechazado (ver log)"
+            except ValueError as e:
+                ok, error = False, str(e)
+            except Exception as e:
+                self.log_message(f"✗ Error en comando remoto '{name}': {str(e)}")
+                ok, error = False, str(e)
+            reply({"type": "reply", "id": request_id, "ok": ok, "error": error})
+        
+        # El inicio fija la selección de la HMI local: corre en su hilo, como si se pulsara el botón
+        if self.root is not None:
+            self.root.after(0, run)
+        else:
+            threading.Thread(target=run, daemon=True).start()
+    
+    def start_remote_selection(self, items) -> bool:
+        """Inicio remoto con la selección items; ValueError si no se puede en este momento"""
+        if self.is_executing:
+            raise ValueError("El sistema ya está ejecutando un proceso")
+        if self.commands.busy:
+            raise ValueError("Hay un comando del operador en curso")
+        if not isinstance(items, list) or not items:
+            raise ValueError("Selecciona al menos una arepa antes de iniciar")
+        unknown = [item for item in items if item not in self.arepas]
+        if unknown:
+            raise ValueError(f"Arepas desconocidas: {', '.join(map(str, unknown))}")
+        if len(set(items)) != len(items) or len(items) > len(self.grill_positions):
+            raise ValueError(f"Selecciona hasta {len(self.grill_positions)} arepas distintas")
+        self.set_selection(items)
+        self.selection_dirty = True
+        return self.start_process()
     
     def start_process(self):
         """Inicia el proceso de cocción"""
         if not self.selected_arepas:
-            messagebox.showwarning("Sin selección", "Selecciona al menos una arepa antes de iniciar")
-            return
+            self.show_message("showwarning", "Sin selección", "Selecciona al menos una arepa antes de iniciar")
+            return False
         
         if self.is_executing:
-            messagebox.showwarning("En proceso", "El sistema ya está ejecutando un proceso")
-            return
+            self.show_message("showwarning", "En proceso", "El sistema ya está ejecutando un proceso")
+            return False
+        
+        if self.commands.busy:
+            self.show_message("showwarning", "Comando en curso", "Espera a que termine el comando del operador")
+            return False
         
         if not self.robot:
-            messagebox.showerror("Error", "Robot no inicializado")
-            return
+            self.show_message("showerror", "Error", "Robot no inicializado")
+            return False
+        
+        if self.held_arepa is not None:
+            self.show_message("showwarning", "Arepa en el gripper",
+                              f"{self.held_arepa} sigue tomada: pulsa Reset para abrir el gripper")
+            return False
         
         # Verificar targets críticos antes de iniciar
         critical_targets = ["Home", "Pos1_Estan1", "Pos1_Estan2", "Entrega1"]
         for target in critical_targets:
             if not self.check_target_exists(target):
-                messagebox.showerror("Error", f"Target crítico '{target}' no encontrado")
-                return
+                self.show_message("showerror", "Error", f"Target crítico '{target}' no encontrado")
+                return False
+        
+        # Selección manual: registrar como pedido y descontar existencias
+        if not self.active_orders:
+            try:
+                self.create_hmi_order(self.selected_arepas)
+            except ValueError as e:
+                self.show_message("showwarning", "Sin existencias", f"{str(e)}\nUsa Reset para reponer la estantería")
+                return False
         
-        self.is_executing = True
+        # El ciclo toma el robot solo si ningún comando lo tomó mientras tanto
+        with self.commands.lock:
+            if self.commands.current is not None:
+                self.show_message("showwarning", "Comando en curso", "Espera a que termine el comando del operador")
+                self.finish_active_orders()
+                return False
+            self.is_executing = True
+        self.selection_dirty = False
         self.stop_control = False
         
-        # Deshabilitar botones
-        self.btn_start.configure(state="disabled")
-        self.btn_stop.configure(state="normal")
+        self.set_controls_running(True)
         
-        # Deshabilitar selección de arepas
-        for btn in self.arepa_buttons.values():
-            btn.configure(state="disabled")
+        self.timeline = RunTimeline(timeline_lanes(len(self.grill_positions), len(self.delivery_positions)))
+        self.mark_timeline("Robot", "idle")
+        for i, arepa_id in enumerate(self.delivery_positions):
+            if arepa_id is not None:
+                self.mark_timeline(f"E{i + 1}", "occupied", arepa_id)
         
         self.log_message("=" * 40)
         self.log_message("INICIANDO PROCESO DE COCCIÓN")
@@ -541,13 +3144,27 @@ class ArepaController:
         # Iniciar hilo principal de control
         self.main_control_thread = threading.Thread(target=self.main_control_loop, daemon=True)
         self.main_control_thread.start()
+        return True
     
+    @traced()
     def main_control_loop(self):
         """Bucle principal de control"""
         try:
             self.update_status("Iniciando proceso...")
             
+            # Fallas aisladas del lote
+            self.batch_failed = set()
+            
+            # Posiciones de parrilla del lote (menor recorrido)
+            self.slot_plan = self.plan_grill_slots(self.selected_arepas)
+            
+            # Etapas del ciclo como programas nativos del robot (si están activados)
+            self.native_programs = {}
+            if self.native_config.get("enabled"):
+                self.prepare_native_programs()
+            
             # Ir a Home primero
+            self.apply_motion_profile(self.resolve_motion_profile("empty"))
             if not self.move_to_target("Home"):
                 self.log_message("✗ No se pudo ir a Home. Abortando.")
                 return
@@ -559,20 +3176,37 @@ class ArepaController:
                 if self.stop_control:
                     self.log_message("🛑 Proceso detenido")
                     break
+                if arepa_id in self.batch_failed:
+                    continue  # Descartada con su pedido
                     
                 self.log_message(f"--- {arepa_id} ({i+1}/{len(self.selected_arepas)}) ---")
                 
+                # Voltear/entregar primero lo que vencería durante esta carga
+                self.serve_grill_before(self.estimate_transport_duration(arepa_id))
+                if self.stop_control:
+                    self.log_message("🛑 Proceso detenido")
+                    break
+                if arepa_id in self.batch_failed:
+                    continue  # Su pedido falló mientras se atendía la parrilla
+                
                 success = self.transport_arepa_to_grill(arepa_id)
                 if not success:
-                    self.log_message(f"✗ Error transportando {arepa_id}")
-                    self.arepas[arepa_id].state = ArepaState.ERROR
-                    break
+                    if self.stop_control:
+                        self.log_message("🛑 Proceso detenido")
+                        break
+                    # Solo esta arepa (y su pedido) queda fuera; el resto del lote sigue
+                    self.log_message(f"✗ Error transportando {arepa_id} - se sigue con las demás")
+                    self.isolate_stage_failure(arepa_id, release_grill=True)
+                    continue
                 
                 self.update_grill_display()
-                time.sleep(0.5)
+                clock.sleep(0.5)
             
-            if not self.stop_control and all(self.arepas[aid].state != ArepaState.ERROR for aid in self.selected_arepas):
-                self.log_message("✓ TODAS TRANSPORTADAS - COCINANDO")
+            if not self.stop_control:
+                if self.batch_failed:
+                    self.log_message(f"✓ TRANSPORTE TERMINADO ({len(self.batch_failed)} fuera del lote) - COCINANDO")
+                else:
+                    self.log_message("✓ TODAS TRANSPORTADAS - COCINANDO")
                 self.update_status("Cocinando - Lado 1...")
                 self.process_cooking_phases()
         
@@ -582,60 +3216,39 @@ class ArepaController:
         finally:
             self.cleanup_process()
     
+    @traced()
     def process_cooking_phases(self):
         """Procesa las fases de cocción - CORREGIDO PARA PROCESAR TODAS LAS AREPAS"""
         try:
             while not self.stop_control:
-                current_time = time.time()
+                current_time = clock.time()
                 action_taken = False
                 
                 # Verificar arepas listas para voltear
                 for i, timer_info in enumerate(self.grill_timers):
                     if timer_info is None:
                         continue
-                    
-                    arepa_id = timer_info['arepa_id']
-                    arepa = self.arepas[arepa_id]
-                    elapsed = current_time - timer_info['start_time']
-                    
-                    # Verificar volteo (lado 1 → lado 2)
-                    if (timer_info['side'] == 1 and 
-                        elapsed >= self.cook_time_side1 and 
-                        arepa.state == ArepaState.COOKING_SIDE1):
-                        
-                        self.log_message(f"⏰ {arepa_id} listo para voltear")
-                        if not self.stop_control:
-                            if self.flip_arepa(arepa_id, i + 1):
-                                action_taken = True
-                    
-                    # Verificar entrega (lado 2 → entrega)
-                    elif (timer_info['side'] == 2 and 
-                          elapsed >= self.cook_time_side2 and 
-                          arepa.state == ArepaState.COOKING_SIDE2):
-                        
-                        self.log_message(f"⏰ {arepa_id} listo para entrega")
-                        if not self.stop_control:
-                            if self.deliver_arepa(arepa_id, i + 1):
-                                action_taken = True
-                                # *** FORZAR ACTUALIZACIÓN INMEDIATA DE DISPLAYS ***
-                                self.update_grill_display()
-                                self.update_delivery_display()
-                                self.root.update_idletasks()  # Forzar actualización GUI
+                    if self.process_grill_position(i, timer_info, current_time):
+                        action_taken = True
                 
-                # Verificar si todas las arepas están entregadas
+                # Verificar si todas las arepas están entregadas (o aisladas por una falla)
                 all_delivered = all(
-                    self.arepas[arepa_id].state == ArepaState.DELIVERED 
+                    self.arepas[arepa_id].state == ArepaState.DELIVERED or arepa_id in self.batch_failed
                     for arepa_id in self.selected_arepas
                 )
                 
                 if all_delivered:
-                    self.log_message("🎉 TODAS ENTREGADAS - COMPLETADO")
+                    if self.batch_failed:
+                        delivered = len(self.selected_arepas) - len(self.batch_failed)
+                        self.log_message(f"🎉 LOTE TERMINADO - {delivered} entregadas, "
+                                         f"{len(self.batch_failed)} con falla: {', '.join(sorted(self.batch_failed))}")
+                    else:
+                        self.log_message("🎉 TODAS ENTREGADAS - COMPLETADO")
                     self.update_status("Retornando a Home...")
                     
                     # *** ACTUALIZACIÓN FINAL DE DISPLAYS ANTES DE IR A HOME ***
                     self.update_grill_display()
                     self.update_delivery_display()
-                    self.root.update_idletasks()
                     
                     # REGRESAR A HOME PASANDO POR ENTREGA1 (MOVIMIENTOS INTERMEDIOS)
                     self.log_message("🏠 REGRESANDO A HOME CON MOVIMIENTOS INTERMEDIOS")
@@ -652,19 +3265,265 @@ class ArepaController:
                 if action_taken:
                     self.update_grill_display()
                     self.update_delivery_display()
+                else:
+                    # Todo cocina: esperar sobre la próxima acción en lugar de donde terminó el robot
+                    self.stage_for_next_action()
                 
-                time.sleep(0.5)
+                clock.sleep(self.cooking_poll_delay())
                 
         except Exception as e:
             self.log_message(f"✗ Error en cocción: {str(e)}")
     
+    def process_grill_position(self, index: int, timer_info: dict, current_time: float) -> bool:
+        """Voltea o entrega la arepa de una posición si su timer ya venció"""
+        arepa_id = timer_info['arepa_id']
+        arepa = self.arepas[arepa_id]
+        elapsed = current_time - timer_info['start_time']
+        
+        # Verificar volteo (lado 1 → lado 2)
+        if (timer_info['side'] == 1 and 
+            elapsed >= self.cook_time_side1 and 
+            arepa.state == ArepaState.COOKING_SIDE1):
+            
+            self.log_message(f"⏰ {arepa_id} listo para voltear")
+            if not self.stop_control:
+                self.response_expiry = timer_info['start_time'] + timer_info['duration']
+                flipped = self.flip_arepa(arepa_id, index + 1)
+                self.response_expiry = None
+                if flipped:
+                    return True
+                return self.isolate_stage_failure(arepa_id)
+        
+        # Verificar entrega (lado 2 → entrega)
+        elif (timer_info['side'] == 2 and 
+              elapsed >= self.cook_time_side2 and 
+              arepa.state == ArepaState.COOKING_SIDE2):
+            
+            self.log_message(f"⏰ {arepa_id} listo para entrega")
+            if not self.stop_control:
+                self.response_expiry = timer_info['start_time'] + timer_info['duration']
+                delivered = self.deliver_arepa(arepa_id, index + 1)
+                self.response_expiry = None
+                if delivered:
+                    # *** FORZAR ACTUALIZACIÓN INMEDIATA DE DISPLAYS ***
+                    self.update_grill_display()
+                    self.update_delivery_display()
+                    return True
+                return self.isolate_stage_failure(arepa_id)
+        
+        return False
+    
+    def next_grill_deadline(self) -> Optional[Tuple[float, int]]:
+        """Devuelve (segundos restantes, índice) del próximo timer de parrilla en vencer"""
+        current_time = clock.time()
+        deadlines = [
+            (timer_info['start_time'] + timer_info['duration'] - current_time, i)
+            for i, timer_info in enumerate(self.grill_timers)
+            if timer_info is not None
+        ]
+        return min(deadlines) if deadlines else None
+    
+    def serve_grill_before(self, duration: float):
+        """Atiende volteos/entregas que vencerían durante una operación de 'duration' segundos"""
+        while not self.stop_control:
+            deadline = self.next_grill_deadline()
+            if deadline is None or deadline[0] > duration:
+                return
+
+            remaining, index = deadline
+            if remaining > 0:
+                if self.stage_for_next_action():
+                    continue  # Recalcula la espera después de moverse
+                self.log_message(f"⏳ P{index + 1} vence en {remaining:.1f}s "
+                                 f"(antes de terminar la siguiente carga, ~{duration:.1f}s) - esperando")
+                wait_until = clock.time() + remaining
+                with tracer.span("wait_grill_deadline", "wait", grill_position=index + 1):
+                    while not self.stop_control and clock.time() < wait_until:
+                        clock.sleep(min(wait_until - clock.time(), 0.1))
+                continue
+
+            timer_info = self.grill_timers[index]
+            if not self.process_grill_position(index, timer_info, clock.time()):
+                return
+            self.update_grill_display()
+            self.update_delivery_display()
+
+    def next_grill_action(self) -> Optional[Tuple[float, str]]:
+        """(segundos hasta el vencimiento, target de aproximación) de la próxima acción de parrilla"""
+        deadline = self.next_grill_deadline()
+        if deadline is None:
+            return None
+        remaining, index = deadline
+        return remaining, f"Parrilla_Pos{index + 1}"
+
+    def stage_for_next_action(self) -> bool:
+        """Con el robot libre, lo adelanta a la aproximación de la próxima volteada/entrega
+
+        Solo si el movimiento estimado termina (con STAGING_MARGIN de holgura) antes
+        del vencimiento; si no, la propia secuencia hace la aproximación en fly-by.
+        Devuelve True si el robot quedó en la aproximación.
+        """
+        if not self.staging_enabled or self.stop_control:
+            return False
+        action = self.next_grill_action()
+        if action is None or action[1] == self.current_target:
+            return False
+        remaining, target = action
+        if not self.check_target_exists(target):
+            return False
+
+        self.apply_motion_profile(self.resolve_motion_profile("empty"))
+        duration = self.estimate_move_duration(self.current_target, target, "L")
+        if remaining < duration + self.staging_margin:
+            return False
+        if not self.check_sequence_in_cache([MoveStep(target, f"→ {target}")]):
+            return False
+        return self.staging_move(target)
+
+    def cooking_poll_delay(self) -> float:
+        """Espera del bucle de cocción; con anticipación despierta justo al vencer el próximo timer"""
+        deadline = self.next_grill_deadline()
+        if not self.staging_enabled or deadline is None:
+            return COOKING_POLL_PERIOD
+        return min(COOKING_POLL_PERIOD, max(deadline[0], STAGING_POLL_PERIOD))
+
+    @traced("motion", target="target_name")
+    @robot_activity("staging")
+    def staging_move(self, target_name: str) -> bool:
+        """MoveL sin bloquear a la aproximación; se cancela con Detener o si cambia la próxima acción"""
+        move_start = clock.time()
+        from_target = self.current_target
+        self.log_message(f"🎯 Anticipando: → {target_name} (próxima acción de parrilla)")
+        try:
+            self.apply_rounding(0)  # Punto fino: el robot queda detenido sobre la aproximación
+            self.current_target = None  # Posición intermedia hasta terminar
+            self.robot.MoveL(self.target_pose(target_name), False)
+            while self.robot.Busy():
+                action = self.next_grill_action()
+                if self.stop_control or action is None or action[1] != target_name:
+                    self.robot.Stop()
+                    self.staging_stats["cancelled"] += 1
+                    self.log_message(f"↩️ Anticipación a {target_name} cancelada")
+                    return False
+                clock.sleep(STAGING_POLL_PERIOD)
+        except Exception as e:
+            self.log_message(f"⚠️ Error anticipando {target_name}: {str(e)}")
+            return False
+
+        self.record_move_duration(from_target, target_name, "L", clock.time() - move_start)
+        self.current_target = target_name
+        self.staging_stats["staged"] += 1
+        return True
+
+    def record_response(self):
+        """Tiempo desde el vencimiento del timer hasta que el gripper toma la arepa"""
+        if self.response_expiry is None:
+            return
+        self.staging_stats["responses"] += 1
+        self.staging_stats["response_seconds"] += max(clock.time() - self.response_expiry, 0.0)
+        self.response_expiry = None
+
+    def staging_report(self) -> dict:
+        """Métricas del turno: movimientos anticipados y respuesta media vencimiento → agarre"""
+        stats = dict(self.staging_stats)
+        stats["response_mean_s"] = (round(stats["response_seconds"] / stats["responses"], 2)
+                                    if stats["responses"] else None)
+        return stats
+
+    def resolve_motion_profile(self, profile_class: str, arepa_id: Optional[str] = None) -> dict:
+        """Perfil efectivo de una clase de segmento: por defecto + config general + config del producto"""
+        profile = dict(DEFAULT_MOTION_PROFILES.get(profile_class, DEFAULT_MOTION_PROFILES["loaded"]))
+        profile.update(self.motion_profile_config.get("default", {}).get(profile_class, {}))
+        if arepa_id is not None:
+            # El producto se puede configurar por ID de estante o por nombre
+            products = self.motion_profile_config.get("products", {})
+            for key in (arepa_id, self.arepas[arepa_id].name):
+                profile.update(products.get(key, {}).get(profile_class, {}))
+        profile["name"] = profile_class
+        return profile
+    
+    def apply_motion_profile(self, profile: dict):
+        """Envía velocidad y aceleración al robot solo si cambian"""
+        self.active_profile = profile
+        speed_settings = (profile["speed"], profile["joint_speed"], profile["accel"], profile["joint_accel"])
+        if speed_settings == self.active_speed_settings:
+            return
+        self.robot.setSpeed(*speed_settings)
+        self.active_speed_settings = speed_settings
+        self.log_message(f"  ⚙ Perfil '{profile['name']}': {profile['speed']:g} mm/s, "
+                         f"{profile['joint_speed']:g} °/s")
+    
+    def profile_speed(self, profile: Optional[dict], move_type: str) -> float:
+        """Velocidad que determina la duración de un movimiento (clave del modelo de tiempos)"""
+        if profile is None:
+            return self.robot_speed
+        return profile["joint_speed"] if move_type in ("J", "ROT") else profile["speed"]
+    
+    def record_move_duration(self, from_target: Optional[str], to_target: str, move_type: str, duration: float,
+                             profile_name: Optional[str] = None):
+        """Registra la duración medida de un segmento (y su perfil) en el modelo de tiempos"""
+        if from_target is None or from_target == to_target:
+            return
+        profile = self.active_profile
+        if profile_name is None and profile is not None:
+            profile_name = profile["name"]
+        self.motion_model.record(from_target, to_target, move_type, self.profile_speed(profile, move_type),
+                                 duration, profile_name)
+        self.log_message(f"  ⏱ {from_target} → {to_target} [{profile_name or 'sin perfil'}]: {duration:.2f}s")
+    
+    def estimate_move_duration(self, from_target: Optional[str], to_target: str, move_type: str,
+                               speed: Optional[float] = None) -> float:
+        """Estima la duración de un segmento: medición, caché de trayectorias o valor por defecto"""
+        if from_target is not None:
+            if from_target == to_target:
+                return 0.0
+            estimate = self.motion_model.estimate(from_target, to_target, move_type,
+                                                  self.robot_speed if speed is None else speed)
+            if estimate is not None:
+                return estimate[0]
+            if self.trajectory_cache is not None:
+                entry = self.trajectory_cache.lookup(from_target, to_target, move_type)
+                if entry is not None and entry.get("duration") is not None:
+                    return entry["duration"]
+        return DEFAULT_MOVE_DURATIONS.get(move_type, DEFAULT_MOVE_DURATIONS["L"])
+    
+    def estimate_sequence_duration(self, steps: List[MoveStep], start_target: Optional[str] = None,
+                                   arepa_id: Optional[str] = None) -> float:
+        """Estima la duración total de una secuencia (movimientos + operaciones de gripper)"""
+        previous_target = start_target if start_target is not None else self.current_target
+        total = 0.0
+        for group in self.group_move_steps(steps):
+            # Tramo con puntos de paso: usar su tiempo medido completo si existe
+            estimate = None
+            if len(group) > 1 and previous_target is not None:
+                speed = self.profile_speed(self.resolve_motion_profile(group[-1].profile, arepa_id), "FLY")
+                estimate = self.motion_model.estimate(previous_target, self.chain_key(group, arepa_id), "FLY", speed)
+            if estimate is not None:
+                total += estimate[0]
+            else:
+                for step in group:
+                    speed = self.profile_speed(self.resolve_motion_profile(step.profile, arepa_id), step.move_type)
+                    total += self.estimate_move_duration(previous_target, step.target, step.move_type, speed)
+                    previous_target = step.target
+            previous_target = group[-1].target
+            
+            if group[-1].action:
+                total += self.gripper.expected_duration() if self.gripper else GRIPPER_MIN_DWELL
+        return total
+    
+    def estimate_transport_duration(self, arepa_id: str) -> float:
+        """Estima cuánto tarda llevar una arepa a la siguiente posición libre de parrilla"""
+        grill_pos = self.slot_plan.get(arepa_id) or self.get_available_grill_position() or 1
+        return self.estimate_sequence_duration(self.build_transport_sequence(arepa_id, grill_pos), arepa_id=arepa_id)
+    
+    @traced(arepa="arepa_id")
     def transport_arepa_to_grill(self, arepa_id: str) -> bool:
         """Transporta una arepa desde su estante a la parrilla usando MoveL"""
         try:
             self.log_message(f"=== TRANSPORTANDO {arepa_id} ===")
             
             # Cambiar estado inmediatamente
-            self.arepas[arepa_id].state = ArepaState.TRANSPORTING_TO_GRILL
+            self.cell.ask("set_state", arepa_id, ArepaState.TRANSPORTING_TO_GRILL)
             self.update_grill_display()
             
             # Obtener posición de parrilla
@@ -675,51 +3534,11 @@ class ArepaController:
             
             self.log_message(f"Posición parrilla: {grill_pos}")
             
-            # Definir secuencia de movimientos
-            intermediate_pos = self.get_intermediate_position(arepa_id)
-            source_pos = self.get_arepa_source_position(arepa_id)
-            parrilla_intermediate = f"Parrilla_Pos{grill_pos}"
-            parrilla_final = f"Parrilla_Arepa{grill_pos}"
-            
-            # Verificar que todos los targets existan
-            required_targets = [intermediate_pos, source_pos, parrilla_intermediate, parrilla_final]
-            for target in required_targets:
-                if not self.check_target_exists(target):
-                    self.log_message(f"✗ Target '{target}' no encontrado")
-                    return False
+            # Ejecutar secuencia de movimientos LINEALES (falla al tomar: estante; al dejar: parrilla)
+            if not self.run_stage_retrying(self.transport_stage(arepa_id, grill_pos), arepa_id, f"P{grill_pos}"):
+                return False
             
-            # Ejecutar secuencia de movimientos LINEALES
-            movements = [
-                (intermediate_pos, f"1. → {intermediate_pos}"),
-                (source_pos, f"2. → {source_pos}"),
-                (intermediate_pos, f"4. ← Intermedia"),
-                (parrilla_intermediate, f"5. → {parrilla_intermediate}"),
-                (parrilla_final, f"6. ↓ {parrilla_final}"),
-                (parrilla_intermediate, f"7. ↑ Intermedia")
-            ]
-            
-            for i, (target, description) in enumerate(movements):
-                if self.stop_control:
-                    self.log_message("🛑 Cancelado")
-                    return False
-                
-                self.log_message(description)
-                
-                if not self.move_to_target_linear(target):
-                    self.log_message(f"✗ Error en movimiento {i+1}")
-                    return False
-                
-                # Simular operaciones especiales
-                if i == 1:  # Después de llegar a source_pos
-                    self.log_message(f"3. Tomando {arepa_id}")
-                    time.sleep(1)
-                elif i == 4:  # Después de llegar a parrilla_final
-                    self.log_message(f"Colocando {arepa_id}")
-                    time.sleep(1)
-            
-            # Actualizar estado e iniciar cocción
-            self.arepas[arepa_id].state = ArepaState.COOKING_SIDE1
-            self.arepas[arepa_id].cook_start_time = time.time()
+            # Iniciar cocción (estado y timer)
             self.start_grill_timer(grill_pos, 1)
             
             self.log_message(f"✓ {arepa_id} EN POSICIÓN {grill_pos} - COCINANDO LADO 1")
@@ -729,69 +3548,23 @@ class ArepaController:
             self.log_message(f"✗ Error transportando {arepa_id}: {str(e)}")
             return False
     
+    @traced(arepa="arepa_id", grill_position="position")
     def flip_arepa(self, arepa_id: str, position: int) -> bool:
         """Voltea una arepa en la parrilla con movimientos lineales"""
         try:
             self.log_message(f"🔄 VOLTEANDO {arepa_id} POS {position}")
             
-            self.arepas[arepa_id].state = ArepaState.FLIPPING
+            self.cell.ask("set_state", arepa_id, ArepaState.FLIPPING)
+            self.mark_grill_pickup(position, "flipping", arepa_id)
             self.update_grill_display()
             
-            # Definir targets para la secuencia de volteo
-            parrilla_pos = f"Parrilla_Pos{position}"
-            parrilla_arepa = f"Parrilla_Arepa{position}"
-            parrilla_pos_giro = f"Parrilla_Pos{position}_Giro"
-            parrilla_giro_pos = f"Parrilla_Giro_Pos{position}"
-            
-            # Verificar targets
-            required_targets = [parrilla_pos, parrilla_arepa, parrilla_pos_giro, parrilla_giro_pos]
-            for target in required_targets:
-                if not self.check_target_exists(target):
-                    self.log_message(f"✗ Target '{target}' no encontrado")
-                    return False
-            
             # SECUENCIA DE VOLTEO CON MOVIMIENTOS LINEALES:
             self.log_message(f"🔄 Secuencia volteo {arepa_id}")
             
-            movements = [
-                (parrilla_pos, f"1. → {parrilla_pos}"),
-                (parrilla_arepa, f"2. ↓ Tomar arepa"),
-                (parrilla_pos, f"4. ↑ Con arepa"),
-                (parrilla_pos_giro, f"5. 🔄 Rotar Z"),
-                (parrilla_giro_pos, f"6. ↓ Dejar volteada"),
-                (parrilla_pos_giro, f"8. ↑ Subir"),
-                (parrilla_pos, f"9. 🔄 Rotar normal")
-            ]
-            
-            for i, (target, description) in enumerate(movements):
-                if self.stop_control:
-                    return False
-                
-                self.log_message(description)
-                
-                # Usar movimiento de rotación para cambios de orientación
-                if i in [3, 6]:  # Movimientos de rotación
-                    if i == 3:  # Rotación para voltear
-                        if not self.rotate_to_target(parrilla_pos, parrilla_pos_giro):
-                            return False
-                    else:  # Rotación de vuelta
-                        if not self.rotate_to_target(parrilla_pos_giro, parrilla_pos):
-                            return False
-                else:
-                    if not self.move_to_target_linear(target):
-                        return False
-                
-                # Operaciones especiales
-                if i == 1:  # Después de bajar
-                    self.log_message(f"3. Agarrando {arepa_id}")
-                    time.sleep(1)
-                elif i == 4:  # Después de bajar volteada
-                    self.log_message(f"7. Soltando {arepa_id} volteada")
-                    time.sleep(1)
-            
-            # Actualizar estado e iniciar timer lado 2
-            self.arepas[arepa_id].state = ArepaState.COOKING_SIDE2
-            self.arepas[arepa_id].flip_time = time.time()
+            if not self.run_stage_retrying(self.flip_stage(arepa_id, position), f"P{position}", f"P{position}"):
+                return False
+            
+            # Iniciar lado 2 (estado y timer)
             self.start_grill_timer(position, 2)
             
             self.log_message(f"✓ {arepa_id} VOLTEADA - COCINANDO LADO 2")
@@ -801,17 +3574,19 @@ class ArepaController:
             self.log_message(f"✗ Error volteando {arepa_id}: {str(e)}")
             return False
     
+    @traced(arepa="arepa_id", grill_position="grill_position")
     def deliver_arepa(self, arepa_id: str, grill_position: int) -> bool:
         """Entrega una arepa terminada con movimientos intermedios obligatorios"""
         try:
             self.log_message(f"📦 ENTREGANDO {arepa_id} POS {grill_position}")
             
-            self.arepas[arepa_id].state = ArepaState.TRANSPORTING_TO_DELIVERY
+            self.cell.ask("set_state", arepa_id, ArepaState.TRANSPORTING_TO_DELIVERY)
+            self.mark_grill_pickup(grill_position, "pickup", arepa_id)
             
-            # Encontrar posición de entrega disponible
+            # Encontrar posición de entrega disponible (y en servicio)
             delivery_pos = None
-            for i in range(4):
-                if self.delivery_positions[i] is None:
+            for i in range(len(self.delivery_positions)):
+                if self.delivery_positions[i] is None and f"E{i + 1}" not in self.quarantined:
                     delivery_pos = i + 1
                     break
             
@@ -819,69 +3594,34 @@ class ArepaController:
                 self.log_message("✗ Sin posiciones de entrega")
                 return False
             
-            parrilla_intermediate = f"Parrilla_Pos{grill_position}"
-            parrilla_final = f"Parrilla_Arepa{grill_position}"
-            entrega_intermedio = "Entrega1"  # TARGET INTERMEDIO OBLIGATORIO
-            entrega_pos = f"Entrega_Pos{delivery_pos}"
-            
-            # Verificar targets
-            required_targets = [parrilla_intermediate, parrilla_final, entrega_intermedio, entrega_pos]
-            for target in required_targets:
-                if not self.check_target_exists(target):
-                    self.log_message(f"✗ Target '{target}' no encontrado")
-                    return False
-            
-            # SECUENCIA: Parrilla → Entrega1 → Entrega_Pos# → Entrega1 (para siguiente arepa)
-            movements = [
-                (parrilla_intermediate, f"1. → {parrilla_intermediate}"),
-                (parrilla_final, f"2. ↓ Tomar terminada"),
-                (parrilla_intermediate, f"4. ↑ Con arepa"),
-                (entrega_intermedio, f"5. → {entrega_intermedio}"),  # PASO INTERMEDIO OBLIGATORIO
-                (entrega_pos, f"6. → {entrega_pos}")
-            ]
-            
-            for i, (target, description) in enumerate(movements):
-                if self.stop_control:
-                    return False
-                
-                self.log_message(description)
-                
-                if not self.move_to_target_linear(target):
-                    self.log_message(f"✗ Error entregando")
-                    return False
-                
-                if i == 1:  # Después de tomar la arepa
-                    self.log_message(f"3. Tomando {arepa_id} terminada")
-                    time.sleep(1)
-                elif i == 4:  # Después de llegar a entrega final
-                    self.log_message(f"7. Entregando {arepa_id} en E{delivery_pos}")
-                    time.sleep(1)
-            
             # MOVIMIENTO INTERMEDIO OBLIGATORIO: Regresar a Entrega1 después de entregar
             # (excepto si es la última arepa, que irá a Home)
             remaining_arepas = sum(1 for aid in self.selected_arepas 
                                  if self.arepas[aid].state != ArepaState.DELIVERED 
-                                 and aid != arepa_id)
+                                 and aid != arepa_id and aid not in self.batch_failed)
+            
+            # SECUENCIA: Parrilla → Entrega1 → Entrega_Pos# → Entrega1 (para siguiente arepa)
+            stage = self.delivery_stage(arepa_id, grill_position, delivery_pos, remaining_arepas > 0)
+            if not self.run_stage_retrying(stage, f"P{grill_position}", f"E{delivery_pos}"):
+                self.log_message(f"✗ Error entregando")
+                return False
             
-            if remaining_arepas > 0:
+            # El programa nativo ya incluye el regreso
+            if remaining_arepas > 0 and stage.name not in self.native_programs:
                 self.log_message("8. → Entrega1 (posición intermedia)")
-                if not self.move_to_target_linear(entrega_intermedio):
+                self.apply_motion_profile(self.resolve_motion_profile("empty", arepa_id))
+                if not self.move_to_target_linear("Entrega1"):
                     self.log_message("⚠️ Error regresando a posición intermedia")
                     # Continuar de todas formas
             
-            # Actualizar estados
-            self.arepas[arepa_id].state = ArepaState.DELIVERED
-            self.arepas[arepa_id].delivery_time = time.time()
-            
-            # Liberar posición de parrilla
-            self.grill_positions[grill_position - 1] = None
-            self.grill_timers[grill_position - 1] = None
-            
-            # Ocupar posición de entrega
-            self.delivery_positions[delivery_pos - 1] = arepa_id
+            # Actualizar estado, liberar posición de parrilla y ocupar la de entrega
+            self.cell.ask("deliver", arepa_id, grill_position, delivery_pos, clock.time())
+            self.mark_timeline(f"P{grill_position}", None)
+            self.mark_timeline(f"E{delivery_pos}", "occupied", arepa_id)
             
             # *** AGREGAR ESTA LÍNEA PARA ACTUALIZAR EL DISPLAY DE ENTREGA ***
             self.update_delivery_display()
+            self.update_order_progress()
             
             self.log_message(f"✓ {arepa_id} ENTREGADA EN E{delivery_pos}")
             return True
@@ -895,37 +3635,10 @@ class ArepaController:
         try:
             self.log_message("🏠 SECUENCIA RETORNO A HOME CON INTERMEDIO")
             
-            entrega_intermedio = "Entrega1"  # TARGET INTERMEDIO OBLIGATORIO
-            home_target = "Home"
-            
-            # Verificar targets
-            required_targets = [entrega_intermedio, home_target]
-            for target in required_targets:
-                if not self.check_target_exists(target):
-                    self.log_message(f"✗ Target '{target}' no encontrado")
-                    return False
-            
             # SECUENCIA OBLIGATORIA: Posición actual → Entrega1 → Home
-            movements = [
-                (entrega_intermedio, f"1. → {entrega_intermedio} (intermedio)"),
-                (home_target, f"2. → {home_target} (final)")
-            ]
-            
-            for i, (target, description) in enumerate(movements):
-                if self.stop_control:
-                    return False
-                
-                self.log_message(description)
-                
-                # Para Home usar MoveJ, para intermedio usar MoveL
-                if target == home_target:
-                    if not self.move_to_target(target):  # MoveJ para Home
-                        self.log_message(f"✗ Error yendo a Home")
-                        return False
-                else:
-                    if not self.move_to_target_linear(target):  # MoveL para intermedio
-                        self.log_message(f"✗ Error en movimiento intermedio")
-                        return False
+            if not self.run_stage(self.home_stage()):
+                self.log_message(f"✗ Error yendo a Home")
+                return False
             
             self.log_message("✓ Secuencia Home completada con movimientos intermedios")
             return True
@@ -933,114 +3646,826 @@ class ArepaController:
         except Exception as e:
             self.log_message(f"✗ Error regresando a Home: {str(e)}")
             return False
+
+    def build_transport_sequence(self, arepa_id: str, grill_pos: int) -> List[MoveStep]:
+        """Secuencia estante → parrilla para una arepa"""
+        intermediate_pos = self.get_intermediate_position(arepa_id)
+        source_pos = self.get_arepa_source_position(arepa_id)
+        parrilla_intermediate = f"Parrilla_Pos{grill_pos}"
+        parrilla_final = f"Parrilla_Arepa{grill_pos}"
+
+        return [
+            MoveStep(intermediate_pos, f"1. → {intermediate_pos}", fly_by=True),
+            MoveStep(source_pos, f"2. → {source_pos}", profile="approach",
+                     action="grasp", action_message=f"3. Tomando {arepa_id}"),
+            MoveStep(intermediate_pos, f"4. ← Intermedia", fly_by=True, profile="approach"),
+            MoveStep(parrilla_intermediate, f"5. → {parrilla_intermediate}", fly_by=True, profile="loaded"),
+            MoveStep(parrilla_final, f"6. ↓ {parrilla_final}", profile="approach",
+                     action="release", action_message=f"Colocando {arepa_id}"),
+            MoveStep(parrilla_intermediate, f"7. ↑ Intermedia")
+        ]
+
+    def build_flip_sequence(self, arepa_id: str, position: int) -> List[MoveStep]:
+        """Secuencia de volteo en una posición de parrilla"""
+        parrilla_pos = f"Parrilla_Pos{position}"
+        parrilla_arepa = f"Parrilla_Arepa{position}"
+        parrilla_pos_giro = f"Parrilla_Pos{position}_Giro"
+        parrilla_giro_pos = f"Parrilla_Giro_Pos{position}"
+
+        return [
+            MoveStep(parrilla_pos, f"1. → {parrilla_pos}", fly_by=True),
+            MoveStep(parrilla_arepa, f"2. ↓ Tomar arepa", profile="approach",
+                     action="grasp", action_message=f"3. Agarrando {arepa_id}"),
+            MoveStep(parrilla_pos, f"4. ↑ Con arepa", fly_by=True, profile="approach"),
+            MoveStep(parrilla_pos_giro, f"5. 🔄 Rotar Z", move_type="ROT", fly_by=True, profile="flip"),
+            MoveStep(parrilla_giro_pos, f"6. ↓ Dejar volteada", profile="approach",
+                     action="release", action_message=f"7. Soltando {arepa_id} volteada"),
+            MoveStep(parrilla_pos_giro, f"8. ↑ Subir", fly_by=True),
+            MoveStep(parrilla_pos, f"9. 🔄 Rotar normal", move_type="ROT", profile="flip")
+        ]
+
+    def build_delivery_sequence(self, arepa_id: str, grill_position: int, delivery_pos: int) -> List[MoveStep]:
+        """Secuencia parrilla → entrega (sin el regreso a Entrega1)"""
+        parrilla_intermediate = f"Parrilla_Pos{grill_position}"
+        parrilla_final = f"Parrilla_Arepa{grill_position}"
+        entrega_intermedio = "Entrega1"  # TARGET INTERMEDIO OBLIGATORIO
+        entrega_pos = f"Entrega_Pos{delivery_pos}"
+
+        return [
+            MoveStep(parrilla_intermediate, f"1. → {parrilla_intermediate}", fly_by=True),
+            MoveStep(parrilla_final, f"2. ↓ Tomar terminada", profile="approach",
+                     action="grasp", action_message=f"3. Tomando {arepa_id} terminada"),
+            MoveStep(parrilla_intermediate, f"4. ↑ Con arepa", fly_by=True, profile="approach"),
+            MoveStep(entrega_intermedio, f"5. → {entrega_intermedio}", fly_by=True,
+                     profile="loaded"),  # PASO INTERMEDIO OBLIGATORIO
+            MoveStep(entrega_pos, f"6. → {entrega_pos}", profile="approach",
+                     action="release", action_message=f"7. Entregando {arepa_id} en E{delivery_pos}")
+        ]
+
+    def build_home_sequence(self) -> List[MoveStep]:
+        """Secuencia de retorno a Home pasando por Entrega1"""
+        return [
+            MoveStep("Entrega1", f"1. → Entrega1 (intermedio)", fly_by=True),  # MoveL para intermedio
+            MoveStep("Home", f"2. → Home (final)", move_type="J")                # MoveJ para Home
+        ]
+
+    def travel_leg(self, from_target: str, to_target: str, profile_class: str,
+                   arepa_id: Optional[str] = None) -> Tuple[float, float]:
+        """(mm, s) de un tramo: tiempo medido si existe; si no, distancia entre poses / velocidad del perfil"""
+        start = self.get_target_position(from_target)
+        end = self.get_target_position(to_target)
+        distance = math.dist(start, end) if start is not None and end is not None else 0.0
+        speed = self.profile_speed(self.resolve_motion_profile(profile_class, arepa_id), "L")
+        estimate = self.motion_model.estimate(from_target, to_target, "L", speed)
+        return distance, estimate[0] if estimate is not None else distance / speed
+    
+    def batch_travel(self, arepa_ids: List[str], slots: Tuple[int, ...],
+                     legs: Dict[tuple, Tuple[float, float]]) -> Tuple[float, float]:
+        """(mm, s) entre estante, parrilla y entrega para un lote con una asignación de parrilla
+
+        Sigue las fases del ciclo: cargar en orden, voltear en orden y entregar en
+        orden; los tramos dentro de cada posición no dependen de la asignación.
+        """
+        def leg(from_target, to_target, profile_class, arepa_id):
+            key = (from_target, to_target, profile_class, arepa_id)
+            if key not in legs:
+                legs[key] = self.travel_leg(from_target, to_target, profile_class, arepa_id)
+            return legs[key]
+        
+        path = []
+        position = "Home"
+        for arepa_id, slot in zip(arepa_ids, slots):
+            intermediate = self.get_intermediate_position(arepa_id)
+            path += [leg(position, intermediate, "empty", arepa_id),
+                     leg(intermediate, f"Parrilla_Pos{slot}", "loaded", arepa_id)]
+            position = f"Parrilla_Pos{slot}"
+        for arepa_id, slot in zip(arepa_ids, slots):
+            path.append(leg(position, f"Parrilla_Pos{slot}", "empty", arepa_id))
+            position = f"Parrilla_Pos{slot}"
+        for arepa_id, slot in zip(arepa_ids, slots):
+            path += [leg(position, f"Parrilla_Pos{slot}", "empty", arepa_id),
+                     leg(f"Parrilla_Pos{slot}", "Entrega1", "loaded", arepa_id)]
+            position = "Entrega1"
+        path.append(leg(position, "Home", "empty", None))
+        return sum(distance for distance, _ in path), sum(seconds for _, seconds in path)
+    
+    def plan_grill_slots(self, arepa_ids: List[str]) -> Dict[str, int]:
+        """Posición de parrilla de cada arepa del lote con el menor tiempo de recorrido
+
+        Con "slot_assignment": "selection" en config_arepas.json se mantiene el
+        orden de selección (posición N para la N-ésima arepa).
+        """
+        slots = self.usable_grill_slots()
+        selection = dict(zip(arepa_ids, slots))
+        if self.slot_assignment != "travel" or len(arepa_ids) > len(slots):
+            return selection
+        
+        legs: Dict[tuple, Tuple[float, float]] = {}
+        best = min(itertools.permutations(slots, len(arepa_ids)),
+                   key=lambda assignment: self.batch_travel(arepa_ids, assignment, legs)[1])
+        
+        # Recorrido con la asignación elegida frente al orden de selección
+        planned = self.batch_travel(arepa_ids, best, legs)
+        baseline = self.batch_travel(arepa_ids, tuple(selection.values()), legs)
+        for key, (distance, seconds) in (("planned", planned), ("selection", baseline)):
+            self.shift_travel[key][0] += distance
+            self.shift_travel[key][1] += seconds
+        self.log_message(f"🧭 Parrilla por recorrido: "
+                         f"{', '.join(f'{a}→P{s}' for a, s in zip(arepa_ids, best))} "
+                         f"({planned[0] / 1000:.2f} m, {planned[1]:.1f} s; por orden de selección "
+                         f"{baseline[0] / 1000:.2f} m, {baseline[1]:.1f} s)")
+        return dict(zip(arepa_ids, best))
+    
+    def transport_stage(self, arepa_id: str, grill_pos: int) -> CycleStage:
+        return CycleStage(f"{NATIVE_PROGRAM_PREFIX}T_{arepa_id}_P{grill_pos}", "transport",
+                          self.build_transport_sequence(arepa_id, grill_pos), arepa_id)
+
+    def flip_stage(self, arepa_id: str, position: int) -> CycleStage:
+        return CycleStage(f"{NATIVE_PROGRAM_PREFIX}G_{arepa_id}_P{position}", "flip",
+                          self.build_flip_sequence(arepa_id, position), arepa_id)
+
+    def delivery_stage(self, arepa_id: str, grill_position: int, delivery_pos: int,
+                       return_to_intermediate: bool) -> CycleStage:
+        """Entrega; con regreso a Entrega1 si quedan arepas (la última va a Home)"""
+        name = f"{NATIVE_PROGRAM_PREFIX}E_{arepa_id}_P{grill_position}_E{delivery_pos}"
+        return CycleStage(name + ("_R" if return_to_intermediate else ""), "delivery",
+                          self.build_delivery_sequence(arepa_id, grill_position, delivery_pos), arepa_id,
+                          "Entrega1" if return_to_intermediate else None)
+
+    def home_stage(self) -> CycleStage:
+        return CycleStage(f"{NATIVE_PROGRAM_PREFIX}Home", "home", self.build_home_sequence())
+
+    def plan_cycle(self, arepa_ids: List[str]) -> List[CycleStage]:
+        """Etapas previstas de un ciclo: parrilla por orden de selección y entregas en las posiciones libres"""
+        snapshot = self.cell.snapshot
+        free_deliveries = [i + 1 for i, arepa_id in enumerate(snapshot.delivery_positions) if arepa_id is None]
+        if len(arepa_ids) > min(len(snapshot.grill_positions), len(free_deliveries)):
+            raise ValueError(f"{len(arepa_ids)} arepas no caben en la parrilla o en las entregas libres")
+
+        slots = self.slot_plan if set(self.slot_plan) == set(arepa_ids) else self.plan_grill_slots(arepa_ids)
+        stages = []
+        for arepa_id in arepa_ids:
+            stages.append(self.transport_stage(arepa_id, slots[arepa_id]))
+        for arepa_id in arepa_ids:
+            stages.append(self.flip_stage(arepa_id, slots[arepa_id]))
+        for i, arepa_id in enumerate(arepa_ids):
+            stages.append(self.delivery_stage(arepa_id, slots[arepa_id], free_deliveries[i], i < len(arepa_ids) - 1))
+        stages.append(self.home_stage())
+        return stages
+
+    def native_programs_supported(self) -> bool:
+        """Los programas nativos necesitan RoboDK (el robot simulado no tiene post-procesadores)"""
+        return ROBODK_AVAILABLE and self.robot is not None
+
+    def write_native_program(self, stage: CycleStage):
+        """Genera (o regenera) en la estación el programa de RoboDK de una etapa"""
+        previous = self.RDK.Item(stage.name, ITEM_TYPE_PROGRAM)
+        if previous.Valid():
+            previous.Delete()
+        program = self.RDK.AddProgram(stage.name, self.robot)
+        program.ShowInstructions(False)
+
+        speed_settings = None
+        rounding = None
+        previous_target = None
+        for group in self.group_move_steps(stage.program_steps):
+            for j, step in enumerate(group):
+                profile = self.resolve_motion_profile(step.profile, stage.arepa_id)
+                settings = (profile["speed"], profile["joint_speed"], profile["accel"], profile["joint_accel"])
+                if settings != speed_settings:
+                    program.setSpeed(*settings)
+                    speed_settings = settings
+
+                # Puntos de paso con redondeo; el final del tramo es punto fino (el
+                # gripper o el tramo siguiente no deben empezar antes de llegar)
+                step_rounding = 0
+                if j < len(group) - 1:
+                    step_rounding = self.flyby_rounding(previous_target, step.target, group[j + 1].target)
+                if step_rounding != rounding:
+                    program.setRounding(step_rounding)
+                    rounding = step_rounding
+
+                target = self.layout_targets.get(step.target)
+                if target is None:
+                    target = self.RDK.Item(step.target, ITEM_TYPE_TARGET)
+                if step.move_type == "L":
+                    program.MoveL(target)
+                else:
+                    program.MoveJ(target)
+                previous_target = step.target
+
+            if group[-1].action:
+                self.write_gripper_instructions(program, group[-1].action)
+        return program
+
+    def write_gripper_instructions(self, program, action: str):
+        """Gripper en el programa nativo: salida, espera de confirmación y tiempo mínimo"""
+        close = action == "grasp"
+        confirm_input = self.gripper.di_closed if close else self.gripper.di_open
+        program.setDO(self.gripper.do_close, 1 if close else 0)
+        if confirm_input is not None:
+            program.waitDI(confirm_input, 1, self.gripper.confirm_timeout * 1000)
+        program.Pause(self.gripper.min_dwell * 1000)
+
+    def make_native_program(self, program, folder: str, upload: bool = False) -> Tuple[bool, str]:
+        """Traduce un programa con el post-procesador del robot (y lo envía al controlador)"""
+        run_mode = robolink.RUNMODE_MAKE_ROBOTPROG_AND_UPLOAD if upload else robolink.RUNMODE_MAKE_ROBOTPROG
+        result = program.MakeProgram(folder, run_mode)
+        # Versiones recientes devuelven (éxito, log); las anteriores solo el estado
+        if isinstance(result, tuple):
+            return bool(result[0]), str(result[1])
+        return bool(result), ""
+
+    def set_post_processor(self, post_processor: Optional[str]):
+        """Elige el post-procesador del robot (p. ej. "Motoman"); None deja el de la estación"""
+        if post_processor:
+            self.robot.setParam("PostProcessor", post_processor)
+
+    @traced("motion")
+    def prepare_native_programs(self) -> int:
+        """Genera los programas nativos del ciclo planificado y, si se pide, los envía al robot"""
+        self.native_programs = {}
+        if not self.native_programs_supported():
+            self.log_message("⚠️ Programas nativos: sin RoboDK, se mueve desde el PC")
+            return 0
+        try:
+            stages = self.plan_cycle(self.selected_arepas)
+            self.set_post_processor(self.native_config.get("post_processor"))
+            upload = self.native_config.get("upload", False)
+            folder = self.native_config.get("folder", NATIVE_PROGRAMS_DIR)
+            if upload:
+                os.makedirs(folder, exist_ok=True)
+            for stage in stages:
+                program = self.write_native_program(stage)
+                if upload:
+                    made, message = self.make_native_program(program, folder, upload=True)
+                    if not made:
+                        self.log_message(f"⚠️ {stage.name} no se pudo enviar: {message}")
+                        continue
+                    program.setRunType(robolink.PROGRAM_RUN_ON_ROBOT)
+                self.native_programs[stage.name] = program
+        except Exception as e:
+            self.log_message(f"⚠️ Programas nativos no disponibles: {str(e)}")
+            self.native_programs = {}
+            return 0
+        self.log_message(f"🤖 {len(self.native_programs)} programas nativos listos")
+        return len(self.native_programs)
+
+    def run_stage_retrying(self, stage: CycleStage, pick_slot: str, place_slot: str) -> bool:
+        """Ejecuta una etapa con reintentos y espera creciente ante fallas transitorias
+
+        Cada reintento sigue desde el tramo que falló. Si se agotan los intentos o
+        la falla es permanente (target inexistente, segmento inviable), el lugar
+        donde falló queda en cuarentena (pick_slot si la arepa aún no estaba
+        tomada, place_slot si ya lo estaba) y la arepa queda aislada del lote.
+        En el transporte, la unidad se descuenta del estante apenas se pasa el
+        agarre, aunque después la etapa falle o se detenga. Si la etapa falla con
+        la arepa en el gripper, recover_held_arepa la saca antes de seguir.
+        """
+        started = clock.time()
+        grasp_index = next((i for i, step in enumerate(stage.steps) if step.action == "grasp"), None)
+        release_index = next((i for i, step in enumerate(stage.steps)
+                              if step.action == "release" and grasp_index is not None and i > grasp_index), None)
+        done: Optional[int] = 0  # Pasos completados (None = programa nativo, sin detalle)
+        picked = False
+        for attempt in range(1, self.stage_attempts + 1):
+            if done:
+                ok = self.run_move_sequence(stage.steps[done:], stage.arepa_id)
+            else:
+                ok = self.run_stage(stage)
+            done = None if done is None or self.sequence_progress is None else done + self.sequence_progress
+            if not picked and grasp_index is not None and (done > grasp_index if done is not None else ok):
+                picked = True
+                if stage.kind == "transport":
+                    self.take_from_shelf(stage.arepa_id)
+            if ok:
+                if attempt > 1:
+                    self.fault_stats["recovered"] += 1
+                    self.fault_stats["recovery_seconds"] += clock.time() - started
+                    self.log_message(f"🩹 {stage.name} recuperada en el intento {attempt}")
+                return True
+            if self.stop_control:
+                return False
+            
+            remaining = stage.steps[done:] if done is not None else stage.steps
+            if attempt == self.stage_attempts or self.stage_failure_is_permanent(remaining):
+                break
+            delay = self.retry_backoff * 2 ** (attempt - 1)
+            self.fault_stats["retries"] += 1
+            self.log_message(f"🔁 {stage.name}: reintento {attempt + 1}/{self.stage_attempts} en {delay:.1f}s")
+            wait_until = clock.time() + delay
+            while not self.stop_control and clock.time() < wait_until:
+                clock.sleep(min(wait_until - clock.time(), 0.1))
+            if self.stop_control:
+                return False
+        
+        self.fault_stats["failed_stages"] += 1
+        self.quarantine(place_slot if picked else pick_slot, f"falló {stage.name}")
+        # Del programa nativo no se sabe en qué paso falló: se asume que la arepa puede estar tomada
+        held = done is None or (picked and (release_index is None or done <= release_index))
+        if held and stage.arepa_id is not None:
+            self.recover_held_arepa(stage.arepa_id)
+        if stage.arepa_id is not None:
+            # Sin detalle del programa nativo no se sabe si la arepa quedó en la parrilla
+            self.isolate_arepa(stage.arepa_id, release_grill=done is not None and not picked)
+        return False
+    
+    def recover_held_arepa(self, arepa_id: str) -> bool:
+        """Falla con la arepa en el gripper: la suelta en el descarte o detiene el lote en Home
+
+        Con "discard_target" en "fault_handling" el robot la lleva ahí por Entrega1,
+        abre el gripper y el lote sigue (True). Sin descarte, o si no se puede
+        llegar, va a Home con la arepa tomada, detiene el lote y avisa al
+        operador; el Reset abre el gripper.
+        """
+        if self.discard_target and self.check_target_exists(self.discard_target):
+            self.log_message(f"🗑️ {arepa_id} al descarte ({self.discard_target})")
+            steps = [MoveStep("Entrega1", "→ Entrega1", fly_by=True, profile="loaded"),
+                     MoveStep(self.discard_target, f"→ {self.discard_target}", profile="approach",
+                              action="release", action_message=f"Soltando {arepa_id} en el descarte")]
+            if self.run_move_sequence(steps, arepa_id):
+                return True
+            self.log_message(f"✗ No se pudo dejar {arepa_id} en el descarte")
+        
+        self.held_arepa = arepa_id
+        self.log_message(f"🛑 {arepa_id} quedó en el gripper: Home y lote detenido")
+        steps = [replace(step, profile="loaded") for step in self.build_home_sequence()]
+        if not self.run_move_sequence(steps, arepa_id):
+            self.log_message(f"⚠️ No se pudo ir a Home con {arepa_id} tomada")
+        self.stop_control = True
+        self.show_message("showerror", "Arepa en el gripper",
+                          f"{arepa_id} quedó tomada después de una falla y el lote se detuvo.\n\n"
+                          f"Sostén la arepa y pulsa Reset para abrir el gripper.")
+        return False
+    
+    def stage_failure_is_permanent(self, steps: List[MoveStep]) -> bool:
+        """Una falla que un reintento no arregla: target inexistente o segmento inviable"""
+        if any(not self.check_target_exists(target) for target in dict.fromkeys(step.target for step in steps)):
+            return True
+        return not self.check_sequence_in_cache(steps)
+    
+    def quarantine(self, slot: str, reason: str):
+        """Saca de servicio un estante ("A1"), posición de parrilla ("P2") o de entrega ("E3") hasta el Reset"""
+        if slot in self.quarantined:
+            return
+        self.quarantined[slot] = reason
+        self.fault_stats["quarantined"] += 1
+        self.log_message(f"🚧 {slot} en cuarentena ({reason}) - Reset para volver a usarlo")
+    
+    def check_quarantine(self, items: List[str]):
+        """ValueError si algún estante pedido está en cuarentena"""
+        blocked = [item for item in items if item in self.quarantined]
+        if blocked:
+            raise ValueError(f"Estante en cuarentena: {', '.join(blocked)}")
+    
+    def blocked_grill_slots(self) -> List[int]:
+        """Posiciones de parrilla en cuarentena"""
+        return [i + 1 for i in range(len(self.grill_positions)) if f"P{i + 1}" in self.quarantined]
+    
+    def usable_grill_slots(self) -> List[int]:
+        """Posiciones de parrilla en servicio"""
+        blocked = self.blocked_grill_slots()
+        return [slot for slot in range(1, len(self.grill_positions) + 1) if slot not in blocked]
+    
+    def isolate_arepa(self, arepa_id: str, release_grill: bool):
+        """La arepa queda en error y su pedido se cierra; el resto del lote sigue
+
+        Las arepas del mismo pedido que aún no salieron del estante se descartan
+        y vuelven a las existencias.
+        """
+        self.cell.ask("fail", arepa_id, release_grill)
+        position = self.arepas[arepa_id].grill_position
+        if release_grill and position is not None:
+            self.mark_timeline(f"P{position}", None)
+        self.batch_failed.add(arepa_id)
+        self.fault_stats["failed_arepas"] += 1
+        
+        skipped = []
+        with self.orders_lock:
+            for order_id in self.active_orders:
+                order = self.orders[order_id]
+                if arepa_id not in order.slots or order.status != "cooking":
+                    continue
+                order.status = "error"
+                order.completed = clock.time()
+                for item in order.slots:
+                    if item not in self.batch_failed and self.arepas[item].state == ArepaState.IDLE:
+                        self.batch_failed.add(item)
+                        self.inventory.release([self.inventory.slots[item].product])
+                        skipped.append(item)
+        self.fault_stats["skipped_arepas"] += len(skipped)
+        
+        self.log_message(f"⚠️ {arepa_id} en ERROR, aislada del lote"
+                         + (f" (se descartan {', '.join(skipped)} de su pedido)" if skipped else ""))
+        self.update_grill_display()
+    
+    def isolate_stage_failure(self, arepa_id: str, release_grill: bool = False) -> bool:
+        """Aísla una arepa cuya etapa falló, si run_stage_retrying no lo hizo ya (False si fue por Detener)"""
+        if self.stop_control:
+            return False
+        if arepa_id not in self.batch_failed:
+            self.isolate_arepa(arepa_id, release_grill)
+        return True
+    
+    def fault_report(self) -> dict:
+        """Métricas de recuperación del turno y lugares en cuarentena"""
+        return {"stats": dict(self.fault_stats), "quarantined": dict(self.quarantined)}
+    
+    def run_stage(self, stage: CycleStage) -> bool:
+        """Ejecuta una etapa con su programa nativo si está cargado; si no, movimiento a movimiento"""
+        program = self.native_programs.get(stage.name)
+        if program is None:
+            if self.native_programs:
+                self.log_message(f"  ℹ {stage.name} fuera del plan: movimientos desde el PC")
+            return self.run_move_sequence(stage.steps, stage.arepa_id)
+        self.sequence_progress = None  # El controlador no informa hasta dónde llegó
+        if not self.check_sequence_in_cache(stage.program_steps):
+            return False
+        return self.run_native_program(stage, program)
+
+    @traced("motion")
+    @robot_activity("moving")
+    def run_native_program(self, stage: CycleStage, program) -> bool:
+        """Lanza el programa de una etapa y espera su fin: handshake al inicio y al final"""
+        self.log_message(f"🤖 Programa nativo {stage.name}")
+        start = clock.time()
+        from_target = self.current_target
+        try:
+            program.RunProgram()
+            while program.Busy():
+                if self.stop_control:
+                    program.Stop()
+                    self.log_message("🛑 Cancelado")
+                    return False
+                clock.sleep(NATIVE_POLL_PERIOD)
+        except Exception as e:
+            self.log_message(f"✗ Error en programa {stage.name}: {str(e)}")
+            self.current_target = None
+            return False
+        finally:
+            # El programa cambió velocidad y redondeo en el controlador
+            self.active_speed_settings = None
+            self.active_rounding = None
+
+        self.current_target = stage.program_steps[-1].target
+        self.record_move_duration(from_target, stage.name, "PROG", clock.time() - start, stage.kind)
+        return True
+
+    def enumerate_motion_segments(self) -> List[Tuple[str, str, str]]:
+        """Enumera todos los segmentos (origen, destino, tipo) que el controlador puede emitir"""
+        sequences = []
+        for arepa_id in self.arepas:
+            for grill_pos in range(1, len(self.grill_positions) + 1):
+                sequences.append(self.build_transport_sequence(arepa_id, grill_pos))
+        for position in range(1, len(self.grill_positions) + 1):
+            sequences.append(self.build_flip_sequence("", position))
+            for delivery_pos in range(1, len(self.delivery_positions) + 1):
+                delivery = self.build_delivery_sequence("", position, delivery_pos)
+                delivery.append(MoveStep("Entrega1", "8. → Entrega1"))
+                sequences.append(delivery)
+        sequences.append(self.build_home_sequence())
+
+        segments = set()
+        for sequence in sequences:
+            for previous, step in zip(sequence, sequence[1:]):
+                segments.add((previous.target, step.target, step.move_type))
+
+        # Transiciones entre secuencias: el robot puede quedar en el final de
+        # cualquier secuencia (o en Home) antes de empezar la siguiente
+        end_targets = {sequence[-1].target for sequence in sequences} | {"Home"}
+        for sequence in sequences:
+            first = sequence[0]
+            for end_target in end_targets:
+                if end_target != first.target:
+                    segments.add((end_target, first.target, first.move_type))
+
+        return sorted(segments)
+
+    def check_sequence_in_cache(self, steps: List[MoveStep]) -> bool:
+        """Consulta la caché de trayectorias antes de mover el robot"""
+        if self.trajectory_cache is None:
+            return True
+
+        previous_target = self.current_target
+        for step in steps:
+            if previous_target is not None and previous_target != step.target:
+                entry = self.trajectory_cache.lookup(previous_target, step.target, step.move_type)
+                if entry is not None and not entry.get("feasible", False):
+                    self.log_message(f"✗ Segmento inviable (caché): {previous_target} → {step.target} "
+                                     f"({entry.get('verdict', '?')})")
+                    return False
+            previous_target = step.target
+        return True
+
+    @traced("motion", arepa="arepa_id")
+    def run_move_sequence(self, steps: List[MoveStep], arepa_id: Optional[str] = None) -> bool:
+        """Ejecuta una secuencia de movimientos y sus operaciones de gripper (perfiles del producto arepa_id)
+
+        self.sequence_progress queda con los pasos completados (por tramos enteros),
+        para que un reintento siga desde el tramo que falló.
+        """
+        self.sequence_progress = 0
+        
+        # Verificar que todos los targets existan
+        for target in dict.fromkeys(step.target for step in steps):
+            if not self.check_target_exists(target):
+                self.log_message(f"✗ Target '{target}' no encontrado")
+                return False
+
+        # Descartar antes de mover si la caché marca algún segmento como inviable
+        if not self.check_sequence_in_cache(steps):
+            return False
+
+        previous_target = self.current_target
+        step_number = 0
+        for group in self.group_move_steps(steps):
+            group_start = clock.time()
+            group_from = previous_target
+            chained = len(group) > 1
+
+            # Los puntos de paso se envían sin bloquear (con redondeo) y el
+            # punto fino final espera a que termine todo el tramo
+            for j, step in enumerate(group):
+                step_number += 1
+                if self.stop_control:
+                    self.log_message("🛑 Cancelado")
+                    return False
+
+                self.log_message(step.description)
+                self.apply_motion_profile(self.resolve_motion_profile(step.profile, arepa_id))
+
+                rounding = None
+                if j < len(group) - 1:
+                    rounding = self.flyby_rounding(previous_target, step.target, group[j + 1].target)
+
+                if step.move_type == "ROT":
+                    moved = self.rotate_to_target(previous_target, step.target, rounding, record=not chained)
+                elif step.move_type == "J":
+                    moved = self.move_to_target(step.target, rounding, record=not chained)
+                else:
+                    moved = self.move_to_target_linear(step.target, rounding, record=not chained)
+
+                if not moved:
+                    self.log_message(f"✗ Error en movimiento {step_number}")
+                    return False
+                previous_target = step.target
+
+            if chained:
+                self.record_move_duration(group_from, self.chain_key(group, arepa_id), "FLY", clock.time() - group_start,
+                                          "+".join(dict.fromkeys(step.profile for step in group)))
+
+            # Operaciones especiales
+            last_step = group[-1]
+            if last_step.action:
+                self.log_message(last_step.action_message)
+                if not self.operate_gripper(last_step.action):
+                    return False
+            self.sequence_progress += len(group)
+
+        return True
+    
+    def group_move_steps(self, steps: List[MoveStep]) -> List[List[MoveStep]]:
+        """Agrupa la secuencia en tramos: puntos de paso (fly-by) terminados en un punto fino"""
+        groups: List[List[MoveStep]] = []
+        current: List[MoveStep] = []
+        for i, step in enumerate(steps):
+            current.append(step)
+            if not step.fly_by or step.action or i == len(steps) - 1:
+                groups.append(current)
+                current = []
+        return groups
+    
+    def chain_key(self, group: List[MoveStep], arepa_id: Optional[str] = None) -> str:
+        """Destino compuesto de un tramo con puntos de paso (para el modelo de tiempos)"""
+        parts = []
+        for step in group:
+            speed = self.profile_speed(self.resolve_motion_profile(step.profile, arepa_id), step.move_type)
+            parts.append(f"{step.target}@{speed:g}")
+        return ">".join(parts)
+    
+    def generate_layout_targets(self):
+        """Calcula una vez las poses paramétricas de parrilla y entrega ("grill_layout" en config_arepas.json)
+
+        {"frame": "Parrilla", "first_slot": [x, y, z, rx, ry, rz], "pitch": [0, 150, 0],
+         "approach": 120, "flip_rotation": 180,
+         "delivery": {"frame": "Entrega", "first_slot": [...], "pitch": [150, 0, 0]}}
+        """
+        self.layout_targets = {}
+        self.grill_layout = None
+        layout = self.settings.get("grill_layout")
+        if not layout:
+            return
+        try:
+            grill_frame = self.frame_pose_values(layout.get("frame"))
+            delivery_frame = self.frame_pose_values((layout.get("delivery") or {}).get("frame"))
+            poses = layout_target_poses(layout, grill_frame, delivery_frame,
+                                        len(self.grill_positions), len(self.delivery_positions))
+        except (KeyError, ValueError, TypeError, IndexError) as e:
+            self.log_message(f"⚠️ grill_layout inválido, se usan los targets de la estación: {str(e)}")
+            return
+        self.layout_targets = {name: self.make_pose(values) for name, values in poses.items()}
+        self.grill_layout = layout
+        self.log_message(f"📐 {len(poses)} targets de parrilla/entrega calculados desde el marco")
+    
+    def frame_pose_values(self, frame_name: Optional[str]) -> List[float]:
+        """Pose de un marco de referencia en el marco activo del robot (identidad si no se indica)"""
+        if not frame_name:
+            return [0.0] * 6
+        frame = self.RDK.Item(frame_name, ITEM_TYPE_FRAME)
+        if not frame.Valid():
+            raise ValueError(f"marco '{frame_name}' no encontrado")
+        if not ROBODK_AVAILABLE:
+            return list(frame.Pose().values)
+        active_frame = self.robot.PoseAbs() * self.robot.PoseFrame()
+        values = robomath.Pose_2_TxyzRxyz(robomath.invH(active_frame) * frame.PoseAbs())
+        return list(values[:3]) + [math.degrees(value) for value in values[3:]]
+    
+    def make_pose(self, values: List[float]):
+        """[x, y, z, rx, ry, rz] (mm, °) → pose del backend (Mat de RoboDK o MockPose)"""
+        if not ROBODK_AVAILABLE:
+            return MockPose(values)
+        return robomath.TxyzRxyz_2_Pose(list(values[:3]) + [math.radians(value) for value in values[3:]])
+    
+    def target_pose(self, target_name: str):
+        """Pose de un target: la paramétrica si existe o la del target de la estación (None si no existe)"""
+        pose = self.layout_targets.get(target_name)
+        if pose is not None:
+            return pose
+        target = self.RDK.Item(target_name, ITEM_TYPE_TARGET)
+        return target.Pose() if target.Valid() else None
+    
+    def get_target_position(self, target_name: Optional[str]) -> Optional[List[float]]:
+        """Posición XYZ (mm) de un target, o None si no se conoce"""
+        if target_name is None:
+            return None
+        try:
+            return list(self.target_pose(target_name).Pos())
+        except Exception:
+            return None
+    
+    def flyby_rounding(self, previous_target: Optional[str], target: str, next_target: str) -> float:
+        """Radio de redondeo para atravesar un punto de paso sin invadir los tramos vecinos"""
+        position = self.get_target_position(target)
+        if position is None:
+            return FLYBY_ROUNDING_MAX
+        
+        lengths = []
+        for neighbour in (previous_target, next_target):
+            neighbour_position = self.get_target_position(neighbour)
+            if neighbour_position is not None:
+                lengths.append(sum((a - b) ** 2 for a, b in zip(position, neighbour_position)) ** 0.5)
+        if not lengths:
+            return FLYBY_ROUNDING_MAX
+        return min(FLYBY_ROUNDING_MAX, FLYBY_ROUNDING_RATIO * min(lengths))
+    
+    def apply_rounding(self, rounding: Optional[float]):
+        """Ajusta el redondeo del robot solo si cambia (None = punto fino)"""
+        value = self.robot_rounding if rounding is None else rounding
+        if value != self.active_rounding:
+            self.robot.setRounding(value)
+            self.active_rounding = value
     
-    def move_to_target_linear(self, target_name: str) -> bool:
+    def describe_rounding(self, rounding: Optional[float]) -> str:
+        """Sufijo de log para movimientos fly-by"""
+        return "" if rounding is None else f" (fly-by r={rounding:.0f}mm)"
+    
+    @traced("motion", target="target_name", rounding="rounding")
+    @robot_activity("moving")
+    def move_to_target_linear(self, target_name: str, rounding: Optional[float] = None, record: bool = True) -> bool:
         """Mueve el robot a un target usando MoveL (movimiento lineal)"""
+        move_start = clock.time()
         try:
             if ROBODK_AVAILABLE:
                 # Verificar que el target existe
-                target = self.RDK.Item(target_name, ITEM_TYPE_TARGET)
-                if not target.Valid():
+                pose = self.target_pose(target_name)
+                if pose is None:
                     self.log_message(f"✗ Target '{target_name}' no encontrado")
                     return False
                 
-                pose = target.Pose()
-                self.log_message(f"  → LINEAR: {target_name}")
+                self.log_message(f"  → LINEAR: {target_name}{self.describe_rounding(rounding)}")
                 
-                # Usar MoveL para movimiento lineal
-                result = self.robot.MoveL(pose)
+                # Usar MoveL para movimiento lineal (sin bloquear en puntos de paso)
+                self.apply_rounding(rounding)
+                result = self.robot.MoveL(pose, rounding is None)
                 
                 self.log_message(f"  ✓ LINEAR OK: {target_name}")
                 
             else:
-                # Modo simulación
-                self.log_message(f"  → SIM LINEAR: {target_name}")
-                time.sleep(0.6)  # Tiempo simulado para movimiento lineal
+                # Modo simulación: el robot mock calcula la duración por distancia, perfil y redondeo
+                self.log_message(f"  → SIM LINEAR: {target_name}{self.describe_rounding(rounding)}")
+                self.apply_rounding(rounding)
+                self.robot.MoveL(self.target_pose(target_name), rounding is None)
                 self.log_message(f"  ✓ SIM LINEAR OK: {target_name}")
             
+            if record and rounding is None:
+                self.record_move_duration(self.current_target, target_name, "L", clock.time() - move_start)
+            self.current_target = target_name
             return True
             
         except Exception as e:
+            if self.recover_connection():
+                return self.move_to_target_linear(target_name, rounding, record)
+            
             error_msg = f"✗ Error MoveL a {target_name}: {str(e)}"
             self.log_message(error_msg)
             
             if ROBODK_AVAILABLE:
-                messagebox.showerror("Error MoveL", 
-                                   f"No se pudo hacer movimiento lineal a '{target_name}'.\n\nError: {str(e)}")
+                self.show_message("showerror", "Error MoveL",
+                                  f"No se pudo hacer movimiento lineal a '{target_name}'.\n\nError: {str(e)}")
             
             return False
     
-    def move_to_target(self, target_name: str) -> bool:
+    @traced("motion", target="target_name", rounding="rounding")
+    @robot_activity("moving")
+    def move_to_target(self, target_name: str, rounding: Optional[float] = None, record: bool = True) -> bool:
         """Mueve el robot a un target específico (mantiene MoveJ para Home y posiciones de seguridad)"""
+        move_start = clock.time()
         try:
             if ROBODK_AVAILABLE:
-                target = self.RDK.Item(target_name, ITEM_TYPE_TARGET)
-                if not target.Valid():
+                pose = self.target_pose(target_name)
+                if pose is None:
                     self.log_message(f"✗ Target '{target_name}' no encontrado")
                     return False
                 
-                pose = target.Pose()
-                self.log_message(f"  → JOINT: {target_name}")
+                self.log_message(f"  → JOINT: {target_name}{self.describe_rounding(rounding)}")
                 
                 # Usar MoveJ para movimientos articulares (Home, etc.)
-                result = self.robot.MoveJ(pose)
+                self.apply_rounding(rounding)
+                result = self.robot.MoveJ(pose, rounding is None)
                 
                 self.log_message(f"  ✓ JOINT OK: {target_name}")
                 
             else:
                 # Modo simulación
-                self.log_message(f"  → SIM JOINT: {target_name}")
-                time.sleep(0.8)
+                self.log_message(f"  → SIM JOINT: {target_name}{self.describe_rounding(rounding)}")
+                self.apply_rounding(rounding)
+                self.robot.MoveJ(self.target_pose(target_name), rounding is None)
                 self.log_message(f"  ✓ SIM JOINT OK: {target_name}")
             
+            if record and rounding is None:
+                self.record_move_duration(self.current_target, target_name, "J", clock.time() - move_start)
+            self.current_target = target_name
             return True
             
         except Exception as e:
+            if self.recover_connection():
+                return self.move_to_target(target_name, rounding, record)
+            
             error_msg = f"✗ Error MoveJ a {target_name}: {str(e)}"
             self.log_message(error_msg)
             
             if ROBODK_AVAILABLE:
-                messagebox.showerror("Error MoveJ", 
-                                   f"No se pudo mover a '{target_name}'.\n\nError: {str(e)}")
+                self.show_message("showerror", "Error MoveJ",
+                                  f"No se pudo mover a '{target_name}'.\n\nError: {str(e)}")
             
             return False
     
-    def rotate_to_target(self, from_target: str, to_target: str) -> bool:
+    @traced("motion", target="to_target", rounding="rounding")
+    @robot_activity("moving")
+    def rotate_to_target(self, from_target: str, to_target: str, rounding: Optional[float] = None,
+                         record: bool = True) -> bool:
         """Realiza una rotación específica solo en eje Z entre dos targets usando MoveL"""
+        move_start = clock.time()
         try:
             if ROBODK_AVAILABLE:
-                # Obtener poses de ambos targets
-                target_from = self.RDK.Item(from_target, ITEM_TYPE_TARGET)
-                target_to = self.RDK.Item(to_target, ITEM_TYPE_TARGET)
+                # Obtener poses de ambos targets (exactas si el volteo es paramétrico)
+                pose_from = self.target_pose(from_target)
+                pose_to = self.target_pose(to_target)
                 
-                if not target_from.Valid() or not target_to.Valid():
+                if pose_from is None or pose_to is None:
                     self.log_message(f"✗ Targets rotación inválidos: {from_target} -> {to_target}")
                     return False
                 
-                pose_to = target_to.Pose()
-                
-                self.log_message(f"  🔄 ROT LINEAR Z: {from_target} -> {to_target}")
+                self.log_message(f"  🔄 ROT LINEAR Z: {from_target} -> {to_target}{self.describe_rounding(rounding)}")
                 
                 # Usar MoveJ para rotación suave
-                self.robot.MoveJ(pose_to)
+                self.apply_rounding(rounding)
+                self.robot.MoveJ(pose_to, rounding is None)
                 
                 self.log_message(f"  ✓ ROT OK: {to_target}")
                 
             else:
                 # Modo simulación
-                self.log_message(f"  🔄 SIM ROT Z: {from_target} -> {to_target}")
-                time.sleep(1.0)  # Simular tiempo de rotación
+                self.log_message(f"  🔄 SIM ROT Z: {from_target} -> {to_target}{self.describe_rounding(rounding)}")
+                self.apply_rounding(rounding)
+                self.robot.MoveJ(self.target_pose(to_target), rounding is None)
                 self.log_message(f"  ✓ SIM ROT OK: {to_target}")
             
+            if record and rounding is None:
+                self.record_move_duration(from_target, to_target, "ROT", clock.time() - move_start)
+            self.current_target = to_target
             return True
             
         except Exception as e:
+            if self.recover_connection():
+                return self.rotate_to_target(from_target, to_target, rounding, record)
+            
             error_msg = f"✗ Error rotación {from_target} -> {to_target}: {str(e)}"
             self.log_message(error_msg)
             
             if ROBODK_AVAILABLE:
-                messagebox.showerror("Error rotación", 
-                                   f"No se pudo rotar.\n\nError: {str(e)}")
+                self.show_message("showerror", "Error rotación",
+                                  f"No se pudo rotar.\n\nError: {str(e)}")
             
             return False
     
@@ -1072,51 +4497,39 @@ class ArepaController:
         return None
     
     def assign_grill_position(self, arepa_id: str) -> Optional[int]:
-        """Asigna una posición de parrilla a una arepa respetando el orden"""
-        arepa = self.arepas[arepa_id]
-        if arepa.selection_order is None:
+        """Asigna una posición de parrilla a una arepa según el plan del lote"""
+        if self.arepas[arepa_id].selection_order is None:
             self.log_message(f"✗ Arepa {arepa_id} sin orden")
             return None
         
-        # Intentar asignar en la posición correspondiente al orden
-        preferred_position = arepa.selection_order
-        
-        if preferred_position <= 4 and self.grill_positions[preferred_position - 1] is None:
-            position = preferred_position
-        else:
-            # Si no, buscar la primera disponible
-            position = self.get_available_grill_position()
-            if position is None:
-                self.log_message("✗ Sin posiciones parrilla")
-                return None
-        
-        self.grill_positions[position - 1] = arepa_id
-        arepa.grill_position = position
+        # La posición del plan (o del orden de selección) o, si está ocupada, la primera disponible
+        position = self.cell.ask("assign_grill", arepa_id, self.slot_plan.get(arepa_id),
+                                 tuple(self.blocked_grill_slots()))
+        if position is None:
+            self.log_message("✗ Sin posiciones parrilla")
         return position
     
     def start_grill_timer(self, position: int, side: int):
         """Inicia el timer visual de una posición de parrilla"""
-        if position < 1 or position > 4:
+        if position < 1 or position > len(self.grill_positions):
             self.log_message(f"✗ Posición inválida: {position}")
             return
         
-        arepa_id = self.grill_positions[position - 1]
+        duration = self.cook_time_side1 if side == 1 else self.cook_time_side2
+        arepa_id = self.cell.ask("start_timer", position, side, duration, clock.time())
         if arepa_id is None:
             self.log_message(f"✗ Sin arepa en posición {position}")
             return
         
-        self.grill_timers[position - 1] = {
-            'start_time': time.time(),
-            'duration': self.cook_time_side1 if side == 1 else self.cook_time_side2,
-            'side': side,
-            'arepa_id': arepa_id
-        }
-        
+        self.mark_timeline(f"P{position}", f"side{side}", arepa_id)
         self.log_message(f"⏲️ Timer {arepa_id} - Lado {side} - P{position}")
     
+    @traced("gui")
     def update_timers(self):
         """Actualiza los timers visuales"""
-        current_time = time.time()
+        if self.root is None:
+            return
+        current_time = clock.time()
         
         for i, timer_info in enumerate(self.grill_timers):
             if timer_info is None:
@@ -1141,14 +4554,20 @@ class ArepaController:
         # Programar siguiente actualización
         self.root.after(1000, self.update_timers)
     
+    @traced("gui")
     def update_grill_display(self):
         """Actualiza el display de la parrilla"""
-        for i in range(4):
-            arepa_id = self.grill_positions[i]
-            if arepa_id is None:
+        if self.root is None or self.defer_to_hmi(self.update_grill_display):
+            return
+        snapshot = self.cell.snapshot
+        for i in range(len(snapshot.grill_positions)):
+            arepa_id = snapshot.grill_positions[i]
+            if arepa_id is None and f"P{i + 1}" in self.quarantined:
+                self.grill_labels[i].config(text="Cuarentena", background="gray")
+            elif arepa_id is None:
                 self.grill_labels[i].config(text="Vacío", background="lightgray")
             else:
-                arepa = self.arepas[arepa_id]
+                arepa = snapshot.arepas[arepa_id]
                 if arepa.state == ArepaState.TRANSPORTING_TO_GRILL:
                     self.grill_labels[i].config(text=f"{arepa_id}\nMoviendo", background="yellow")
                 elif arepa.state == ArepaState.COOKING_SIDE1:
@@ -1164,15 +4583,19 @@ class ArepaController:
         
         self.root.update_idletasks()
     
+    @traced("gui")
     def update_delivery_display(self):
         """Actualiza el display de entrega - MEJORADO PARA CONFIRMACIÓN VISUAL"""
-        for i in range(4):
-            arepa_id = self.delivery_positions[i]
+        if self.root is None or self.defer_to_hmi(self.update_delivery_display):
+            return
+        snapshot = self.cell.snapshot
+        for i in range(len(snapshot.delivery_positions)):
+            arepa_id = snapshot.delivery_positions[i]
             if arepa_id is None:
                 self.delivery_labels[i].config(text="Vacío", background="lightgray", foreground="black")
             else:
                 # Verificar que la arepa esté realmente entregada
-                arepa = self.arepas[arepa_id]
+                arepa = snapshot.arepas[arepa_id]
                 if arepa.state == ArepaState.DELIVERED:
                     self.delivery_labels[i].config(text=f"{arepa_id}\nListo", background="lightgreen", foreground="black")
                 else:
@@ -1181,6 +4604,25 @@ class ArepaController:
         
         self.root.update_idletasks()
     
+    def request_stop(self, on_done=None):
+        """Detener: no pasa por el ejecutor de comandos, así nunca espera detrás de otro comando
+
+        stop_control se marca en el acto (el ciclo lo revisa entre movimientos) y solo
+        la espera del hilo de control y la limpieza corren en segundo plano.
+        on_done(ok, error) se llama al terminar, desde ese hilo.
+        """
+        self.stop_control = True
+        def finish():
+            ok, error = True, None
+            try:
+                self.stop_process()
+            except Exception as e:
+                self.log_message(f"✗ Error deteniendo: {str(e)}")
+                ok, error = False, str(e)
+            if on_done is not None:
+                on_done(ok, error)
+        threading.Thread(target=finish, name="Detener", daemon=True).start()
+    
     def stop_process(self):
         """Detiene el proceso actual"""
         self.stop_control = True
@@ -1193,111 +4635,341 @@ class ArepaController:
         
         self.cleanup_process()
     
+    def set_controls_running(self, running: bool):
+        """Habilita/deshabilita botones y selección según haya un proceso en curso"""
+        if self.root is None:
+            return
+        self.btn_start.configure(state="disabled" if running else "normal")
+        self.btn_stop.configure(state="normal" if running else "disabled")
+        for btn in self.arepa_buttons.values():
+            btn.configure(state="disabled" if running else "normal")
+    
     def cleanup_process(self):
         """Limpia el proceso y restaura el estado"""
         self.is_executing = False
         self.stop_control = False
         
-        # Habilitar botones
-        self.btn_start.configure(state="normal")
-        self.btn_stop.configure(state="disabled")
-        
-        # Habilitar selección de arepas
-        for btn in self.arepa_buttons.values():
-            btn.configure(state="normal")
+        self.set_controls_running(False)
         
         if not self.stop_control:
             self.update_status("Proceso completado")
         else:
             self.update_status("Proceso detenido")
         
+        self.finish_active_orders()
+        self.save_motion_model()
+        if self.write_reports:
+            self.write_timeline_report()
+        if isinstance(self.robot, MockRobot):
+            self.log_message(f"📏 Recorrido simulado: {self.robot.motion_summary()}")
+        if self.slot_assignment == "travel":
+            planned, selection = self.shift_travel["planned"], self.shift_travel["selection"]
+            self.log_message(f"🧭 Recorrido del turno: {planned[0] / 1000:.2f} m, {planned[1]:.0f} s "
+                             f"(por orden de selección: {selection[0] / 1000:.2f} m, {selection[1]:.0f} s)")
+        stats = self.fault_stats
+        if stats["retries"] or stats["failed_stages"] or stats["rejected_orders"]:
+            self.log_message(f"🩹 Fallas del turno: {stats['retries']} reintentos, {stats['recovered']} etapas recuperadas "
+                             f"({stats['recovery_seconds']:.1f} s), {stats['failed_stages']} fallidas, "
+                             f"{stats['failed_arepas']} arepas en error, {stats['skipped_arepas']} descartadas, "
+                             f"{stats['rejected_orders']} pedidos rechazados; en cuarentena: "
+                             f"{', '.join(sorted(self.quarantined)) or 'nada'}")
+        staging = self.staging_report()
+        if staging["responses"]:
+            self.log_message(f"🎯 Vencimiento → agarre: media {staging['response_mean_s']:.2f} s en "
+                             f"{staging['responses']} acciones ({staging['staged']} anticipadas, "
+                             f"{staging['cancelled']} canceladas)")
         self.log_message("Sistema listo")
     
-    def go_to_home(self):
+    def mark_timeline(self, lane: str, state: Optional[str], label: Optional[str] = None,
+                      at: Optional[float] = None):
+        """Registra un cambio de estado en la línea de tiempo de la corrida en curso"""
+        if self.timeline is not None:
+            self.timeline.mark(lane, state, label, at)
+    
+    def mark_grill_pickup(self, position: int, state: str, arepa_id: str):
+        """Marca el volteo/retiro de una posición; desde que venció su timer cuenta como espera"""
+        timer_info = self.grill_timers[position - 1]
+        if timer_info is not None:
+            expiry = timer_info['start_time'] + timer_info['duration']
+            if expiry < clock.time() - TIMELINE_MIN_GAP:
+                self.mark_timeline(f"P{position}", "overdue", arepa_id, at=expiry)
+        self.mark_timeline(f"P{position}", state, arepa_id)
+    
+    def write_timeline_report(self):
+        """Cierra la línea de tiempo y guarda el Gantt (HTML) y los intervalos (CSV)"""
+        if self.timeline is None or self.timeline.end is not None:
+            return
+        self.timeline.close()
+        base = os.path.join(REPORTS_DIR, time.strftime("corrida_%Y%m%d_%H%M%S",
+                                                       time.localtime(self.timeline.start)))
+        try:
+            os.makedirs(REPORTS_DIR, exist_ok=True)
+            self.timeline.export_html(base + ".html")
+            self.timeline.export_csv(base + ".csv")
+        except OSError as e:
+            self.log_message(f"⚠️ No se pudo guardar el reporte de la corrida: {str(e)}")
+            return
+        
+        robot = self.timeline.utilization()["Robot"]
+        self.log_message(f"📊 Reporte: {base}.html (robot en movimiento {robot.get('moving', 0):.0%}, "
+                         f"gripper {robot.get('gripping', 0):.0%}, inactivo {robot.get('idle', 0):.0%})")
+    
+    def save_motion_model(self):
+        """Guarda las duraciones medidas para el próximo arranque"""
+        try:
+            self.motion_model.save()
+        except OSError as e:
+            self.log_message(f"⚠️ No se pudo guardar el modelo de tiempos: {str(e)}")
+    
+    def export_trace(self):
+        """Escribe la traza de ejecución si las trazas están activas (ver AREPAS_TRACE)"""
+        path = os.environ.get(TRACE_ENV_VAR)
+        if not tracer.enabled or not path:
+            return
+        try:
+            count = tracer.export(path)
+            print(f"Traza guardada en {path} ({count} spans)")
+        except OSError as e:
+            print(f"No se pudo guardar la traza: {str(e)}")
+    
+    def command_spec(self, name: str):
+        """(etiqueta, función) de un comando del operador"""
+        return {
+            "home": ("Home", self.go_to_home),
+            "test_targets": ("Test Targets", self.test_targets),
+            "check_robodk": ("Verificar RDK", self.check_robodk_connection),
+            "reset": ("Reset", self.reset_system),
+        }[name]
+    
+    def run_command(self, name: str) -> bool:
+        """Envía un comando del operador al ejecutor en segundo plano (la HMI sigue respondiendo)"""
+        if self.commands.submit(name, *self.command_spec(name)):
+            return True
+        running = self.commands.current
+        self.show_message("showwarning", "Comando en curso",
+                          f"Espera a que termine {running.label if running else 'el comando'} o cancélalo")
+        return False
+    
+    def report_command_started(self, command: OperatorCommand):
+        """Bloquea los botones de comandos mientras corre uno (se agenda en el hilo de la HMI)"""
+        self.log_message(f"▶️ {command.label}")
+        if self.root is None:
+            return
+        def update():
+            for btn in (self.btn_home, self.btn_reset, self.btn_check_robodk, self.btn_test_targets):
+                btn.configure(state="disabled")
+            self.btn_cancel.configure(state="normal")
+            self.command_progress.configure(value=0)
+            self.command_label.config(text=f"{command.label}...")
+        self.root.after(0, update)
+    
+    def report_command_progress(self, command: OperatorCommand):
+        """Muestra el avance del comando en curso"""
+        if self.root is None:
+            return
+        def update():
+            self.command_progress.configure(value=command.fraction)
+            self.command_label.config(text=f"{command.label}: {command.text}")
+        self.root.after(0, update)
+    
+    def report_command_finished(self, command: OperatorCommand, ok: bool, error: Optional[str]):
+        """Rehabilita los botones y deja el resultado a la vista"""
+        if self.root is None:
+            return
+        def update():
+            for btn in (self.btn_home, self.btn_reset, self.btn_check_robodk, self.btn_test_targets):
+                btn.configure(state="normal")
+            self.btn_cancel.configure(state="disabled")
+            self.command_progress.configure(value=1.0 if ok else 0)
+            self.command_label.config(text=f"✓ {command.label}" if ok else f"✗ {command.label}: {error}")
+        self.root.after(0, update)
+    
+    def halt_robot(self):
+        """Detiene el movimiento en curso (cancelación de un comando)
+
+        Se llama desde la HMI mientras el hilo del comando está bloqueado en un
+        movimiento: la API de RoboDK no es thread-safe, así que Stop va por una
+        conexión propia en lugar del socket de los movimientos.
+        """
+        try:
+            if ROBODK_AVAILABLE:
+                create_robolink(self.robodk_port).Item(self.robot_name, ITEM_TYPE_ROBOT).Stop()
+            else:
+                self.robot.Stop()
+            self.log_message("⏹️ Robot detenido")
+        except Exception as e:
+            self.log_message(f"⚠️ No se pudo detener el robot: {str(e)}")
+    
+    def go_to_home(self, command: Optional[OperatorCommand] = None) -> bool:
         """Mueve el robot a la posición Home"""
         if self.is_executing:
-            messagebox.showwarning("Proceso activo", "No se puede mover a Home durante la ejecución")
-            return
+            self.show_message("showwarning", "Proceso activo", "No se puede mover a Home durante la ejecución")
+            return False
+        
+        if not self.robot:
+            self.show_message("showerror", "Error", "Robot no inicializado")
+            return False
         
         self.log_message("Moviendo a Home...")
-        if self.move_to_target("Home"):
+        if command is not None:
+            command.progress(0.1, "Moviendo a Home")
+            command.on_cancel = self.halt_robot
+        self.apply_motion_profile(self.resolve_motion_profile("empty"))
+        moved = self.move_to_target("Home")
+        if command is not None:
+            command.on_cancel = None
+            command.check_cancelled()
+        if moved:
             self.log_message("✓ Robot en Home")
             self.update_status("Robot en Home")
-        else:
-            self.log_message("✗ Error moviendo a Home")
+            return True
+        self.log_message("✗ Error moviendo a Home")
+        return False
     
-    def reset_system(self):
+    def reset_system(self, command: Optional[OperatorCommand] = None):
         """Reinicia el sistema"""
         if self.is_executing:
+            if command is not None:
+                command.progress(0.1, "Deteniendo el proceso")
             self.stop_process()
-            time.sleep(1)
-        
-        # Limpiar estados
-        for arepa in self.arepas.values():
-            arepa.state = ArepaState.IDLE
-            arepa.grill_position = None
-            arepa.cook_start_time = None
-            arepa.flip_time = None
-            arepa.delivery_time = None
-            arepa.selection_order = None
-        
-        # Limpiar posiciones
-        self.grill_positions = [None, None, None, None]
-        self.delivery_positions = [None, None, None, None]
-        self.grill_timers = [None, None, None, None]
+            clock.sleep(1)
+        
+        # Desde aquí ya no se cancela: la celda queda siempre coherente
+        if command is not None:
+            command.progress(0.6, "Limpiando la celda")
+        
+        # El operador sostiene la arepa que quedó tomada tras una falla
+        if self.held_arepa is not None and self.robot is not None:
+            if self.operate_gripper("release"):
+                self.log_message(f"🖐️ Gripper abierto: {self.held_arepa} retirada")
+                self.held_arepa = None
+        
+        # Limpiar estados y posiciones
+        self.cell.ask("reset")
         
         # Limpiar selección
         self.selected_arepas = []
-        for var in self.arepa_vars.values():
-            var.set(False)
+        if self.root is not None:
+            for var in self.arepa_vars.values():
+                var.set(False)
+        self.selection_dirty = False
+        
+        # Reponer estantería
+        self.restock_shelves()
+        
+        # El operador revisó la celda: todo vuelve a servicio
+        if self.quarantined:
+            self.log_message(f"🚧 Fin de cuarentena: {', '.join(sorted(self.quarantined))}")
+            self.quarantined = {}
+        self.batch_failed = set()
         
         # Actualizar displays
         self.update_grill_display()
         self.update_delivery_display()
-        self.order_label.config(text="Selecciona hasta 4 arepas")
+        if self.root is not None:
+            self.order_label.config(text=f"Selecciona hasta {len(self.grill_positions)} arepas")
     
         
         self.log_message("🔄 SISTEMA REINICIADO")
         self.update_status("Sistema reiniciado - Listo")
     
-    def check_robodk_connection(self):
+    def check_robodk_connection(self, command: Optional[OperatorCommand] = None) -> bool:
         """Verifica la conexión con RoboDK"""
+        if self.RDK is None:
+            self.show_message("showwarning", "RoboDK", "Conexión con RoboDK en curso")
+            return False
+        
+        if command is not None:
+            command.progress(0.2, "Consultando RoboDK")
         try:
             if ROBODK_AVAILABLE:
                 stations = self.RDK.getOpenStations()
+                if command is not None:
+                    command.check_cancelled()
                 if stations:
                     self.log_message(f"✓ RoboDK OK - Estaciones: {stations}")
-                    messagebox.showinfo("RoboDK", f"Conectado OK\nEstaciones: {', '.join(stations)}")
+                    self.show_message("showinfo", "RoboDK", f"Conectado OK\nEstaciones: {', '.join(stations)}")
                 else:
                     self.log_message("⚠️ RoboDK sin estaciones")
-                    messagebox.showwarning("RoboDK", "Conectado pero sin estaciones")
+                    self.show_message("showwarning", "RoboDK", "Conectado pero sin estaciones")
             else:
                 self.log_message("ℹ️ RoboDK no disponible - Simulación")
-                messagebox.showinfo("RoboDK", "No disponible - Modo simulación")
+                self.show_message("showinfo", "RoboDK", "No disponible - Modo simulación")
+            return True
                 
+        except CommandCancelled:
+            raise
         except Exception as e:
             error_msg = f"✗ Error RoboDK: {str(e)}"
             self.log_message(error_msg)
-            messagebox.showerror("Error RoboDK", error_msg)
+            self.show_message("showerror", "Error RoboDK", error_msg)
+            return False
+    
+    def shutdown(self):
+        """Guarda el modelo, la traza y el historial y detiene servidores, supervisor y celda"""
+        self.commands.cancel()
+        self.save_motion_model()
+        self.export_trace()
+        self.stop_order_server()
+        self.stop_state_server()
+        self.supervisor.stop()
+        self.cell.stop()
+        self.order_history.close()
     
     def on_closing(self):
         """Maneja el cierre de la aplicación"""
         if self.is_executing:
             if messagebox.askokcancel("Cerrar", "¿Detener proceso y cerrar?"):
                 self.stop_process()
-                time.sleep(1)
+                clock.sleep(1)
+                self.shutdown()
                 self.root.destroy()
         else:
+            self.shutdown()
             self.root.destroy()
 
+def run_headless(app: ArepaController):
+    """Controlador sin HMI local: solo atiende pedidos y comandos de los visores remotos"""
+    print(f"Sin HMI local: conecta visores con python hmi_client.py --port {STATE_SERVER_PORT}")
+    try:
+        while True:
+            try:
+                app.dispatch_orders()
+            except Exception as e:
+                app.log_message(f"✗ Error procesando pedidos: {str(e)}")
+            time.sleep(ORDER_POLL_MS / 1000)
+    except KeyboardInterrupt:
+        print("\nAplicación cerrada por el usuario")
+        if app.is_executing:
+            app.stop_process()
+        app.shutdown()
+
 def main():
     """Función principal"""
+    parser = argparse.ArgumentParser(description="Control de la parrilla automática de arepas")
+    parser.add_argument("--headless", action="store_true",
+                        help="Sin HMI local; la interfaz se abre aparte con hmi_client.py")
+    args = parser.parse_args()
+    
     print("=" * 40)
     print("Sistema Control Arepas - Parrilla Automática")
     print("=" * 40)
     
+    if os.environ.get(TRACE_ENV_VAR):
+        tracer.enable()
+        print(f"Trazas activas: se guardarán en {os.environ[TRACE_ENV_VAR]} al cerrar")
+    
+    if args.headless:
+        app = ArepaController(None)
+        app.start_order_server()
+        app.start_state_server()
+        run_headless(app)
+        return
+    
     root = tk.Tk()
     app = ArepaController(root)
+    app.start_order_server()
+    app.start_state_server()
     
     try:
         root.mainloop()
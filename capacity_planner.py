@@ -0,0 +1,235 @@
+"""Planificador de capacidad: barre configuraciones de la celda en tiempo simulado.
+
+Prueba una grilla de parámetros (posiciones de parrilla y de entrega, tiempos
+de cocción, velocidad del robot, tiempo del gripper y tasa de llegada de
+pedidos). Cada punto es una corrida de load_test.py: el controlador completo
+con el robot simulado y el reloj virtual. Como el reloj es global al proceso,
+cada punto corre en su propio proceso y la grilla se reparte entre todos los
+núcleos. Todos los puntos usan la misma semilla, así que reciben la misma
+secuencia de pedidos y las diferencias vienen solo de la configuración.
+
+Reporta throughput y latencias de cada punto y las superficies de arepas/h y
+latencia p95 sobre dos de los parámetros barridos.
+
+Ejemplo:
+    python capacity_planner.py --grill 4,5,6 --cook1 10,8 --rates 20,40,60 --hours 2
+"""
+import argparse
+import csv
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List
+
+import Prog1
+from Prog1 import DELIVERY_SLOTS, GRILL_SLOTS, GRIPPER_MIN_DWELL, SimulatedGripperIO
+from load_test import DEFAULT_SIZES, LoadTest, constant_rate, format_seconds, is_saturated, parse_weights
+
+# Parámetros de la grilla: nombre → (texto, conversión)
+GRID_PARAMETERS = {
+    "grill": ("Posiciones de parrilla", int),
+    "delivery": ("Posiciones de entrega", int),
+    "cook1": ("Cocción lado 1 (s)", float),
+    "cook2": ("Cocción lado 2 (s)", float),
+    "speed": ("Factor de velocidad", float),
+    "dwell": ("Gripper (s)", float),
+    "rate": ("Pedidos/h", float)
+}
+RESULT_METRICS = ["throughput_per_hour", "arepas_per_hour", "latency_p50_s", "latency_p95_s",
+                  "wait_p95_s", "delivered", "errors", "rejected_queue_full", "rejected_invalid"]
+
+
+class CellScenario(LoadTest):
+    """Corrida de carga con un tamaño de celda, velocidad y gripper dados"""
+
+    def __init__(self, point: dict, hours: float, mix: Dict[str, float], sizes: Dict[int, float], seed: int):
+        super().__init__(constant_rate(point["rate"]), point["rate"], hours, mix, sizes, seed,
+                         point["cook1"], point["cook2"])
+        self.point = point
+        self.controller_options = {"grill_slots": point["grill"], "delivery_slots": point["delivery"]}
+        self.track_memory = False
+
+    def create_controller(self, model_dir: str):
+        app = super().create_controller(model_dir)
+        missing = [target for target in app.get_required_targets() if not app.check_target_exists(target)]
+        if missing:
+            app.supervisor.stop()
+            app.cell.stop()
+            raise ValueError(f"la estación no tiene {', '.join(missing[:3])}"
+                             + (f" y {len(missing) - 3} más" if len(missing) > 3 else ""))
+
+        # Velocidad: escala las velocidades (no las aceleraciones) de todos los perfiles
+        speed = self.point["speed"]
+        app.robot_speed *= speed
+        defaults = app.motion_profile_config.setdefault("default", {})
+        for profile_class in Prog1.DEFAULT_MOTION_PROFILES:
+            profile = app.resolve_motion_profile(profile_class)
+            defaults[profile_class] = {"speed": profile["speed"] * speed, "accel": profile["accel"],
+                                       "joint_speed": profile["joint_speed"] * speed,
+                                       "joint_accel": profile["joint_accel"]}
+
+        # Gripper: tiempo mínimo con la válvula conmutada; el simulado confirma dentro de ese tiempo
+        dwell = self.point["dwell"]
+        app.gripper.min_dwell = dwell
+        if isinstance(app.gripper.io, SimulatedGripperIO):
+            app.gripper.io.actuation_time = min(app.gripper.io.actuation_time, dwell)
+        return app
+
+
+def run_point(point: dict, hours: float, mix: Dict[str, float], sizes: Dict[int, float], seed: int) -> dict:
+    """Corre un punto de la grilla (en un proceso del pool)"""
+    Prog1.ROBODK_AVAILABLE = False  # Siempre el robot simulado, nunca la estación real
+    try:
+        result = CellScenario(point, hours, mix, sizes, seed).run()
+    except Exception as e:
+        return {**point, "error": str(e)}
+    # Una celda que rechaza pedidos válidos para la celda estándar (p. ej. más arepas que
+    # posiciones de parrilla) tampoco sigue la demanda
+    return {**point, **{metric: result[metric] for metric in RESULT_METRICS},
+            "saturated": is_saturated(result) or result["rejected_invalid"] > 0,
+            "wall_seconds": result["wall_seconds"]}
+
+
+def parse_values(text: str, cast) -> list:
+    return [cast(value) for value in text.split(",") if value.strip()]
+
+
+def build_grid(values: Dict[str, list]) -> List[dict]:
+    """Producto cartesiano de los valores de cada parámetro"""
+    names = list(values)
+    return [dict(zip(names, combination)) for combination in itertools.product(*(values[name] for name in names))]
+
+
+def describe(point: dict, names: List[str]) -> str:
+    return " ".join(f"{name}={point[name]:g}" for name in names)
+
+
+def print_surface(results: List[dict], metric: str, rows: str, columns: str, fixed: List[str], formatter):
+    """Tabla de una métrica sobre dos parámetros, una por combinación de los demás parámetros barridos"""
+    row_values = sorted({result[rows] for result in results})
+    column_values = sorted({result[columns] for result in results})
+    groups: Dict[tuple, Dict[tuple, dict]] = {}
+    for result in results:
+        key = tuple(result[name] for name in fixed)
+        groups.setdefault(key, {})[(result[rows], result[columns])] = result
+
+    for key, cells in sorted(groups.items()):
+        title = ", ".join(f"{name}={value:g}" for name, value in zip(fixed, key))
+        print(f"\n{metric} ({GRID_PARAMETERS[rows][0]} × {GRID_PARAMETERS[columns][0]})"
+              + (f" con {title}" if title else ""))
+        print(f"{rows:>10} | " + "".join(f"{value:>10g}" for value in column_values))
+        for row_value in row_values:
+            line = ""
+            for column_value in column_values:
+                cell = cells.get((row_value, column_value))
+                if cell is None or "error" in cell:
+                    text = "-"
+                else:
+                    text = formatter(cell[metric]) + ("*" if cell["saturated"] else "")
+                line += f"{text:>10}"
+            print(f"{row_value:>10g} | {line}")
+
+
+def main():
+    """Función principal"""
+    parser = argparse.ArgumentParser(description="Barrido de configuraciones de la celda en tiempo simulado")
+    parser.add_argument("--grill", default=str(GRILL_SLOTS), help="Posiciones de parrilla, p. ej. 4,5,6")
+    parser.add_argument("--delivery", default=str(DELIVERY_SLOTS), help="Posiciones de entrega")
+    parser.add_argument("--cook1", default="10", help="Tiempos de cocción del lado 1 (s)")
+    parser.add_argument("--cook2", default="10", help="Tiempos de cocción del lado 2 (s)")
+    parser.add_argument("--speed", default="1", help="Factores sobre las velocidades del robot, p. ej. 1,1.25")
+    parser.add_argument("--dwell", default=str(GRIPPER_MIN_DWELL), help="Tiempos mínimos del gripper (s)")
+    parser.add_argument("--rates", dest="rate", default="20,40,60", help="Tasas de llegada (pedidos/hora)")
+    parser.add_argument("--hours", type=float, default=2.0, help="Horas simuladas por punto")
+    parser.add_argument("--mix", default="A1=1,A2=1,A3=1,B1=1,B2=1,B3=1",
+                        help="Pesos de cada producto de la estantería")
+    parser.add_argument("--sizes", default=",".join(f"{k}={v}" for k, v in DEFAULT_SIZES.items()),
+                        help="Probabilidad de cada tamaño de pedido")
+    parser.add_argument("--surface", default=None,
+                        help="Parámetros de filas y columnas de las superficies, p. ej. grill,rate")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Procesos en paralelo")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="Guardar los resultados en un archivo JSON")
+    parser.add_argument("--csv", help="Guardar los resultados en un archivo CSV")
+    args = parser.parse_args()
+
+    try:
+        values = {name: parse_values(getattr(args, name), cast)
+                  for name, (_, cast) in GRID_PARAMETERS.items()}
+    except ValueError as e:
+        parser.error(f"Valor inválido: {str(e)}")
+    if any(not options for options in values.values()):
+        parser.error("Cada parámetro necesita al menos un valor")
+    if any(value < 1 for value in values["grill"] + values["delivery"]):
+        parser.error("Se necesita al menos una posición de parrilla y una de entrega")
+
+    swept = [name for name in GRID_PARAMETERS if len(values[name]) > 1]
+    if args.surface:
+        surface = [name.strip() for name in args.surface.split(",")]
+        if len(surface) != 2 or any(name not in GRID_PARAMETERS for name in surface) or surface[0] == surface[1]:
+            parser.error(f"--surface necesita dos parámetros distintos de: {', '.join(GRID_PARAMETERS)}")
+    else:
+        surface = (swept + [name for name in ("grill", "rate") if name not in swept])[:2]
+    fixed = [name for name in swept if name not in surface]
+
+    mix = parse_weights(args.mix)
+    sizes = {int(size): weight for size, weight in parse_weights(args.sizes).items()}
+    grid = build_grid(values)
+
+    print("=" * 40)
+    print("Planificador de capacidad - Parrilla Automática")
+    print("=" * 40)
+    print(f"{len(grid)} configuraciones × {args.hours:g} h simuladas en {args.workers} procesos")
+
+    results = []
+    wall_start = time.time()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = [pool.submit(run_point, point, args.hours, mix, sizes, args.seed) for point in grid]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            label = describe(result, swept or ["grill", "rate"])
+            if "error" in result:
+                print(f"✗ [{len(results)}/{len(grid)}] {label}: {result['error']}")
+            else:
+                print(f"✓ [{len(results)}/{len(grid)}] {label}: {result['arepas_per_hour']} arepas/h, "
+                      f"p95 {format_seconds(result['latency_p95_s'])}"
+                      + (" (saturada)" if result["saturated"] else ""))
+    results.sort(key=lambda result: tuple(result[name] for name in GRID_PARAMETERS))
+    print(f"\nGrilla completa en {time.time() - wall_start:.0f} s")
+
+    valid = [result for result in results if "error" not in result]
+    if valid:
+        print_surface(valid, "arepas_per_hour", surface[0], surface[1], fixed, lambda value: f"{value:g}")
+        print_surface(valid, "latency_p95_s", surface[0], surface[1], fixed, format_seconds)
+        print("(* = saturada: rechaza pedidos o entrega menos de lo aceptado)")
+
+        # Por tasa de llegada: la configuración sin saturar con menor latencia p95
+        print("\nMejor configuración por tasa de llegada:")
+        for rate in values["rate"]:
+            candidates = [result for result in valid if result["rate"] == rate and not result["saturated"]
+                          and result["latency_p95_s"] is not None]
+            if not candidates:
+                print(f"  {rate:g} pedidos/h: ninguna configuración sigue la demanda")
+                continue
+            best = min(candidates, key=lambda result: result["latency_p95_s"])
+            print(f"  {rate:g} pedidos/h: {describe(best, [name for name in GRID_PARAMETERS if name != 'rate'])} "
+                  f"(p95 {format_seconds(best['latency_p95_s'])})")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"grid": values, "hours": args.hours, "seed": args.seed, "results": results}, f, indent=1)
+        print(f"\nResultados guardados en {args.json}")
+    if args.csv:
+        columns = list(GRID_PARAMETERS) + RESULT_METRICS + ["saturated", "wall_seconds", "error"]
+        with open(args.csv, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(results)
+        print(f"Resultados guardados en {args.csv}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,539 @@
+"""Despachador de una flota de celdas de cocción.
+
+Lanza N controladores sin HMI, cada uno en su propio proceso y ligado a su
+instancia de RoboDK (puerto) o al robot simulado. Recibe los pedidos por la
+misma API HTTP que una celda (POST /orders, GET /orders/<id>, GET /stock) y
+envía cada uno a la celda con menor hora estimada de entrega entre las que
+tienen existencias. GET /fleet agrega estado y métricas de todas las celdas.
+
+Ejemplo:
+    python fleet.py --cells mock,mock,20501 --port 8765
+"""
+import argparse
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, asdict, field
+from http.server import ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+import Prog1
+from Prog1 import ArepaController, OrderRequestHandler, ORDER_POLL_MS, ORDER_SERVER_HOST, ORDER_SERVER_PORT
+from load_test import percentile
+
+FLEET_STATUS_INTERVAL = 1.0   # s entre reportes de estado de cada celda
+FLEET_STATUS_STALE = 5 * FLEET_STATUS_INTERVAL  # s sin reportes para dejar de rutear a una celda
+FLEET_START_TIMEOUT = 60.0    # s máximos esperando que una celda conecte su robot
+FLEET_ORDER_QUEUE_SIZE = 100  # Pedidos pendientes de ruteo antes de rechazar con 503
+
+
+def run_cell(cell_id: str, backend: str, stock: Optional[int], commands, events):
+    """Proceso de una celda: controlador sin HMI que atiende órdenes del despachador"""
+    if backend == "mock":
+        Prog1.ROBODK_AVAILABLE = False
+        app = ArepaController(None)
+    else:
+        app = ArepaController(None, robodk_port=int(backend))
+    app.debug_mode = False
+    app.write_reports = False
+    # Cada celda aprende los tiempos de su propia estación
+    root, ext = os.path.splitext(Prog1.MOTION_MODEL_FILE)
+    app.motion_model.path = f"{root}_{cell_id}{ext}"
+    if stock is not None:
+        app.shelf_capacity = stock
+        app.restock_shelves()
+
+    app.connection_done.wait()
+    events.put(("ready", cell_id, app.robot_name))
+    if app.robot is None:
+        app.supervisor.stop()
+        app.cell.stop()
+        return
+
+    reported: Dict[str, str] = {}  # Último estado enviado de cada pedido
+    next_status = 0.0
+    try:
+        while True:
+            try:
+                command = commands.get(timeout=ORDER_POLL_MS / 1000)
+            except queue.Empty:
+                command = None
+
+            if command is not None:
+                if command[0] == "stop":
+                    break
+                _, fleet_id, items = command
+                try:
+                    order = app.submit_order(items, source=f"fleet:{fleet_id}")
+                except ValueError as e:
+                    events.put(("rejected", cell_id, fleet_id, str(e)))
+                except queue.Full:
+                    events.put(("rejected", cell_id, fleet_id, "Cola de pedidos llena"))
+                else:
+                    reported[order.order_id] = order.status
+                    events.put(("accepted", cell_id, fleet_id, app.order_to_dict(order)))
+
+            app.dispatch_orders()
+
+            if time.time() >= next_status:
+                events.put(("status", cell_id, cell_status(app, reported)))
+                next_status = time.time() + FLEET_STATUS_INTERVAL
+    finally:
+        app.stop_control = True
+        if app.main_control_thread and app.main_control_thread.is_alive():
+            app.main_control_thread.join(timeout=5)
+        app.save_motion_model()
+        app.supervisor.stop()
+        app.cell.stop()
+        app.order_history.close()
+
+
+def cell_status(app: ArepaController, reported: Dict[str, str]) -> dict:
+    """Estado de una celda y los pedidos que cambiaron desde el último reporte"""
+    with app.orders_lock:
+        backlog_items = sum(len(order.items) for order in app.orders.values()
+                            if order.status in ("queued", "cooking"))
+        changed = []
+        for order in app.orders.values():
+            if reported.get(order.order_id) != order.status:
+                reported[order.order_id] = order.status
+                changed.append(app.order_to_dict(order))
+    return {
+        "connected": app.supervisor.connected.is_set(),
+        "executing": app.is_executing,
+        "queued": app.queued_order_count(),
+        "backlog_items": backlog_items,
+        "cycle_seconds": app.estimate_arepa_cycle_duration(),
+        "cook_seconds": app.cook_time_side1 + app.cook_time_side2,
+        "stock": app.get_available_stock(),
+        "products": {slot_id: slot.product for slot_id, slot in app.inventory.slots.items()},
+        "faults": app.fault_report(),
+        "orders": changed,
+        "at": time.time()
+    }
+
+
+@dataclass
+class CellState:
+    cell_id: str
+    backend: str
+    process: Optional[multiprocessing.Process] = None
+    commands: Optional[multiprocessing.Queue] = None
+    robot_name: Optional[str] = None
+    ready: bool = False
+    status: dict = field(default_factory=dict)
+    routed_items: int = 0  # Arepas enviadas después del último reporte de estado
+    lost: bool = False     # El proceso terminó fuera de un cierre normal
+
+    def available_stock(self) -> Dict[str, int]:
+        return dict(self.status.get("stock", {}))
+
+    def order_products(self, items: List[str]) -> Optional[List[str]]:
+        """Productos de los ítems (los IDs de estante son alias); None si la celda no tiene alguno"""
+        slots = self.status.get("products", {})
+        names = set(slots.values())
+        products = [item if item in names else slots.get(item) for item in items]
+        return None if None in products else products
+
+    def has_stock(self, items: List[str]) -> bool:
+        """Unidades sin reservar para cada producto del pedido (igual que ArepaController.submit_order)
+
+        Cada unidad del lote sale de una posición distinta: no más unidades de un
+        producto que posiciones tiene en la celda.
+        """
+        products = self.order_products(items)
+        if products is None:
+            return False
+        stock = self.status.get("stock", {})
+        positions = Counter(self.status.get("products", {}).values())
+        return all(stock.get(product, 0) >= count and positions[product] >= count
+                   for product, count in Counter(products).items())
+
+    def reserve(self, items: List[str]):
+        """Reserva local hasta el próximo reporte: descuenta el producto y todos sus IDs de estante"""
+        stock = self.status["stock"]
+        slots = self.status.get("products", {})
+        for product in self.order_products(items):
+            stock[product] -= 1
+            for slot_id, slot_product in slots.items():
+                if slot_product == product:
+                    stock[slot_id] -= 1
+
+    def responsive(self, now: float) -> bool:
+        """Proceso vivo, robot conectado y reportes al día"""
+        return (self.ready and self.process is not None and self.process.is_alive()
+                and bool(self.status.get("connected"))
+                and now - self.status.get("at", 0.0) <= FLEET_STATUS_STALE)
+
+    def predicted_completion(self, n_items: int, now: float) -> Optional[float]:
+        """Misma estimación que ArepaController.estimate_order_eta, con lo enviado desde el último reporte"""
+        if not self.responsive(now):
+            return None
+        items_ahead = self.status["backlog_items"] + self.routed_items
+        return now + (items_ahead + n_items) * self.status["cycle_seconds"] + self.status["cook_seconds"]
+
+
+@dataclass
+class FleetOrder:
+    order_id: str                    # F00001, F00002, ...
+    items: List[str]
+    status: str = "routing"          # routing / queued / cooking / delivered / error
+    created: float = 0.0
+    started: Optional[float] = None
+    completed: Optional[float] = None
+    eta: Optional[float] = None
+    source: str = "pos"
+    cell: Optional[str] = None       # Celda asignada
+    cell_order_id: Optional[str] = None
+    error: Optional[str] = None
+    tried: List[str] = field(default_factory=list)  # Celdas que lo rechazaron
+
+
+class FleetDispatcher:
+    """Rutea pedidos entre celdas en procesos separados y agrega su estado
+
+    Expone la misma interfaz de pedidos que ArepaController, así que
+    OrderRequestHandler la sirve sin cambios.
+    """
+
+    def __init__(self, backends: List[str], stock: Optional[int] = None):
+        self.cells: Dict[str, CellState] = {
+            f"C{i + 1}": CellState(f"C{i + 1}", backend) for i, backend in enumerate(backends)}
+        self.stock = stock
+        self.orders: Dict[str, FleetOrder] = {}
+        self.orders_lock = threading.Lock()
+        self.order_counter = itertools.count(1)
+        self.context = multiprocessing.get_context("spawn")
+        self.events = self.context.Queue()
+        self.started = time.time()
+        self.collector: Optional[threading.Thread] = None
+        self.order_server = None
+        self.stopping = False
+
+    def start(self, timeout: float = FLEET_START_TIMEOUT) -> int:
+        """Lanza un proceso por celda y espera a que conecten su robot; devuelve las celdas listas"""
+        for cell in self.cells.values():
+            cell.commands = self.context.Queue()
+            cell.process = self.context.Process(target=run_cell, name=f"Celda{cell.cell_id}",
+                                                args=(cell.cell_id, cell.backend, self.stock,
+                                                      cell.commands, self.events), daemon=True)
+            cell.process.start()
+
+        self.collector = threading.Thread(target=self.collect_events, name="Flota", daemon=True)
+        self.collector.start()
+
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            with self.orders_lock:
+                pending = [cell for cell in self.cells.values() if not cell.status and cell.process.is_alive()]
+            if not pending:
+                break
+            time.sleep(0.1)
+        with self.orders_lock:
+            return sum(1 for cell in self.cells.values() if cell.ready)
+
+    def stop(self):
+        """Detiene todas las celdas (terminan su lote en curso como en un cierre normal)"""
+        if self.order_server is not None:
+            self.order_server.shutdown()
+            self.order_server = None
+        with self.orders_lock:
+            self.stopping = True
+        for cell in self.cells.values():
+            if cell.process is not None and cell.process.is_alive():
+                cell.commands.put(("stop",))
+        for cell in self.cells.values():
+            if cell.process is not None:
+                cell.process.join(timeout=10)
+        self.events.put(None)
+        if self.collector is not None:
+            self.collector.join(timeout=2)
+
+    def collect_events(self):
+        """Hilo que recibe los eventos de todas las celdas"""
+        while True:
+            try:
+                event = self.events.get(timeout=FLEET_STATUS_INTERVAL)
+            except queue.Empty:
+                with self.orders_lock:
+                    self.check_cells()
+                continue
+            if event is None:
+                break
+            kind, cell_id = event[0], event[1]
+            with self.orders_lock:
+                self.check_cells()
+                cell = self.cells[cell_id]
+                if kind == "ready":
+                    cell.robot_name = event[2]
+                    cell.ready = event[2] is not None
+                    if not cell.ready:
+                        cell.status = {"connected": False}
+                        print(f"✗ Celda {cell_id} ({cell.backend}): robot no inicializado")
+                    else:
+                        print(f"✓ Celda {cell_id} ({cell.backend}): {cell.robot_name}")
+                elif kind == "status":
+                    cell.status = event[2]
+                    cell.routed_items = 0
+                    for data in event[2]["orders"]:
+                        self.update_from_cell(data)
+                elif kind == "lost":
+                    self.recover_orders(cell)
+                elif kind == "accepted":
+                    order = self.orders[event[2]]
+                    order.cell_order_id = event[3]["order_id"]
+                    order.status = "queued"
+                    order.eta = event[3]["eta"]
+                else:
+                    self.reroute(self.orders[event[2]], event[3])
+
+    def check_cells(self):
+        """Detecta celdas cuyo proceso terminó (llamar con orders_lock tomado)
+
+        Sus pedidos se recuperan al procesar el evento "lost", que entra a la cola
+        después de los últimos eventos que la celda alcanzó a enviar.
+        """
+        if self.stopping:
+            return
+        for cell in self.cells.values():
+            if cell.lost or not cell.ready or cell.process is None or cell.process.is_alive():
+                continue
+            cell.lost = True
+            print(f"✗ Celda {cell.cell_id} ({cell.backend}): el proceso terminó (código {cell.process.exitcode})")
+            self.events.put(("lost", cell.cell_id))
+
+    def recover_orders(self, cell: CellState):
+        """Pedidos abiertos de una celda caída: los que no empezaron van a otra, los demás quedan en error
+
+        Llamar con orders_lock tomado. Los pedidos en cocción no se reenvían: sus
+        arepas quedaron en esa celda.
+        """
+        cell.status["connected"] = False
+        reason = f"La celda {cell.cell_id} dejó de responder"
+        for order in self.orders.values():
+            if order.cell != cell.cell_id or order.status not in ("routing", "queued", "cooking"):
+                continue
+            if order.status == "cooking":
+                order.status = "error"
+                order.error = reason
+                order.completed = time.time()
+            else:
+                order.status = "routing"
+                order.cell_order_id = None
+                self.reroute(order, reason)
+
+    def update_from_cell(self, data: dict):
+        """Copia el estado de un pedido reportado por su celda (llamar con orders_lock tomado)"""
+        source = data.get("source", "")
+        if not source.startswith("fleet:"):
+            return
+        order = self.orders.get(source[len("fleet:"):])
+        if order is None:
+            return
+        order.cell_order_id = data["order_id"]
+        order.status = data["status"]
+        order.started = data["started"]
+        order.completed = data["completed"]
+        order.eta = data["eta"]
+
+    def choose_cell(self, order: FleetOrder) -> Optional[CellState]:
+        """Celda con menor hora estimada de entrega que tiene existencias (llamar con orders_lock tomado)"""
+        now = time.time()
+        best, best_completion = None, None
+        for cell in self.cells.values():
+            if cell.cell_id in order.tried:
+                continue
+            if not cell.has_stock(order.items):
+                continue
+            completion = cell.predicted_completion(len(order.items), now)
+            if completion is not None and (best_completion is None or completion < best_completion):
+                best, best_completion = cell, completion
+        if best is not None:
+            order.eta = best_completion
+        return best
+
+    def route(self, order: FleetOrder) -> bool:
+        """Envía un pedido a la mejor celda (llamar con orders_lock tomado)"""
+        cell = self.choose_cell(order)
+        if cell is None:
+            return False
+        order.cell = cell.cell_id
+        cell.routed_items += len(order.items)
+        cell.reserve(order.items)
+        cell.commands.put(("order", order.order_id, list(order.items)))
+        return True
+
+    def reroute(self, order: FleetOrder, reason: str):
+        """La celda rechazó el pedido: probar en otra (llamar con orders_lock tomado)"""
+        order.tried.append(order.cell)
+        order.cell = None
+        if not self.route(order):
+            order.status = "error"
+            order.error = reason
+            order.completed = time.time()
+
+    # --- Interfaz de pedidos (la misma de ArepaController) ---
+
+    def submit_order(self, items, source: str = "pos") -> FleetOrder:
+        """Registra un pedido y lo envía a la celda que lo entregaría antes"""
+        if not isinstance(items, list) or not items or not all(isinstance(item, str) for item in items):
+            raise ValueError("El pedido debe incluir una lista 'items' con productos o IDs de arepa")
+        with self.orders_lock:
+            routing = sum(1 for order in self.orders.values() if order.status == "routing")
+            if routing >= FLEET_ORDER_QUEUE_SIZE:
+                raise queue.Full
+            order = FleetOrder(f"F{next(self.order_counter):05d}", list(items), created=time.time(), source=source)
+            if not self.route(order):
+                raise ValueError(f"Ninguna celda disponible con existencias de: {', '.join(items)}")
+            self.orders[order.order_id] = order
+        return order
+
+    def order_to_dict(self, order: FleetOrder) -> dict:
+        data = asdict(order)
+        del data["tried"]
+        if order.eta is None or order.completed is not None:
+            data["eta_seconds"] = None
+        else:
+            data["eta_seconds"] = round(max(0.0, order.eta - time.time()), 1)
+        return data
+
+    def list_orders(self) -> List[dict]:
+        with self.orders_lock:
+            return [self.order_to_dict(order) for order in self.orders.values()]
+
+    def get_order(self, order_id: str) -> Optional[dict]:
+        with self.orders_lock:
+            order = self.orders.get(order_id)
+            return None if order is None else self.order_to_dict(order)
+
+    def get_available_stock(self) -> Dict[str, int]:
+        """Existencias sumadas de todas las celdas conectadas"""
+        total: Dict[str, int] = {}
+        with self.orders_lock:
+            now = time.time()
+            for cell in self.cells.values():
+                if cell.responsive(now):
+                    for item, units in cell.available_stock().items():
+                        total[item] = total.get(item, 0) + units
+        return total
+
+    def order_retry_after(self) -> int:
+        with self.orders_lock:
+            now = time.time()
+            cycles = [cell.status["cycle_seconds"] for cell in self.cells.values() if cell.responsive(now)]
+        return max(1, round(min(cycles))) if cycles else 5
+
+    # --- Estado y métricas agregadas ---
+
+    def fleet_status(self) -> dict:
+        """Estado de cada celda y métricas de pedidos por celda y de la flota"""
+        now = time.time()
+        hours = max((now - self.started) / 3600, 1e-9)
+        with self.orders_lock:
+            orders = list(self.orders.values())
+            cells = {}
+            for cell in self.cells.values():
+                status = {key: value for key, value in cell.status.items() if key != "orders"}
+                cells[cell.cell_id] = {"backend": cell.backend, "robot": cell.robot_name,
+                                       "alive": cell.process is not None and cell.process.is_alive(),
+                                       **status, **order_metrics([o for o in orders if o.cell == cell.cell_id], hours)}
+        return {"cells": cells, "fleet": order_metrics(orders, hours)}
+
+    def fault_report(self) -> dict:
+        """Fallas y cuarentenas de cada celda (GET /faults)"""
+        with self.orders_lock:
+            return {"cells": {cell.cell_id: cell.status.get("faults") for cell in self.cells.values()}}
+
+    def start_order_server(self, host: str = ORDER_SERVER_HOST, port: int = ORDER_SERVER_PORT) -> bool:
+        """API HTTP de pedidos de la flota en un hilo aparte"""
+        try:
+            self.order_server = ThreadingHTTPServer((host, port), FleetRequestHandler)
+        except OSError as e:
+            print(f"⚠️ No se pudo iniciar el servidor de pedidos: {str(e)}")
+            return False
+        self.order_server.daemon_threads = True
+        self.order_server.controller = self
+        threading.Thread(target=self.order_server.serve_forever, daemon=True).start()
+        print(f"🧾 Servidor de pedidos de la flota en http://{host}:{port}/orders")
+        return True
+
+
+def order_metrics(orders: List[FleetOrder], hours: float) -> dict:
+    """Conteos, throughput y latencia pedido → entrega"""
+    delivered = [order for order in orders if order.status == "delivered"]
+    latencies = [order.completed - order.created for order in delivered]
+    return {
+        "orders": len(orders),
+        "pending": sum(1 for order in orders if order.status in ("routing", "queued", "cooking")),
+        "delivered": len(delivered),
+        "errors": sum(1 for order in orders if order.status == "error"),
+        "throughput_per_hour": round(len(delivered) / hours, 1),
+        "latency_p50": percentile(latencies, 0.5),
+        "latency_p95": percentile(latencies, 0.95)
+    }
+
+
+class FleetRequestHandler(OrderRequestHandler):
+    """API de pedidos de una celda más GET /fleet con el estado de la flota"""
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/fleet":
+            self.send_json(200, self.server.controller.fleet_status())
+        else:
+            super().do_GET()
+
+
+def print_status(status: dict):
+    """Resumen de una línea por celda"""
+    for cell_id, cell in status["cells"].items():
+        state = "ejecutando" if cell.get("executing") else ("lista" if cell.get("connected") else "sin conexión")
+        print(f"  {cell_id} [{cell['backend']}] {state}: cola {cell.get('queued', 0)}, "
+              f"entregados {cell['delivered']}, errores {cell['errors']}")
+    fleet = status["fleet"]
+    print(f"  Flota: {fleet['delivered']}/{fleet['orders']} entregados, {fleet['throughput_per_hour']}/h")
+
+
+def main():
+    """Función principal"""
+    parser = argparse.ArgumentParser(description="Despachador de pedidos para varias celdas de cocción")
+    parser.add_argument("--cells", default="mock,mock",
+                        help="Backend de cada celda: 'mock' o el puerto de su instancia de RoboDK")
+    parser.add_argument("--host", default=ORDER_SERVER_HOST)
+    parser.add_argument("--port", type=int, default=ORDER_SERVER_PORT)
+    parser.add_argument("--stock", type=int, default=None,
+                        help="Arepas por posición de estantería en cada celda")
+    parser.add_argument("--report", type=float, default=30.0, help="Segundos entre resúmenes en consola")
+    args = parser.parse_args()
+
+    backends = [backend.strip() for backend in args.cells.split(",") if backend.strip()]
+    invalid = [backend for backend in backends if backend != "mock" and not backend.isdigit()]
+    if not backends or invalid:
+        parser.error("--cells necesita 'mock' o un número de puerto por celda")
+
+    print("=" * 40)
+    print("Flota de celdas - Parrilla Automática")
+    print("=" * 40)
+
+    dispatcher = FleetDispatcher(backends, args.stock)
+    ready = dispatcher.start()
+    print(f"Celdas listas: {ready}/{len(backends)}")
+    if not ready or not dispatcher.start_order_server(args.host, args.port):
+        dispatcher.stop()
+        return
+
+    try:
+        while True:
+            time.sleep(args.report)
+            print_status(dispatcher.fleet_status())
+    except KeyboardInterrupt:
+        print("Deteniendo celdas...")
+    finally:
+        dispatcher.stop()
+
+
+if __name__ == "__main__":
+    main()
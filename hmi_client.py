@@ -0,0 +1,385 @@
+"""HMI en un proceso aparte: visor y mando remoto del controlador de arepas.
+
+Se conecta al servidor de estado de Prog1 (puerto 8766), recibe un snapshot al
+conectarse y luego solo los cambios, y envía los comandos Iniciar, Detener,
+Home y Reset. El dibujo y el log corren en este proceso, así que no compiten
+con el hilo de control por el intérprete; se pueden abrir varios visores a la
+vez y el controlador puede correr sin HMI propia (python Prog1.py --headless).
+"""
+import argparse
+import itertools
+import json
+import queue
+import socket
+import threading
+import time
+import tkinter as tk
+from tkinter import ttk, messagebox
+from typing import Dict, List, Optional
+
+from Prog1 import ArepaState, STATE_SERVER_HOST, STATE_SERVER_PORT
+
+RECONNECT_DELAY = 2.0  # s entre intentos de conexión
+POLL_MS = 100          # Periodo de lectura de mensajes del servidor
+MAX_SELECTION = 4
+
+# Mismos colores que la HMI local (update_grill_display)
+GRILL_STYLES = {
+    ArepaState.TRANSPORTING_TO_GRILL.value: ("Moviendo", "yellow", "black"),
+    ArepaState.COOKING_SIDE1.value: ("Lado 1", "orange", "black"),
+    ArepaState.FLIPPING.value: ("Girando", "purple", "black"),
+    ArepaState.COOKING_SIDE2.value: ("Lado 2", "red", "black"),
+    ArepaState.TRANSPORTING_TO_DELIVERY.value: ("Entrega", "lightblue", "black"),
+    ArepaState.ERROR.value: ("ERROR", "darkred", "white"),
+}
+
+
+def apply_delta(state: dict, changes: dict):
+    """Aplica un delta del servidor (los dicts se actualizan un nivel más adentro)"""
+    for key, value in changes.items():
+        if isinstance(value, dict) and isinstance(state.get(key), dict):
+            state[key].update(value)
+        else:
+            state[key] = value
+
+
+class HMIClient:
+    """Visor remoto: un hilo lee del socket y la HMI aplica los mensajes en su propio hilo"""
+
+    def __init__(self, root: tk.Tk, host: str = STATE_SERVER_HOST, port: int = STATE_SERVER_PORT):
+        self.root = root
+        self.root.title(f"Control de Arepas - Visor ({host}:{port})")
+        self.root.geometry("900x600")
+        self.host = host
+        self.port = port
+
+        self.state: dict = {}
+        self.clock_offset = 0.0  # Hora del controlador - hora local
+        self.sock: Optional[socket.socket] = None
+        self.send_lock = threading.Lock()
+        self.inbox: "queue.Queue[dict]" = queue.Queue()
+        self.request_ids = itertools.count(1)
+        self.pending: Dict[int, str] = {}  # Comandos sin respuesta, por id
+        self.selection: List[str] = []     # Orden de selección local
+        self.closing = False
+
+        self.create_interface()
+        threading.Thread(target=self.connection_loop, daemon=True).start()
+        self.poll()
+        self.update_timers()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
+
+    # --- Conexión ---
+
+    def connection_loop(self):
+        """Conecta (y reconecta) con el controlador y encola lo que llega"""
+        while not self.closing:
+            try:
+                sock = socket.create_connection((self.host, self.port), timeout=RECONNECT_DELAY)
+                sock.settimeout(None)
+            except OSError:
+                time.sleep(RECONNECT_DELAY)
+                continue
+
+            self.sock = sock
+            try:
+                for line in sock.makefile("r", encoding="utf-8"):
+                    self.inbox.put(json.loads(line))
+            except (OSError, ValueError):
+                pass
+            finally:
+                self.sock = None
+                sock.close()
+            self.inbox.put({"type": "disconnected"})
+            time.sleep(RECONNECT_DELAY)
+
+    def send_command(self, name: str, items: Optional[List[str]] = None):
+        """Envía un comando; la respuesta llega como mensaje "reply\""""
+        sock = self.sock
+        if sock is None:
+            messagebox.showwarning("Sin conexión", "No hay conexión con el controlador")
+            return
+        request_id = next(self.request_ids)
+        message = {"type": "command", "id": request_id, "name": name}
+        if items is not None:
+            message["items"] = items
+        try:
+            with self.send_lock:
+                sock.sendall((json.dumps(message) + "\n").encode("utf-8"))
+        except OSError as e:
+            messagebox.showerror("Error", f"No se pudo enviar el comando: {str(e)}")
+            return
+        self.pending[request_id] = name
+
+    # --- Mensajes del servidor (hilo de la HMI) ---
+
+    def poll(self):
+        """Aplica los mensajes pendientes y redibuja una sola vez"""
+        changed = False
+        while True:
+            try:
+                message = self.inbox.get_nowait()
+            except queue.Empty:
+                break
+            changed = self.handle_message(message) or changed
+        if changed:
+            self.render()
+        self.root.after(POLL_MS, self.poll)
+
+    def handle_message(self, message: dict) -> bool:
+        """Procesa un mensaje; True si cambió el estado mostrado"""
+        kind = message.get("type")
+        if kind == "snapshot":
+            self.state = message["state"]
+            self.clock_offset = message["clock"] - time.time()
+            self.log_text.delete("1.0", tk.END)
+            self.append_log(message.get("log", []))
+            self.connection_label.config(text=f"● Conectado a {self.host}:{self.port}", foreground="green")
+            return True
+        if kind == "delta":
+            apply_delta(self.state, message["changes"])
+            self.clock_offset = message["clock"] - time.time()
+            return True
+        if kind == "log":
+            self.append_log(message["lines"])
+            return False
+        if kind == "reply":
+            name = self.pending.pop(message.get("id"), "comando")
+            if not message.get("ok"):
+                messagebox.showwarning(name.capitalize(), message.get("error") or "Comando rechazado")
+            return False
+        if kind == "disconnected":
+            self.connection_label.config(text="○ Sin conexión (reintentando...)", foreground="red")
+            self.pending.clear()
+            return False
+        return False
+
+    # --- Interfaz ---
+
+    def create_interface(self):
+        """Crea la interfaz (misma disposición que la HMI local)"""
+        main_frame = ttk.Frame(self.root, padding="5")
+        main_frame.pack(fill="both", expand=True)
+
+        title_label = ttk.Label(main_frame, text="Control de Arepas - Parrilla Automática",
+                                font=('Arial', 14, 'bold'))
+        title_label.grid(row=0, column=0, columnspan=4, pady=(0, 5))
+        self.connection_label = ttk.Label(main_frame, text="○ Conectando...", foreground="gray")
+        self.connection_label.grid(row=1, column=0, columnspan=4)
+
+        # Selección y orden (las arepas llegan con el primer snapshot)
+        self.selection_frame = ttk.LabelFrame(main_frame, text="Selección", padding="5")
+        self.selection_frame.grid(row=2, column=0, columnspan=4, sticky="ew", pady=2)
+        self.arepa_vars: Dict[str, tk.BooleanVar] = {}
+        self.arepa_buttons: Dict[str, ttk.Checkbutton] = {}
+
+        order_frame = ttk.LabelFrame(main_frame, text="Orden", padding="5")
+        order_frame.grid(row=3, column=0, columnspan=4, sticky="ew", pady=2)
+        self.order_label = ttk.Label(order_frame, text="Selecciona arepas", font=('Arial', 9))
+        self.order_label.grid(row=0, column=0, sticky="w")
+        self.queue_label = ttk.Label(order_frame, text="", font=('Arial', 9))
+        self.queue_label.grid(row=0, column=1, sticky="e", padx=(20, 0))
+
+        # El tamaño de la parrilla llega con el primer snapshot
+        self.grill_frame = ttk.LabelFrame(main_frame, text="Parrilla", padding="5")
+        self.grill_frame.grid(row=4, column=0, columnspan=4, sticky="ew", pady=2)
+        self.delivery_frame = ttk.LabelFrame(main_frame, text="Entrega", padding="5")
+        self.delivery_frame.grid(row=5, column=0, columnspan=4, sticky="ew", pady=2)
+        self.grill_labels: List[ttk.Label] = []
+        self.timer_labels: List[ttk.Label] = []
+        self.delivery_labels: List[ttk.Label] = []
+
+        control_frame = ttk.LabelFrame(main_frame, text="Control", padding="5")
+        control_frame.grid(row=6, column=0, columnspan=4, sticky="ew", pady=2)
+        self.btn_start = ttk.Button(control_frame, text="Iniciar", width=12,
+                                    command=lambda: self.send_command("start", list(self.selection)))
+        self.btn_start.grid(row=0, column=0, padx=2, pady=2)
+        self.btn_stop = ttk.Button(control_frame, text="Detener", width=12,
+                                   command=lambda: self.send_command("stop"))
+        self.btn_stop.grid(row=0, column=1, padx=2, pady=2)
+        self.btn_home = ttk.Button(control_frame, text="Home", width=12,
+                                   command=lambda: self.send_command("home"))
+        self.btn_home.grid(row=0, column=2, padx=2, pady=2)
+        self.btn_reset = ttk.Button(control_frame, text="Reset", width=12, command=self.reset_system)
+        self.btn_reset.grid(row=0, column=3, padx=2, pady=2)
+        self.btn_cancel = ttk.Button(control_frame, text="Cancelar", width=12,
+                                     command=lambda: self.send_command("cancel"))
+        self.btn_cancel.grid(row=1, column=0, padx=2, pady=2)
+
+        status_frame = ttk.LabelFrame(main_frame, text="Estado", padding="5")
+        status_frame.grid(row=7, column=0, columnspan=4, sticky="ew", pady=2)
+        self.status_label = ttk.Label(status_frame, text="", font=('Arial', 9, 'bold'))
+        self.status_label.grid(row=0, column=0, sticky="w", pady=(0, 5))
+        self.robot_label = ttk.Label(status_frame, text="", font=('Arial', 9))
+        self.robot_label.grid(row=0, column=1, sticky="e")
+
+        log_frame = ttk.Frame(status_frame)
+        log_frame.grid(row=1, column=0, columnspan=2, sticky="ew")
+        self.log_text = tk.Text(log_frame, height=10, width=80, font=('Courier', 8))
+        scrollbar = ttk.Scrollbar(log_frame, orient="vertical", command=self.log_text.yview)
+        self.log_text.configure(yscrollcommand=scrollbar.set)
+        self.log_text.grid(row=0, column=0, sticky="ew")
+        scrollbar.grid(row=0, column=1, sticky="ns")
+        log_frame.columnconfigure(0, weight=1)
+        status_frame.columnconfigure(0, weight=1)
+
+        for column in range(4):
+            main_frame.columnconfigure(column, weight=1)
+
+    def build_positions(self, frame, prefix: str, count: int, labels: list, timers: Optional[list]):
+        """Crea las etiquetas de las posiciones de parrilla o entrega"""
+        for i in range(count):
+            pos_frame = ttk.Frame(frame)
+            pos_frame.grid(row=0, column=i, padx=5, pady=2)
+            ttk.Label(pos_frame, text=f"{prefix}{i + 1}", font=('Arial', 8, 'bold')).grid(row=0, column=0)
+            label = ttk.Label(pos_frame, text="Vacío", font=('Arial', 8),
+                              background="lightgray", width=8, relief="sunken")
+            label.grid(row=1, column=0, pady=1)
+            labels.append(label)
+            if timers is not None:
+                timer = ttk.Label(pos_frame, text="--:--", font=('Arial', 10, 'bold'), foreground="gray")
+                timer.grid(row=2, column=0)
+                timers.append(timer)
+
+    def build_selection(self):
+        """Checkbuttons de las arepas que publica el controlador"""
+        for i, (arepa_id, arepa) in enumerate(sorted(self.state["arepas"].items())):
+            var = tk.BooleanVar()
+            short_name = arepa["name"].replace("Arepa de ", "").replace("Arepa ", "")
+            btn = ttk.Checkbutton(self.selection_frame, text=f"{arepa_id}:{short_name}", variable=var,
+                                  command=lambda arepa_id=arepa_id: self.on_selection_change(arepa_id))
+            btn.grid(row=0, column=i, padx=5, pady=2, sticky="w")
+            self.arepa_vars[arepa_id] = var
+            self.arepa_buttons[arepa_id] = btn
+
+    def on_selection_change(self, arepa_id: str):
+        """Mantiene el orden en que el operador marca las arepas"""
+        if self.arepa_vars[arepa_id].get():
+            if len(self.selection) >= MAX_SELECTION:
+                self.arepa_vars[arepa_id].set(False)
+                messagebox.showwarning("Límite", f"Máximo {MAX_SELECTION} arepas")
+                return
+            self.selection.append(arepa_id)
+        elif arepa_id in self.selection:
+            self.selection.remove(arepa_id)
+        self.render_order()
+
+    def render(self):
+        """Redibuja todo el estado recibido"""
+        state = self.state
+        if not state:
+            return
+        if not self.arepa_vars:
+            self.build_selection()
+        if not self.grill_labels:
+            self.build_positions(self.grill_frame, "P", len(state["grill"]), self.grill_labels, self.timer_labels)
+            self.grill_frame.config(text=f"Parrilla (1x{len(state['grill'])})")
+            self.build_positions(self.delivery_frame, "E", len(state["delivery"]), self.delivery_labels, None)
+
+        executing = state["executing"]
+        if executing:
+            # Durante el proceso se muestra la selección en curso del controlador
+            self.selection = list(state["selection"])
+            for arepa_id, var in self.arepa_vars.items():
+                var.set(arepa_id in self.selection)
+        for btn in self.arepa_buttons.values():
+            btn.configure(state="disabled" if executing else "normal")
+        self.btn_start.configure(state="disabled" if executing else "normal")
+        self.btn_stop.configure(state="normal" if executing else "disabled")
+        self.render_order()
+
+        queued = state["queued_orders"]
+        self.queue_label.config(text=f"Pedidos en cola: {queued}" if queued else "")
+        command = state.get("command")
+        self.status_label.config(text=f"{state['status']} · {command} en curso" if command else state["status"])
+        self.btn_cancel.configure(state="normal" if command else "disabled")
+        for btn in (self.btn_home, self.btn_reset):
+            btn.configure(state="disabled" if command else "normal")
+        robot = state["robot"] or "sin robot"
+        self.robot_label.config(text=f"{robot} ({'conectado' if state['connected'] else 'desconectado'})")
+
+        for i, (label, arepa_id) in enumerate(zip(self.grill_labels, state["grill"])):
+            if arepa_id is None:
+                quarantined = f"P{i + 1}" in state.get("quarantined", [])
+                label.config(text="Cuarentena" if quarantined else "Vacío",
+                             background="gray" if quarantined else "lightgray", foreground="black")
+                continue
+            text, background, foreground = GRILL_STYLES.get(state["arepas"][arepa_id]["state"], ("", "lightgray", "black"))
+            label.config(text=f"{arepa_id}\n{text}", background=background, foreground=foreground)
+
+        for label, arepa_id in zip(self.delivery_labels, state["delivery"]):
+            if arepa_id is None:
+                label.config(text="Vacío", background="lightgray")
+            elif state["arepas"][arepa_id]["state"] == ArepaState.DELIVERED.value:
+                label.config(text=f"{arepa_id}\nListo", background="lightgreen")
+            else:
+                label.config(text=f"{arepa_id}\nProceso", background="yellow")
+        self.render_timers()
+
+    def render_order(self):
+        if self.selection:
+            self.order_label.config(text=f"Orden: {' → '.join(self.selection)}")
+        else:
+            self.order_label.config(text=f"Selecciona hasta {len(self.grill_labels)} arepas"
+                                    if self.grill_labels else "Selecciona arepas")
+
+    def render_timers(self):
+        """Cuenta regresiva con la hora del controlador estimada localmente"""
+        now = time.time() + self.clock_offset
+        for label, timer in zip(self.timer_labels, self.state.get("timers", [])):
+            if timer is None:
+                label.config(text="--:--", foreground="gray")
+                continue
+            remaining = max(0, timer["duration"] - (now - timer["start_time"]))
+            if remaining > 0:
+                label.config(text=f"{int(remaining // 60):02d}:{int(remaining % 60):02d}",
+                             foreground="red" if timer["side"] == 1 else "blue")
+            else:
+                label.config(text="GIRAR" if timer["side"] == 1 else "LISTO", foreground="green")
+
+    def update_timers(self):
+        self.render_timers()
+        self.root.after(1000, self.update_timers)
+
+    def append_log(self, lines: List[str]):
+        if not lines:
+            return
+        self.log_text.insert(tk.END, "".join(f"{line}\n" for line in lines))
+        self.log_text.see(tk.END)
+
+    def reset_system(self):
+        """Reset: también limpia la selección local"""
+        self.selection = []
+        for var in self.arepa_vars.values():
+            var.set(False)
+        self.render_order()
+        self.send_command("reset")
+
+    def on_closing(self):
+        self.closing = True
+        sock = self.sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.root.destroy()
+
+
+def main():
+    """Función principal"""
+    parser = argparse.ArgumentParser(description="HMI remota del controlador de arepas")
+    parser.add_argument("--host", default=STATE_SERVER_HOST, help="Equipo del controlador")
+    parser.add_argument("--port", type=int, default=STATE_SERVER_PORT, help="Puerto del servidor de estado")
+    args = parser.parse_args()
+
+    root = tk.Tk()
+    HMIClient(root, args.host, args.port)
+    try:
+        root.mainloop()
+    except KeyboardInterrupt:
+        print("\nVisor cerrado por el usuario")
+
+
+if __name__ == "__main__":
+    main()
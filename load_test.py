@@ -0,0 +1,339 @@
+"""Prueba de carga y resistencia del controlador de arepas en tiempo simulado.
+
+Genera flujos de pedidos con procesos de llegada configurables (Poisson o con
+hora pico de almuerzo) y mezcla de productos sobre las seis posiciones de la
+estantería, los envía por la misma vía que el punto de venta
+(ArepaController.submit_order) y deja que el controlador los cocine contra el
+robot simulado. El reloj es virtual: horas de operación corren en segundos.
+
+Reporta longitud de cola, percentiles de espera, throughput, punto de
+saturación y crecimiento de memoria.
+
+Ejemplo:
+    python load_test.py --hours 4 --rates 10,20,30,40 --process rush
+"""
+import argparse
+import heapq
+import itertools
+import json
+import os
+import queue
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+import Prog1
+from Prog1 import ArepaController, ORDER_POLL_MS, percentile
+
+DEFAULT_SIZES = {1: 0.5, 2: 0.3, 3: 0.2}   # Arepas por pedido → probabilidad
+SATURATION_RATIO = 0.95                     # Throughput mínimo (fracción de lo aceptado) para no saturar
+UNLIMITED_STOCK = 10 ** 9                   # La estantería se repone sin límite durante la prueba
+
+
+class SimulatedClock:
+    """Reloj virtual: sleep() avanza el tiempo al instante y ejecuta los eventos agendados"""
+
+    def __init__(self, start: float):
+        self.now = start
+        self.events = []
+        self.sequence = itertools.count()
+        self.lock = threading.Lock()
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        target = self.now + max(seconds, 0.0)
+        while True:
+            with self.lock:
+                if not self.events or self.events[0][0] > target:
+                    break
+                at, _, callback = heapq.heappop(self.events)
+                self.now = max(self.now, at)
+            callback()
+        self.now = max(self.now, target)
+
+    def schedule(self, at: float, callback: Callable[[], None]):
+        """Agenda un evento en tiempo simulado"""
+        with self.lock:
+            heapq.heappush(self.events, (at, next(self.sequence), callback))
+
+
+def constant_rate(rate_per_hour: float) -> Callable[[float], float]:
+    """Proceso de Poisson homogéneo"""
+    return lambda hour: rate_per_hour
+
+
+def lunch_rush_rate(rate_per_hour: float, peak_factor: float, start_hour: float,
+                    end_hour: float) -> Callable[[float], float]:
+    """Tasa base con una ventana de hora pico (horas desde el inicio de la prueba)"""
+    return lambda hour: rate_per_hour * (peak_factor if start_hour <= hour < end_hour else 1.0)
+
+
+def parse_weights(text: str, cast=str) -> Dict:
+    """'A1=3,B2=1' → {'A1': 3.0, 'B2': 1.0}"""
+    weights = {}
+    for part in text.split(","):
+        key, _, value = part.partition("=")
+        weights[cast(key.strip())] = float(value or 1)
+    return weights
+
+
+class LoadTest:
+    """Una corrida de carga a una tasa de llegada dada"""
+
+    def __init__(self, rate: Callable[[float], float], peak_rate: float, hours: float,
+                 mix: Dict[str, float], sizes: Dict[int, float], seed: int,
+                 cook_side1: Optional[float], cook_side2: Optional[float]):
+        self.rate = rate
+        self.peak_rate = peak_rate
+        self.hours = hours
+        self.mix = mix
+        self.sizes = sizes
+        self.rng = random.Random(seed)
+        self.cook_side1 = cook_side1
+        self.cook_side2 = cook_side2
+
+        self.clock = SimulatedClock(time.time())
+        self.start = self.clock.now
+        self.end = self.start + hours * 3600
+        self.arrivals = 0
+        self.rejected_full = 0
+        self.rejected_invalid = 0
+        self.queue_samples: List[int] = []
+        self.memory_samples: List[dict] = []
+        self.app: Optional[ArepaController] = None
+        self.controller_options: Dict = {}  # Argumentos extra de ArepaController (tamaño de la celda)
+        self.track_memory = True            # tracemalloc hace la corrida más lenta
+        self.staging = True                 # Posicionamiento anticipado del robot entre acciones
+
+    def create_controller(self, model_dir: str) -> ArepaController:
+        """Controlador sin HMI con robot simulado y estantería sin límite"""
+        app = ArepaController(None, **self.controller_options)
+        app.debug_mode = False
+        app.write_reports = False
+        app.connection_done.wait()
+        if app.robot is None:
+            raise RuntimeError("No se pudo inicializar el robot simulado")
+
+        # Usa lo aprendido para estimar, pero no escribe sobre el modelo real
+        app.motion_model.path = os.path.join(model_dir, "modelo_tiempos.json")
+        app.order_history.directory = os.path.join(model_dir, "historial_pedidos")
+        app.shelf_capacity = UNLIMITED_STOCK
+        app.staging_enabled = self.staging
+        app.restock_shelves()
+        if self.cook_side1 is not None:
+            app.cook_time_side1 = self.cook_side1
+        if self.cook_side2 is not None:
+            app.cook_time_side2 = self.cook_side2
+        return app
+
+    def draw_order(self) -> List[str]:
+        """Pedido aleatorio: tamaño según 'sizes', arepas distintas según 'mix'"""
+        size = self.rng.choices(list(self.sizes), weights=list(self.sizes.values()))[0]
+        candidates = dict(self.mix)
+        items = []
+        for _ in range(min(size, len(candidates))):
+            item = self.rng.choices(list(candidates), weights=list(candidates.values()))[0]
+            items.append(item)
+            del candidates[item]
+        return items
+
+    def schedule_next_arrival(self, now: float):
+        """Siguiente llegada por thinning (admite tasas variables en el tiempo)"""
+        at = now
+        while True:
+            at += self.rng.expovariate(self.peak_rate / 3600)
+            if at >= self.end:
+                return
+            if self.rng.random() * self.peak_rate <= self.rate((at - self.start) / 3600):
+                self.clock.schedule(at, self.on_arrival)
+                return
+
+    def on_arrival(self):
+        """Evento de llegada: entra por la misma vía que el punto de venta"""
+        self.arrivals += 1
+        self.queue_samples.append(self.app.queued_order_count())
+        try:
+            self.app.submit_order(self.draw_order(), source="load")
+        except queue.Full:
+            self.rejected_full += 1
+        except ValueError:
+            self.rejected_invalid += 1
+        self.schedule_next_arrival(self.clock.now)
+
+    def sample_memory(self):
+        """Memoria de Python y pedidos retenidos, una vez por hora simulada"""
+        current, _ = tracemalloc.get_traced_memory()
+        self.memory_samples.append({"hour": round((self.clock.now - self.start) / 3600, 2),
+                                    "memory_mb": round(current / 1e6, 2),
+                                    "orders_kept": len(self.app.orders)})
+        if self.clock.now + 3600 <= self.end:
+            self.clock.schedule(self.clock.now + 3600, self.sample_memory)
+
+    def run(self) -> dict:
+        previous_clock = Prog1.clock
+        Prog1.set_clock(self.clock)
+        if self.track_memory:
+            tracemalloc.start()
+        wall_start = time.time()
+        try:
+            with tempfile.TemporaryDirectory() as model_dir:
+                self.app = self.create_controller(model_dir)
+                self.sample_memory()
+                self.schedule_next_arrival(self.start)
+
+                while self.clock.now < self.end:
+                    # Mientras cocina, las llegadas se disparan dentro de los sleep del hilo de control
+                    if self.app.dispatch_orders():
+                        self.app.main_control_thread.join()
+                    else:
+                        self.clock.sleep(ORDER_POLL_MS / 1000)
+                self.sample_memory()
+                self.app.order_history.close()
+        finally:
+            if self.app is not None:
+                self.app.supervisor.stop()
+                self.app.cell.stop()
+            tracemalloc.stop()
+            Prog1.set_clock(previous_clock)
+        return self.summary(time.time() - wall_start)
+
+    def summary(self, wall_seconds: float) -> dict:
+        orders = [order for order in self.app.orders.values() if order.source == "load"]
+        delivered = [order for order in orders if order.status == "delivered"]
+        waits = [order.started - order.created for order in orders if order.started is not None]
+        latencies = [order.completed - order.created for order in delivered]
+        accepted = len(orders)
+        memory = self.memory_samples
+        staging = self.app.staging_report()
+
+        return {
+            "hours": self.hours,
+            "offered_per_hour": round(self.arrivals / self.hours, 1),
+            "accepted": accepted,
+            "rejected_queue_full": self.rejected_full,
+            "rejected_invalid": self.rejected_invalid,
+            "delivered": len(delivered),
+            "errors": sum(1 for order in orders if order.status == "error"),
+            "backlog_at_end": sum(1 for order in orders if order.status in ("queued", "cooking")),
+            "throughput_per_hour": round(len(delivered) / self.hours, 1),
+            "arepas_per_hour": round(sum(len(order.items) for order in delivered) / self.hours, 1),
+            "queue_mean": round(sum(self.queue_samples) / len(self.queue_samples), 2) if self.queue_samples else 0,
+            "queue_max": max(self.queue_samples, default=0),
+            "wait_p50_s": percentile(waits, 0.50),
+            "wait_p95_s": percentile(waits, 0.95),
+            "latency_p50_s": percentile(latencies, 0.50),
+            "latency_p90_s": percentile(latencies, 0.90),
+            "latency_p95_s": percentile(latencies, 0.95),
+            "latency_p99_s": percentile(latencies, 0.99),
+            "response_mean_s": staging["response_mean_s"],
+            "staged_moves": staging["staged"],
+            "staging_cancelled": staging["cancelled"],
+            "memory": memory,
+            "memory_growth_mb_per_hour": round((memory[-1]["memory_mb"] - memory[0]["memory_mb"]) / self.hours, 3)
+            if len(memory) > 1 else 0.0,
+            "wall_seconds": round(wall_seconds, 1)
+        }
+
+
+def is_saturated(result: dict) -> bool:
+    """El sistema no sigue la demanda: rechaza por cola llena o entrega menos de lo aceptado"""
+    return (result["rejected_queue_full"] > 0
+            or result["delivered"] < SATURATION_RATIO * result["accepted"])
+
+
+def format_seconds(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:.0f}s"
+
+
+def print_result(rate: float, result: dict):
+    print(f"\n--- {rate:g} pedidos/h ({result['hours']:g} h simuladas en {result['wall_seconds']} s) ---")
+    print(f"Ofrecidos: {result['offered_per_hour']}/h | aceptados {result['accepted']} | "
+          f"rechazados: cola llena {result['rejected_queue_full']}, inválidos {result['rejected_invalid']}")
+    print(f"Entregados: {result['delivered']} ({result['throughput_per_hour']}/h, "
+          f"{result['arepas_per_hour']} arepas/h) | error {result['errors']} | "
+          f"pendientes al final {result['backlog_at_end']}")
+    print(f"Cola al llegar: media {result['queue_mean']}, máx {result['queue_max']}")
+    print(f"Espera hasta cocinar: p50 {format_seconds(result['wait_p50_s'])}, "
+          f"p95 {format_seconds(result['wait_p95_s'])}")
+    print(f"Pedido → entrega: p50 {format_seconds(result['latency_p50_s'])}, "
+          f"p90 {format_seconds(result['latency_p90_s'])}, p95 {format_seconds(result['latency_p95_s'])}, "
+          f"p99 {format_seconds(result['latency_p99_s'])}")
+    if result["response_mean_s"] is not None:
+        print(f"Vencimiento → agarre: media {result['response_mean_s']:.2f} s "
+              f"({result['staged_moves']} movimientos anticipados, {result['staging_cancelled']} cancelados)")
+    print(f"Memoria: {result['memory'][0]['memory_mb']} → {result['memory'][-1]['memory_mb']} MB "
+          f"({result['memory_growth_mb_per_hour']:+} MB/h, "
+          f"{result['memory'][-1]['orders_kept']} pedidos retenidos)")
+
+
+def main():
+    """Función principal"""
+    parser = argparse.ArgumentParser(description="Prueba de carga del controlador de arepas (tiempo simulado)")
+    parser.add_argument("--hours", type=float, default=4.0, help="Horas simuladas por tasa")
+    parser.add_argument("--rates", default="10,20,30,40,60",
+                        help="Tasas base de llegada a barrer (pedidos/hora)")
+    parser.add_argument("--process", choices=["poisson", "rush"], default="poisson",
+                        help="Proceso de llegada: Poisson o con hora pico de almuerzo")
+    parser.add_argument("--rush", default="1,2.5,3",
+                        help="Hora pico: inicio_h,fin_h,factor (desde el inicio de la prueba)")
+    parser.add_argument("--mix", default="A1=1,A2=1,A3=1,B1=1,B2=1,B3=1",
+                        help="Pesos de cada producto de la estantería")
+    parser.add_argument("--sizes", default=",".join(f"{k}={v}" for k, v in DEFAULT_SIZES.items()),
+                        help="Probabilidad de cada tamaño de pedido")
+    parser.add_argument("--cook", type=float, nargs=2, metavar=("LADO1", "LADO2"),
+                        help="Tiempos de cocción por lado en segundos (por defecto los del controlador)")
+    parser.add_argument("--no-staging", action="store_true",
+                        help="Sin posicionamiento anticipado del robot (para comparar)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="Guardar los resultados en un archivo JSON")
+    args = parser.parse_args()
+
+    if Prog1.ROBODK_AVAILABLE:
+        # La prueba usa siempre el robot simulado, nunca la estación real
+        Prog1.ROBODK_AVAILABLE = False
+
+    mix = parse_weights(args.mix)
+    sizes = {int(size): weight for size, weight in parse_weights(args.sizes).items()}
+    rush_start, rush_end, rush_factor = (float(value) for value in args.rush.split(","))
+    cook_side1, cook_side2 = args.cook if args.cook else (None, None)
+
+    print("=" * 40)
+    print("Prueba de carga - Parrilla Automática")
+    print("=" * 40)
+    results = {}
+    saturation = None
+    for rate in (float(value) for value in args.rates.split(",")):
+        if args.process == "rush":
+            arrival_rate = lunch_rush_rate(rate, rush_factor, rush_start, rush_end)
+            peak_rate = rate * max(rush_factor, 1.0)
+        else:
+            arrival_rate, peak_rate = constant_rate(rate), rate
+        test = LoadTest(arrival_rate, peak_rate, args.hours, mix, sizes, args.seed, cook_side1, cook_side2)
+        test.staging = not args.no_staging
+        result = test.run()
+        results[f"{rate:g}"] = result
+        print_result(rate, result)
+        if saturation is None and is_saturated(result):
+            saturation = rate
+
+    print("\n" + "=" * 40)
+    best = max(results.values(), key=lambda result: result["throughput_per_hour"])
+    if saturation is None:
+        print(f"Sin saturación hasta {args.rates.split(',')[-1]} pedidos/h")
+    else:
+        print(f"Saturación a partir de ~{saturation:g} pedidos/h "
+              f"(throughput máximo observado {best['throughput_per_hour']} pedidos/h)")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "saturation_rate": saturation, "results": results}, f, indent=2)
+        print(f"Resultados en {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Consultas sobre el historial de pedidos del controlador de arepas.
+
+El controlador guarda el ciclo de vida de cada pedido cerrado (producto,
+posición de estante, hora de cada estado de la arepa y atraso respecto a la
+hora estimada) en segmentos columnar dentro de historial_pedidos/. Este
+script lee solo las columnas que necesita y reporta la latencia por producto
+(mediana y percentil) y el throughput por hora.
+
+Ejemplo:
+    python order_history.py --days 14 --percentile 95
+"""
+import argparse
+import json
+import time
+
+from Prog1 import ORDER_HISTORY_DIR, OrderHistoryStore
+
+
+def parse_date(value: str) -> float:
+    """'AAAA-MM-DD' (hora local) → epoch"""
+    return time.mktime(time.strptime(value, "%Y-%m-%d"))
+
+
+def format_seconds(value) -> str:
+    return "-" if value is None else f"{value:.0f} s"
+
+
+def main():
+    """Función principal"""
+    parser = argparse.ArgumentParser(description="Latencia por producto y throughput por hora del historial de pedidos")
+    parser.add_argument("--dir", default=ORDER_HISTORY_DIR, help="Carpeta del historial")
+    parser.add_argument("--days", type=float, default=None, help="Solo los pedidos de los últimos N días")
+    parser.add_argument("--since", default=None, help="Desde la fecha AAAA-MM-DD")
+    parser.add_argument("--until", default=None, help="Hasta la fecha AAAA-MM-DD (sin incluirla)")
+    parser.add_argument("--percentile", type=float, default=95, help="Percentil de latencia (0-100)")
+    parser.add_argument("--json", action="store_true", help="Salida en JSON")
+    args = parser.parse_args()
+
+    if not 0 < args.percentile <= 100:
+        parser.error("--percentile debe estar entre 0 y 100")
+    try:
+        since = parse_date(args.since) if args.since else None
+        until = parse_date(args.until) if args.until else None
+    except ValueError:
+        parser.error("Las fechas van como AAAA-MM-DD")
+    if args.days is not None:
+        since = max(since or 0.0, time.time() - args.days * 86400)
+
+    store = OrderHistoryStore(args.dir)
+    fraction = args.percentile / 100
+    started = time.perf_counter()
+    latency = store.latency_by_product(fraction, since, until)
+    throughput = store.throughput_per_hour(since, until)
+    elapsed = time.perf_counter() - started
+
+    if args.json:
+        print(json.dumps({"latency_by_product": latency, "throughput_per_hour": throughput}, indent=1))
+        return
+
+    print("=" * 40)
+    print("Historial de pedidos - Parrilla Automática")
+    print("=" * 40)
+    key = f"p{round(fraction * 100)}"
+    print(f"{'Producto':<22}{'Entregadas':>11}{'p50':>9}{key:>9}")
+    for product, stats in latency.items():
+        print(f"{product:<22}{stats['delivered']:>11}{format_seconds(stats['p50']):>9}"
+              f"{format_seconds(stats[key]):>9}")
+    if not latency:
+        print("(sin arepas entregadas en el período)")
+
+    print(f"\n{'Hora':<18}{'Arepas':>7}")
+    for hour, delivered in throughput.items():
+        print(f"{hour:<18}{delivered:>7}")
+    print(f"\nConsulta en {elapsed * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
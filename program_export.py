@@ -0,0 +1,167 @@
+"""Exporta un ciclo de cocción completo como programa nativo del robot.
+
+Planifica las etapas (transporte, volteo, entrega y Home) para un conjunto de
+arepas y una asignación de parrilla, programa las esperas de cocción con los
+tiempos estimados del controlador y genera, con el post-procesador de RoboDK
+(p. ej. Motoman), un programa por etapa más el programa principal del ciclo
+que las llama en orden. Ejecutado en el controlador, el ciclo no depende de la
+latencia del PC entre movimientos.
+"""
+import argparse
+import os
+import time
+import tkinter as tk
+
+import Prog1
+from Prog1 import ArepaController, CycleStage, ROBODK_AVAILABLE, NATIVE_PROGRAM_PREFIX, NATIVE_PROGRAMS_DIR
+
+CYCLE_PROGRAM_NAME = f"{NATIVE_PROGRAM_PREFIX}Ciclo"
+
+
+def schedule_cycle(app: ArepaController, arepa_ids, grill_slots):
+    """Ordena las etapas del ciclo en el tiempo: [(espera previa en s, etapa), ...]
+
+    Primero todos los transportes y luego, por orden de vencimiento, los
+    volteos y las entregas; las entregas ocupan las posiciones libres en el
+    orden en que ocurren.
+    """
+    snapshot = app.cell.snapshot
+    free_deliveries = [i + 1 for i, arepa_id in enumerate(snapshot.delivery_positions) if arepa_id is None]
+    if len(arepa_ids) > len(free_deliveries):
+        raise ValueError(f"Solo hay {len(free_deliveries)} posiciones de entrega libres")
+
+    schedule = []
+    now = 0.0
+    position = "Home"
+    due = []  # (vencimiento, tipo, arepa, posición de parrilla)
+
+    def add(stage: CycleStage, at: float):
+        nonlocal now, position
+        schedule.append((max(0.0, at - now), stage))
+        now = max(now, at) + app.estimate_sequence_duration(stage.program_steps, position, stage.arepa_id)
+        position = stage.program_steps[-1].target
+
+    for arepa_id, slot in zip(arepa_ids, grill_slots):
+        add(app.transport_stage(arepa_id, slot), now)
+        due.append((now + app.cook_time_side1, "flip", arepa_id, slot))
+
+    delivered = 0
+    while due:
+        due.sort()
+        at, kind, arepa_id, slot = due.pop(0)
+        if kind == "flip":
+            add(app.flip_stage(arepa_id, slot), at)
+            due.append((now + app.cook_time_side2, "delivery", arepa_id, slot))
+        else:
+            delivered += 1
+            remaining = delivered < len(arepa_ids)
+            add(app.delivery_stage(arepa_id, slot, free_deliveries[delivered - 1], remaining), at)
+
+    add(app.home_stage(), now)
+    return schedule, now
+
+
+def write_cycle_program(app: ArepaController, schedule):
+    """Programa principal: espera de cocción y llamada a cada etapa"""
+    previous = app.RDK.Item(CYCLE_PROGRAM_NAME, Prog1.ITEM_TYPE_PROGRAM)
+    if previous.Valid():
+        previous.Delete()
+    program = app.RDK.AddProgram(CYCLE_PROGRAM_NAME, app.robot)
+    for wait, stage in schedule:
+        if wait > 0:
+            program.Pause(wait * 1000)
+        program.RunInstruction(stage.name, Prog1.robolink.INSTRUCTION_CALL_PROGRAM)
+    return program
+
+
+def export_cycle(app: ArepaController, arepa_ids, grill_slots, folder: str,
+                 post_processor=None, upload: bool = False) -> bool:
+    """Genera las etapas y el ciclo en la estación y los traduce al lenguaje del robot"""
+    schedule, duration = schedule_cycle(app, arepa_ids, grill_slots)
+    app.set_post_processor(post_processor)
+    os.makedirs(folder, exist_ok=True)
+
+    print(f"Ciclo: {' → '.join(arepa_ids)} en parrilla {grill_slots} (≈{duration:.0f} s)")
+    programs = {}
+    for wait, stage in schedule:
+        if stage.name not in programs:
+            programs[stage.name] = app.write_native_program(stage)
+        print(f"  {'espera ' + format(wait, '.1f') + ' s, ' if wait > 0 else ''}{stage.name}")
+    programs[CYCLE_PROGRAM_NAME] = write_cycle_program(app, schedule)
+
+    ok = True
+    for name, program in programs.items():
+        made, message = app.make_native_program(program, folder, upload)
+        print(f"{'✓' if made else '✗'} {name}{': ' + message if message and not made else ''}")
+        ok = ok and made
+    print(f"Programas en {folder}" + (" (enviados al robot)" if upload else ""))
+    return ok
+
+
+def parse_slots(value: str, count: int, grill_size: int):
+    """Posiciones de parrilla "2,1,3" (1..grill_size); por defecto, el orden de selección"""
+    if count > grill_size:
+        raise ValueError(f"La parrilla tiene {grill_size} posiciones y se pidieron {count} arepas")
+    if not value:
+        return list(range(1, count + 1))
+    try:
+        slots = [int(slot) for slot in value.split(",")]
+    except ValueError:
+        raise ValueError(f"--slots necesita números de posición, no '{value}'")
+    if len(slots) != count or len(set(slots)) != count or not all(1 <= slot <= grill_size for slot in slots):
+        raise ValueError(f"--slots necesita una posición distinta (1-{grill_size}) por arepa")
+    return slots
+
+
+def main():
+    """Función principal"""
+    parser = argparse.ArgumentParser(description="Exporta un ciclo de cocción como programa nativo del robot")
+    parser.add_argument("--items", required=True, help="IDs de estante en orden, p. ej. A1,B2,A3")
+    parser.add_argument("--slots", default="", help="Posición de parrilla de cada arepa, p. ej. 2,1,3")
+    parser.add_argument("--post", default=None, help="Post-procesador de RoboDK (p. ej. Motoman)")
+    parser.add_argument("--folder", default=NATIVE_PROGRAMS_DIR, help="Carpeta de salida")
+    parser.add_argument("--upload", action="store_true", help="Enviar los programas al controlador")
+    args = parser.parse_args()
+
+    print("=" * 40)
+    print("Exportación de programa nativo - Parrilla Automática")
+    print("=" * 40)
+
+    if not ROBODK_AVAILABLE:
+        print("Error: se necesita RoboDK para generar programas nativos")
+        return
+
+    arepa_ids = [item.strip() for item in args.items.split(",") if item.strip()]
+
+    root = tk.Tk()
+    root.withdraw()
+    app = ArepaController(root)
+
+    # La conexión es en segundo plano: procesar eventos de Tk mientras termina
+    while not app.connection_done.is_set():
+        root.update()
+        time.sleep(0.05)
+
+    if app.robot is None:
+        print("Error: robot no inicializado")
+        root.destroy()
+        return
+
+    try:
+        unknown = [arepa_id for arepa_id in arepa_ids if arepa_id not in app.arepas]
+        if unknown:
+            print(f"Error: arepas desconocidas: {', '.join(unknown)}")
+            return
+        # El tamaño de la parrilla se conoce recién con el controlador armado
+        try:
+            grill_slots = parse_slots(args.slots, len(arepa_ids), len(app.grill_positions))
+        except ValueError as e:
+            print(f"Error: {str(e)}")
+            return
+        export_cycle(app, arepa_ids, grill_slots, args.folder, args.post, args.upload)
+    finally:
+        root.destroy()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""Exporta un snapshot compacto de la estación de RoboDK para simular sin RoboDK.
+
+Guarda la pose de cada target (y sus articulaciones), los marcos de referencia
+y los límites articulares del robot en estacion_snapshot.json. Sin RoboDK, el
+robot simulado de Prog1 carga ese archivo y mueve entre las poses reales de la
+celda, así que las simulaciones y pruebas de carga tienen geometría realista.
+
+Las poses quedan en la base del robot: mm y grados [x, y, z, rx, ry, rz].
+"""
+import argparse
+import json
+import math
+import os
+import time
+
+import Prog1
+from Prog1 import (compute_file_hash, load_settings, ITEM_TYPE_FRAME, ITEM_TYPE_ROBOT, ITEM_TYPE_TARGET,
+                   ROBODK_AVAILABLE, STATION_FILE_DEFAULT, STATION_SNAPSHOT_FILE, STATION_SNAPSHOT_VERSION)
+
+
+def pose_to_list(pose) -> list:
+    """Pose de RoboDK → [x, y, z, rx, ry, rz] en mm y grados"""
+    values = Prog1.robomath.Pose_2_TxyzRxyz(pose)
+    return [round(value, 3) for value in values[:3]] + [round(math.degrees(value), 4) for value in values[3:]]
+
+
+def relative_pose(base_inverse, item) -> list:
+    """Pose de un item respecto a la base del robot"""
+    return pose_to_list(base_inverse * item.PoseAbs())
+
+
+def item_joints(item, n_axes: int):
+    """Articulaciones guardadas en un target (None si no tiene una configuración completa)"""
+    try:
+        joints = item.Joints().list()
+    except Exception:
+        return None
+    if len(joints) < n_axes:
+        return None
+    return [round(value, 4) for value in joints[:n_axes]]
+
+
+def parent_name(item):
+    try:
+        parent = item.Parent()
+        return parent.Name() if parent.Valid() else None
+    except Exception:
+        return None
+
+
+def take_snapshot(RDK, robot, station_file: str) -> dict:
+    """Lee targets, marcos y límites del robot de la estación abierta"""
+    base_inverse = Prog1.robomath.invH(robot.PoseAbs())
+    lower, upper = robot.JointLimits()[:2]
+    lower, upper = lower.list(), upper.list()
+    n_axes = len(lower)
+
+    frames = {}
+    for frame in RDK.ItemList(ITEM_TYPE_FRAME):
+        frames[frame.Name()] = {"pose": relative_pose(base_inverse, frame), "joints": None,
+                                "parent": parent_name(frame)}
+
+    targets = {}
+    for target in RDK.ItemList(ITEM_TYPE_TARGET):
+        targets[target.Name()] = {"pose": relative_pose(base_inverse, target),
+                                  "joints": item_joints(target, n_axes),
+                                  "frame": parent_name(target)}
+
+    station_name = os.path.basename(station_file) if station_file else ""
+    return {
+        "version": STATION_SNAPSHOT_VERSION,
+        "station": station_name,
+        "station_hash": compute_file_hash(station_file) if station_file and os.path.isfile(station_file) else None,
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "robot": {
+            "name": robot.Name(),
+            "joint_lower": [round(value, 4) for value in lower],
+            "joint_upper": [round(value, 4) for value in upper],
+            "home_joints": [round(value, 4) for value in robot.JointsHome().list()]
+        },
+        "frames": frames,
+        "targets": targets
+    }
+
+
+def find_robot(RDK, name):
+    """Robot por nombre (argumento o el recordado en config_arepas.json) o el primero de la estación"""
+    name = name or load_settings().get("robot_name")
+    if name:
+        robot = RDK.Item(name, ITEM_TYPE_ROBOT)
+        if robot.Valid():
+            return robot
+        print(f"⚠️ Robot '{name}' no encontrado, se usa el primero de la estación")
+    return RDK.Item("", ITEM_TYPE_ROBOT)
+
+
+def main():
+    """Función principal"""
+    parser = argparse.ArgumentParser(description="Exporta targets, marcos y límites de la estación a un snapshot")
+    parser.add_argument("--station", default=None,
+                        help=f"Archivo .rdk a abrir (por defecto la estación abierta o {os.path.basename(STATION_FILE_DEFAULT)})")
+    parser.add_argument("--robot", default=None, help="Nombre del robot en la estación")
+    parser.add_argument("--output", default=STATION_SNAPSHOT_FILE, help="Archivo de salida")
+    args = parser.parse_args()
+
+    print("=" * 40)
+    print("Snapshot de estación - Parrilla Automática")
+    print("=" * 40)
+
+    if not ROBODK_AVAILABLE:
+        print("Error: se necesita RoboDK para leer la estación")
+        return
+
+    RDK = Prog1.create_robolink()
+    if not Prog1.ROBODK_AVAILABLE:
+        print("Error: no se pudo cargar la API de RoboDK")
+        return
+
+    station_file = args.station
+    if station_file:
+        RDK.AddFile(os.path.abspath(station_file))
+    else:
+        station_file = RDK.getParam("FILE_OPENSTATION") or ""
+        if not RDK.getOpenStations():
+            station_file = STATION_FILE_DEFAULT
+            RDK.AddFile(station_file)
+
+    robot = find_robot(RDK, args.robot)
+    if not robot.Valid():
+        print("Error: la estación no tiene robot")
+        return
+
+    snapshot = take_snapshot(RDK, robot, station_file)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f, indent=1)
+
+    print(f"Estación: {station_file or '(sin archivo)'}")
+    print(f"Robot: {snapshot['robot']['name']} ({len(snapshot['robot']['joint_lower'])} ejes)")
+    print(f"Targets: {len(snapshot['targets'])}, marcos: {len(snapshot['frames'])}")
+    print(f"Snapshot guardado en {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+import json
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Prog1  # noqa: E402
+from load_test import SimulatedClock  # noqa: E402
+
+
+@pytest.fixture
+def make_controller(tmp_path, monkeypatch):
+    """Controlador sin HMI con el robot simulado, reloj virtual y archivos en tmp_path"""
+    monkeypatch.setattr(Prog1, "ROBODK_AVAILABLE", False)
+    monkeypatch.setattr(Prog1, "SETTINGS_FILE", str(tmp_path / "config_arepas.json"))
+    previous_clock = Prog1.clock
+    Prog1.set_clock(SimulatedClock(time.time()))
+    apps = []
+
+    def make(settings=None, **kwargs):
+        if settings is not None:
+            with open(Prog1.SETTINGS_FILE, "w", encoding="utf-8") as f:
+                json.dump(settings, f)
+        app = Prog1.ArepaController(None, **kwargs)
+        app.debug_mode = False
+        app.write_reports = False
+        app.connection_done.wait()
+        app.motion_model.path = str(tmp_path / "modelo_tiempos.json")
+        app.order_history.directory = str(tmp_path / "historial_pedidos")
+        app.cook_time_side1 = app.cook_time_side2 = 5
+        apps.append(app)
+        return app
+
+    yield make
+    for app in apps:
+        app.stop_control = True
+        if app.main_control_thread is not None:
+            app.main_control_thread.join(timeout=10)
+        app.shutdown()
+    Prog1.set_clock(previous_clock)
@@ -0,0 +1,81 @@
+"""Falla de una etapa con la arepa en el gripper (run_stage_retrying → recover_held_arepa)"""
+from Prog1 import ArepaState
+
+
+def fail_from_call(app, n):
+    """MoveL simulado que falla desde su n-ésima llamada, siempre hacia el mismo target"""
+    move = app.move_to_target_linear
+    calls = []
+    failing = []
+
+    def flaky(target, *args, **kwargs):
+        calls.append(target)
+        if len(calls) == n:
+            failing.append(target)
+        if target in failing:
+            return False
+        return move(target, *args, **kwargs)
+
+    app.move_to_target_linear = flaky
+    return failing
+
+
+def record_gripper(app):
+    operate = app.operate_gripper
+    actions = []
+
+    def recorded(action):
+        actions.append(action)
+        return operate(action)
+
+    app.operate_gripper = recorded
+    return actions
+
+
+def run_batch(app):
+    assert app.dispatch_orders()
+    app.main_control_thread.join(timeout=60)
+    assert not app.main_control_thread.is_alive()
+
+
+def test_failure_after_grasp_stops_batch_at_home(make_controller):
+    app = make_controller()
+    app.slot_assignment = "selection"
+    first = app.submit_order(["A1"])
+    second = app.submit_order(["B1"])
+    # 1 intermedia, 2 estante (agarre), 3 intermedia, 4 sobre la parrilla: falla con la arepa tomada
+    failing = fail_from_call(app, 4)
+    actions = record_gripper(app)
+
+    run_batch(app)
+
+    assert failing == ["Parrilla_Pos1"]
+    assert actions == ["grasp"]  # No tomó otra arepa con la fallida en el gripper
+    assert app.held_arepa == "A1"
+    assert app.current_target == "Home"
+    assert "P1" in app.quarantined
+    assert first.status == "error"
+    assert app.arepas["B1"].state == ArepaState.IDLE
+    assert second.status != "delivered"
+    assert not app.dispatch_orders()
+
+    app.reset_system()
+    assert actions == ["grasp", "release"]
+    assert app.held_arepa is None
+
+
+def test_failure_after_grasp_drops_arepa_at_discard(make_controller):
+    app = make_controller({"fault_handling": {"discard_target": "Entrega_Pos4"}})
+    app.slot_assignment = "selection"
+    first = app.submit_order(["A1"])
+    second = app.submit_order(["B1"])
+    fail_from_call(app, 4)
+    actions = record_gripper(app)
+
+    run_batch(app)
+
+    assert actions[:2] == ["grasp", "release"]
+    assert app.held_arepa is None
+    assert first.status == "error"
+    assert second.status == "delivered"
+    assert app.arepas["B1"].state == ArepaState.DELIVERED
@@ -0,0 +1,33 @@
+"""Existencias de una celda en el enrutador de la flota (CellState.has_stock / reserve)"""
+from fleet import CellState
+
+
+def make_cell():
+    cell = CellState("C1", "sim")
+    cell.status = {"products": {"A1": "Queso", "A2": "Queso", "B1": "Pollo"},
+                   "stock": {"Queso": 2, "A1": 2, "A2": 2, "Pollo": 1, "B1": 1}}
+    return cell
+
+
+def test_slot_ids_are_aliases_of_their_product():
+    cell = make_cell()
+    assert cell.order_products(["A1", "Pollo"]) == ["Queso", "Pollo"]
+    assert cell.order_products(["Carne"]) is None
+    assert not cell.has_stock(["Carne"])
+
+
+def test_has_stock_counts_units_and_positions_per_product():
+    cell = make_cell()
+    assert cell.has_stock(["A1", "A2"])
+    assert cell.has_stock(["Queso", "A1"])  # El mismo producto por nombre y por alias
+    assert not cell.has_stock(["A1", "A1", "Queso"])
+    assert not cell.has_stock(["B1", "B1"])
+
+
+def test_reserve_decrements_product_and_aliases():
+    cell = make_cell()
+    cell.reserve(["A2"])
+    assert cell.status["stock"] == {"Queso": 1, "A1": 1, "A2": 1, "Pollo": 1, "B1": 1}
+    assert not cell.has_stock(["A1", "A2"])
+    cell.reserve(["Pollo"])
+    assert not cell.has_stock(["B1"])
@@ -0,0 +1,44 @@
+"""Los hilos de fondo no tocan Tk: log y estado se agendan en el hilo de la HMI"""
+import threading
+
+
+class FakeRoot:
+    def __init__(self):
+        self.pending = []
+
+    def after(self, delay, callback):
+        self.pending.append(callback)
+
+    def update_idletasks(self):
+        pass
+
+
+class FakeWidget:
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.calls.append((name, threading.current_thread()))
+
+
+def test_background_log_and_status_run_on_hmi_thread(make_controller):
+    app = make_controller()
+    app.root, app.log_text, app.status_label = FakeRoot(), FakeWidget(), FakeWidget()
+
+    worker = threading.Thread(target=lambda: (app.log_message("desde el hilo"),
+                                              app.update_status("Ocupado")))
+    worker.start()
+    worker.join()
+
+    assert app.log_text.calls == [] and app.status_label.calls == []
+    assert app.status_text == "Ocupado"
+    assert app.hmi_log[-1][1].endswith("desde el hilo")
+    for callback in app.root.pending:
+        callback()
+    calls = app.log_text.calls + app.status_label.calls
+    assert [name for name, _ in calls] == ["insert", "see", "config"]
+    assert all(thread is threading.main_thread() for _, thread in calls)
+
+    app.log_message("desde la HMI")
+    assert app.log_text.calls[-1][0] == "see" and len(app.root.pending) == 2
+    app.root, app.log_text, app.status_label = None, None, None
@@ -0,0 +1,54 @@
+"""ShelfInventory: reservas por producto, asignación de posiciones y descuento al tomar"""
+from Prog1 import ShelfInventory, ShelfSlot
+
+
+def make_inventory():
+    return ShelfInventory([ShelfSlot("A1", "Queso", capacity=3, units=3, low_water=1),
+                           ShelfSlot("A2", "Queso", capacity=3, units=1, low_water=0),
+                           ShelfSlot("B1", "Pollo", capacity=2, units=2, low_water=0)])
+
+
+def test_product_of_accepts_slot_ids_as_aliases():
+    inventory = make_inventory()
+    assert inventory.product_of("Queso") == "Queso"
+    assert inventory.product_of("A2") == "Queso"
+    assert inventory.product_of("Z9") is None
+
+
+def test_reserve_and_release_by_product():
+    inventory = make_inventory()
+    assert inventory.available("Queso") == 4
+    inventory.reserve(["Queso", "Queso", "Pollo"])
+    assert inventory.available("Queso") == 2
+    assert inventory.available("Pollo") == 1
+    inventory.release(["Queso", "Pollo", "Pollo"])
+    assert inventory.available("Queso") == 3
+    assert inventory.available("Pollo") == 2  # La liberación no baja de cero
+    assert inventory.available("Queso", blocked={"A1"}) == 0
+
+
+def test_choose_slots_uses_distinct_nearest_slots():
+    inventory = make_inventory()
+    inventory.rank_slots({"A1": 2.0, "A2": 1.0})
+    assert inventory.choose_slots(["Queso", "Queso"]) == ["A2", "A1"]
+    assert inventory.choose_slots(["Queso"], blocked={"A2"}) == ["A1"]
+    assert inventory.choose_slots(["Queso", "Queso", "Queso"]) is None
+
+
+def test_pick_decrements_units_and_reservation_and_opens_request():
+    inventory = make_inventory()
+    inventory.reserve(["Queso"])
+    assert inventory.pick("A1") is None
+    assert inventory.slots["A1"].units == 2
+    assert inventory.units["Queso"] == 3
+    assert inventory.reserved["Queso"] == 0
+
+    request = inventory.pick("A1")
+    assert request["slot"] == "A1" and request["units"] == 1
+    assert inventory.pick("A1") is None  # Solicitud ya abierta
+    assert inventory.slots["A1"].units == 0
+
+    assert inventory.refill(["A1"]) == ["A1"]
+    assert inventory.slots["A1"].units == 3
+    assert inventory.units["Queso"] == 4
+    assert inventory.requests == {}
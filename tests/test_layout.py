@@ -0,0 +1,41 @@
+"""Targets paramétricos de parrilla y entrega (layout_target_poses)"""
+import pytest
+
+from Prog1 import layout_target_poses, matrix_to_pose, pose_to_matrix
+
+LAYOUT = {"first_slot": [400, -225, 50, 180, 0, 0], "pitch": [0, 150, 0], "approach": 120,
+          "delivery": {"first_slot": [0, 400, 60, 180, 0, 0], "pitch": [150, 0, 0]}}
+
+
+def test_pose_matrix_round_trip():
+    values = [10, -20, 30, 15, -40, 75]
+    assert matrix_to_pose(pose_to_matrix(values)) == pytest.approx(values)
+
+
+def test_grill_slots_follow_pitch_and_approach():
+    poses = layout_target_poses(LAYOUT, [0] * 6, [0] * 6, 3, 2)
+    assert poses["Parrilla_Arepa1"] == pytest.approx([400, -225, 50, 180, 0, 0])
+    assert poses["Parrilla_Arepa3"][:3] == pytest.approx([400, 75, 50])
+    assert poses["Parrilla_Pos2"][:3] == pytest.approx([400, -75, 170])
+    assert "Parrilla_Arepa4" not in poses
+
+
+def test_flip_turns_the_tool_about_its_z():
+    poses = layout_target_poses(LAYOUT, [0] * 6, [0] * 6, 1, 0)
+    flipped = pose_to_matrix(poses["Parrilla_Giro_Pos1"])
+    place = pose_to_matrix(poses["Parrilla_Arepa1"])
+    assert [row[3] for row in flipped[:3]] == pytest.approx([row[3] for row in place[:3]])
+    # Giro de 180° en Z de la herramienta: X e Y de la herramienta se invierten, Z se mantiene
+    for row in range(3):
+        assert flipped[row][0] == pytest.approx(-place[row][0], abs=1e-9)
+        assert flipped[row][1] == pytest.approx(-place[row][1], abs=1e-9)
+        assert flipped[row][2] == pytest.approx(place[row][2], abs=1e-9)
+    assert poses["Parrilla_Pos1_Giro"][2] == pytest.approx(170)
+
+
+def test_frames_move_grill_and_delivery():
+    poses = layout_target_poses(LAYOUT, [100, 0, 0, 0, 0, 90], [0, 0, 500, 0, 0, 0], 2, 2)
+    # Marco girado 90° en Z: el paso en Y del marco es -X del robot
+    assert poses["Parrilla_Arepa1"][:3] == pytest.approx([325, 400, 50])
+    assert poses["Parrilla_Arepa2"][:3] == pytest.approx([175, 400, 50])
+    assert poses["Entrega_Pos2"][:3] == pytest.approx([150, 400, 560])
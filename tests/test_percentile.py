@@ -0,0 +1,21 @@
+"""Percentil por rango más cercano"""
+from Prog1 import percentile
+
+
+def test_empty_is_none():
+    assert percentile([], 0.5) is None
+
+
+def test_nearest_rank():
+    values = list(range(1, 21))
+    assert percentile(values, 0.50) == 10
+    assert percentile(values, 0.95) == 19
+    assert percentile(values, 0.99) == 20
+    assert percentile(values, 1.0) == 20
+    assert percentile(values, 0.0) == 1
+
+
+def test_unsorted_input_and_float_edge():
+    assert percentile([3, 1, 2], 0.5) == 2
+    # 0.28·25 = 7.000000000000001 en coma flotante: sigue siendo el 7.º valor
+    assert percentile(list(range(1, 26)), 0.28) == 7
@@ -0,0 +1,31 @@
+"""Asignación de posiciones de parrilla por recorrido (plan_grill_slots)"""
+
+
+def test_selection_mode_keeps_selection_order(make_controller):
+    app = make_controller()
+    app.slot_assignment = "selection"
+    assert app.plan_grill_slots(["B3", "A1", "B1"]) == {"B3": 1, "A1": 2, "B1": 3}
+
+
+def test_travel_mode_is_never_worse_than_selection(make_controller):
+    app = make_controller()
+    app.slot_assignment = "travel"
+    arepa_ids = ["B3", "A1", "B1"]
+    plan = app.plan_grill_slots(arepa_ids)
+
+    assert set(plan) == set(arepa_ids)
+    assert len(set(plan.values())) == 3
+    legs = {}
+    planned = app.batch_travel(arepa_ids, tuple(plan[a] for a in arepa_ids), legs)[1]
+    selection = app.batch_travel(arepa_ids, (1, 2, 3), legs)[1]
+    assert planned <= selection
+    assert app.shift_travel["planned"][1] <= app.shift_travel["selection"][1]
+
+
+def test_quarantined_slot_is_skipped(make_controller):
+    app = make_controller()
+    app.quarantined["P1"] = "falla"
+    for mode in ("selection", "travel"):
+        app.slot_assignment = mode
+        plan = app.plan_grill_slots(["A1", "A2"])
+        assert 1 not in plan.values()
@@ -0,0 +1,45 @@
+"""Anticipación del robot (staging_move) con el MoveL sin bloquear del robot simulado"""
+import math
+
+import Prog1
+
+
+def test_mock_non_blocking_move_stays_busy_for_its_duration(make_controller):
+    app = make_controller()
+    start = Prog1.clock.time()
+    duration = app.robot.MoveL(app.target_pose("Parrilla_Pos2"), False)
+    assert duration > 0 and app.robot.Busy()
+    Prog1.clock.sleep(duration)
+    assert not app.robot.Busy()
+    assert Prog1.clock.time() - start >= duration - 1e-6
+
+
+def test_staging_move_reaches_approach(make_controller):
+    app = make_controller()
+    app.next_grill_action = lambda: (30.0, "Parrilla_Pos2")
+    start = Prog1.clock.time()
+
+    assert app.staging_move("Parrilla_Pos2")
+    assert app.current_target == "Parrilla_Pos2"
+    assert app.staging_stats["staged"] == 1
+    assert Prog1.clock.time() - start >= app.robot.motion_time - 1e-6 > 0
+
+
+def test_staging_move_cancelled_when_next_action_changes(make_controller):
+    app = make_controller()
+    origin = list(app.robot.Pose().Pos())
+    goal = list(app.target_pose("Parrilla_Pos2").Pos())
+    polls = []
+
+    def next_action():
+        polls.append(Prog1.clock.time())
+        return (30.0, "Parrilla_Pos2" if len(polls) < 3 else "Parrilla_Pos3")
+
+    app.next_grill_action = next_action
+    assert not app.staging_move("Parrilla_Pos2")
+    assert app.staging_stats == dict(app.staging_stats, staged=0, cancelled=1)
+    assert not app.robot.Busy()
+    assert app.current_target is None
+    # Detenido a medio camino: ni en el origen ni en la aproximación
+    position = app.robot.Pose().Pos()
+    assert 0 < math.dist(origin, position) < math.dist(origin, goal)
@@ -0,0 +1,28 @@
+"""Deltas del servidor de estado (state_delta) y su aplicación en el visor (apply_delta)"""
+import copy
+
+from Prog1 import state_delta
+from hmi_client import apply_delta
+
+
+def test_delta_contains_only_changes():
+    previous = {"executing": False, "grill": [None, "A1"], "arepas": {"A1": {"state": 1}, "B1": {"state": 0}}}
+    current = {"executing": True, "grill": [None, "A1"], "arepas": {"A1": {"state": 2}, "B1": {"state": 0}}}
+    assert state_delta(previous, current) == {"executing": True, "arepas": {"A1": {"state": 2}}}
+    assert state_delta(current, current) == {}
+
+
+def test_dict_with_new_keys_is_sent_whole():
+    previous = {"orders": {"1": "queued"}}
+    current = {"orders": {"1": "queued", "2": "queued"}}
+    assert state_delta(previous, current) == current
+
+
+def test_apply_delta_rebuilds_current_state():
+    previous = {"executing": False, "status": "Listo", "arepas": {"A1": {"state": 1}, "B1": {"state": 0}},
+                "orders": {"1": "queued"}}
+    current = {"executing": True, "status": "Listo", "arepas": {"A1": {"state": 2}, "B1": {"state": 0}},
+               "orders": {"1": "done", "2": "queued"}, "queued": 1}
+    state = copy.deepcopy(previous)
+    apply_delta(state, state_delta(previous, current))
+    assert state == current
@@ -0,0 +1,19 @@
+"""Clave de la caché de trayectorias (estación + grill_layout + posiciones)"""
+from Prog1 import STATION_FILE_DEFAULT
+
+LAYOUT = {"first_slot": [400, -225, 50, 180, 0, 0], "pitch": [0, 150, 0]}
+
+
+def test_cache_key_follows_layout_and_slot_counts(make_controller):
+    app = make_controller({"grill_layout": LAYOUT})
+    assert app.grill_layout == LAYOUT
+    key = app.trajectory_cache_key(STATION_FILE_DEFAULT)
+    assert key == app.trajectory_cache_key(STATION_FILE_DEFAULT)
+
+    app.grill_layout = dict(LAYOUT, approach=80)
+    moved = app.trajectory_cache_key(STATION_FILE_DEFAULT)
+    assert moved != key
+
+    smaller = make_controller(grill_slots=3)
+    assert smaller.grill_layout == LAYOUT
+    assert smaller.trajectory_cache_key(STATION_FILE_DEFAULT) not in (key, moved)
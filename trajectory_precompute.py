@@ -0,0 +1,165 @@
+"""Precalcula y valida todos los segmentos de movimiento del controlador de arepas.
+
+Recorre cada segmento (origen, destino, tipo) que ArepaController puede emitir,
+ejecuta las pruebas de factibilidad de RoboDK (IK, colisiones, singularidades)
+y guarda trayectorias, duraciones y veredictos en la caché de trayectorias
+indexada por el hash del archivo de la estación, del grill_layout y de la
+cantidad de posiciones (ArepaController.trajectory_cache_key).
+"""
+import time
+import tkinter as tk
+
+from Prog1 import ArepaController, TrajectoryCache, ROBODK_AVAILABLE
+
+TRAJECTORY_PROGRAM_NAME = "_CacheTrayectorias"
+TRAJECTORY_MM_STEP = 5
+TRAJECTORY_DEG_STEP = 2
+
+
+def describe_status(status: int) -> str:
+    """Traduce el código de MoveL_Test/MoveJ_Test a un veredicto legible"""
+    if status == 0:
+        return "OK"
+    if status < 0:
+        return "Inalcanzable (singularidad o límites de ejes)"
+    return f"Colisión ({status} pares de objetos)"
+
+
+def solve_target_joints(robot, pose, seed):
+    """Resuelve las articulaciones de una pose cerca de seed; None si no hay solución IK"""
+    joints = robot.SolveIK(pose, seed, robot.PoseTool(), robot.PoseFrame())
+    if len(joints.list()) < len(robot.Joints().list()):
+        return None
+    return joints
+
+
+def test_segment(app: ArepaController, from_name: str, to_name: str, move_type: str, speed: float) -> dict:
+    """Prueba un segmento en RoboDK y devuelve la entrada de caché
+
+    Las poses salen de app.target_pose(): las paramétricas del grill_layout o,
+    si no hay, las de los targets de la estación.
+    """
+    RDK, robot = app.RDK, app.robot
+    entry = {
+        "from": from_name,
+        "to": to_name,
+        "move_type": move_type,
+        "feasible": False,
+        "status": None,
+        "verdict": "",
+        "duration": None,
+        "distance": None,
+        "trajectory": []
+    }
+
+    from_pose = app.target_pose(from_name)
+    to_pose = app.target_pose(to_name)
+    if from_pose is None or to_pose is None:
+        entry["verdict"] = "Target no encontrado"
+        return entry
+
+    joints_from = solve_target_joints(robot, from_pose, robot.Joints())
+    joints_to = solve_target_joints(robot, to_pose, joints_from) if joints_from is not None else None
+    if joints_from is None or joints_to is None:
+        entry["verdict"] = "Sin solución IK"
+        return entry
+
+    # Prueba de factibilidad (colisiones activas según la estación)
+    if move_type == "L":
+        status = robot.MoveL_Test(joints_from, to_pose)
+    else:
+        # Las rotaciones del volteo se ejecutan como MoveJ
+        status = robot.MoveJ_Test(joints_from, joints_to)
+
+    entry["status"] = status
+    entry["verdict"] = describe_status(status)
+    entry["feasible"] = status == 0
+    if not entry["feasible"]:
+        return entry
+
+    # Duración, distancia y trayectoria con un programa temporal
+    robot.setJoints(joints_from)
+    program = RDK.AddProgram(TRAJECTORY_PROGRAM_NAME, robot)
+    try:
+        program.setSpeed(speed)
+        program.MoveJ(joints_from)
+        if move_type == "L":
+            program.MoveL(to_pose)
+        else:
+            program.MoveJ(joints_to)
+
+        _, program_time, program_distance, valid_ratio, message = program.Update()
+        entry["duration"] = program_time
+        entry["distance"] = program_distance
+        if valid_ratio < 1.0:
+            entry["feasible"] = False
+            entry["verdict"] = message
+
+        _, joint_list, _ = program.InstructionListJoints(TRAJECTORY_MM_STEP, TRAJECTORY_DEG_STEP)
+        entry["trajectory"] = [[round(value, 4) for value in point]
+                               for point in joint_list.tr().rows]
+    finally:
+        program.Delete()
+
+    return entry
+
+
+def precompute(app: ArepaController) -> TrajectoryCache:
+    """Prueba todos los segmentos del controlador y guarda la caché"""
+    station_file = app.get_station_file()
+    cache = TrajectoryCache(app.trajectory_cache_key(station_file), station_file)
+    segments = app.enumerate_motion_segments()
+
+    print(f"Estación: {station_file}")
+    print(f"Segmentos a probar: {len(segments)}")
+
+    initial_joints = app.robot.Joints()
+    start = time.time()
+    try:
+        for i, (from_name, to_name, move_type) in enumerate(segments):
+            entry = test_segment(app, from_name, to_name, move_type, app.robot_speed)
+            cache.store(entry)
+            mark = "✓" if entry["feasible"] else "✗"
+            print(f"[{i+1}/{len(segments)}] {mark} {from_name} → {to_name} ({move_type}): {entry['verdict']}")
+    finally:
+        app.robot.setJoints(initial_joints)
+
+    cache.save()
+    print(f"Caché guardada en {TrajectoryCache.cache_path(cache.station_hash)} "
+          f"({time.time() - start:.1f} s)")
+    print(f"Inviables: {len(cache.infeasible_segments())}")
+    return cache
+
+
+def main():
+    """Función principal"""
+    print("=" * 40)
+    print("Precálculo de trayectorias - Parrilla Automática")
+    print("=" * 40)
+
+    if not ROBODK_AVAILABLE:
+        print("Error: se necesita RoboDK para probar los segmentos")
+        return
+
+    root = tk.Tk()
+    root.withdraw()
+    app = ArepaController(root)
+
+    # La conexión es en segundo plano: procesar eventos de Tk mientras termina
+    while not app.connection_done.is_set():
+        root.update()
+        time.sleep(0.05)
+
+    if app.robot is None:
+        print("Error: robot no inicializado")
+        root.destroy()
+        return
+
+    try:
+        precompute(app)
+    finally:
+        root.destroy()
+
+
+if __name__ == "__main__":
+    main()